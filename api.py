@@ -1,13 +1,42 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from app import calculate_loan_api, main
 from flasgger import Swagger, swag_from
 from flask_cors import CORS
-from utils import convert_df_fields
+from serialization import LAYOUTS, compress, dumps, parse_fields, project, to_native
+from cmc_fetcher import fetch_data_app, get_snapshot_version, on_snapshot_change
+from allocation_optimizer import (DEFAULT_MAX_LIQUIDATION_PROBABILITY, DEFAULT_MAX_WEIGHT, DEFAULT_MIN_WEIGHT,
+                                  OBJECTIVES, optimize_allocation)
+from factor_correlation import EXACT_CORRELATION_MAX_ASSETS, get_correlation_model
+from quote_table import rebuild_in_background
+from request_coalescing import SingleFlight, IdempotencyKeyConflict, loan_request_key
+from deadlines import StageFailed
+from llm_scheduler import PRIORITIES, scheduler
+from request_profiler import PROFILE_HEADER, authorized, folded, profile_store, profiled, should_profile
 
 app = Flask(__name__)
 CORS(app)  # 👈 Enables CORS for all routes
 swagger = Swagger(app)
 
+# Identical concurrent loan requests share one fetch -> correlation -> LLM run
+loan_flights = SingleFlight()
+
+
+@on_snapshot_change
+def rebuild_snapshot_caches(version, market_df):
+    """Start rebuilding this worker's quote table as soon as a new snapshot arrives."""
+    rebuild_in_background(market_df, version)
+
+
+def json_response(payload, layout="records"):
+    """Serialize ``payload`` in ``layout``, compressed as negotiated through Accept-Encoding."""
+    body = dumps(to_native(payload, layout))
+    body, encoding = compress(body, request.headers.get("Accept-Encoding", ""))
+    response = Response(body, mimetype="application/json")
+    response.headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
 
 @app.route("/api", methods=["GET"])
 def check_server():
@@ -25,10 +54,109 @@ def check_server():
     """
     return jsonify({"result": "Server is running"})
 
+@app.route("/api/llm-scheduler", methods=["GET"])
+def llm_scheduler_stats():
+    """LLM admission queue depth, wait times and shed count for this worker
+    ---
+    responses:
+      200:
+        description: Scheduler statistics
+    """
+    return jsonify(scheduler.stats())
+
+@app.route("/api/profiles", methods=["GET"])
+def list_profiles():
+    """Newest stored request profiles, without their stacks
+    ---
+    parameters:
+      - name: X-Profile-Token
+        in: header
+        type: string
+        required: true
+      - name: limit
+        in: query
+        type: integer
+        required: false
+    responses:
+      200:
+        description: Profile metadata (shared marks requests that only waited on another's run) and the functions with the most samples
+      403:
+        description: Missing or wrong profiling token
+    """
+    if not authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({"error": "Profiling token required"}), 403
+    return jsonify({"profiles": profile_store.list(request.args.get("limit", 50, type=int))})
+
+@app.route("/api/profiles/<profile_id>", methods=["GET"])
+def download_profile(profile_id):
+    """One stored request profile, as folded stacks (flamegraph.pl, speedscope) or JSON
+    ---
+    parameters:
+      - name: X-Profile-Token
+        in: header
+        type: string
+        required: true
+      - name: profile_id
+        in: path
+        type: string
+        required: true
+      - name: format
+        in: query
+        type: string
+        enum: [folded, json]
+        required: false
+    responses:
+      200:
+        description: The profile
+      403:
+        description: Missing or wrong profiling token
+      404:
+        description: No such profile
+    """
+    if not authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({"error": "Profiling token required"}), 403
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        return jsonify({"error": f"No profile {profile_id!r}"}), 404
+    if request.args.get("format") == "json":
+        return jsonify(profile)
+    response = Response(folded(profile), mimetype="text/plain")
+    response.headers["Content-Disposition"] = f"attachment; filename={profile_id}.folded"
+    return response
+
 @app.route("/api/calculate-loan", methods=["POST"])
 @swag_from({
     'tags': ['Loan Calculation'],
     'parameters': [
+        {
+            'name': 'Idempotency-Key',
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'Retries sent with the same key attach to the running calculation'
+        },
+        {
+            'name': PROFILE_HEADER,
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'Profiling token; the request is profiled and X-Profile-Id names the stored profile'
+        },
+        {
+            'name': 'fields',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Comma-separated dotted paths inside result to return, e.g. aetherum_loan_details.total_loan,loan_metrics.weighted_ltv'
+        },
+        {
+            'name': 'layout',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['records', 'columnar'],
+            'required': False,
+            'description': 'records (default) or columnar, which returns tables as {column: [values]}'
+        },
         {
             'name': 'body',
             'in': 'body',
@@ -40,7 +168,8 @@ def check_server():
                     'months': {'type': 'integer', 'example': 6},
                     'payout': {'type': 'string', 'example': "USDC"},
                     'inception_date': {'type': 'string', 'example': '2024-01-01'},
-                    'bank': {'type': 'string', 'example': 'American Bank'}
+                    'bank': {'type': 'string', 'example': 'American Bank'},
+                    'priority': {'type': 'string', 'enum': ['interactive', 'batch'], 'example': 'interactive'}
                 }
             }
         }
@@ -53,11 +182,15 @@ def check_server():
                 'properties': {
                     'aetherum_loan_details': {'type': 'string'},
                     'agent_response': {'type': 'string'},
-                    'loan_metrics': {'type': 'string'}
+                    'loan_metrics': {'type': 'string'},
+                    'degraded': {'type': 'boolean'},
+                    'deadline': {'type': 'object'}
                 }
             }
         },
-        400: {'description': 'Missing required fields'},
+        400: {'description': 'Missing or non-numeric fields, unknown layout or priority'},
+        422: {'description': 'Idempotency key reused with different inputs'},
+        503: {'description': 'No market data could be loaded within the request deadline'},
         500: {'description': 'Internal server error'}
     }
 })
@@ -74,10 +207,137 @@ def calculate_loan():
     if not all([totalPortfolioValue, listOfSelectedTokens, months, payout, inception_date, bank]):
         return jsonify({"error": "Missing required fields"}), 400
 
-    result = calculate_loan_api(totalPortfolioValue, listOfSelectedTokens, months, payout, inception_date, bank)
-    result = convert_df_fields(result)
-    
-    return jsonify({'description': 'Loan calculation successful', "result": result})
+    try:
+        totalPortfolioValue, months = float(totalPortfolioValue), int(months)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Numeric fields must be numbers"}), 400
+
+    priority = data.get("priority", "interactive")
+    if priority not in PRIORITIES:
+        return jsonify({"error": f"Unknown priority {priority!r}, expected one of {', '.join(PRIORITIES)}"}), 400
+
+    layout = request.args.get("layout", "records")
+    if layout not in LAYOUTS:
+        return jsonify({"error": f"Unknown layout {layout!r}, expected one of {', '.join(LAYOUTS)}"}), 400
+
+    def compute():
+        return calculate_loan_api(totalPortfolioValue, listOfSelectedTokens, months, payout, inception_date, bank, PRIORITIES[priority])
+
+    inputs = (totalPortfolioValue, listOfSelectedTokens, months, payout, inception_date, bank)
+    with profiled(should_profile(request.headers), route=request.path, tokens=listOfSelectedTokens,
+                  months=months) as profile:
+        try:
+            result, shared = loan_flights.do(
+                loan_request_key(*inputs, snapshot_version=get_snapshot_version(), priority=priority),
+                compute,
+                idempotency_key=request.headers.get("Idempotency-Key"),
+                fingerprint=loan_request_key(*inputs),
+            )
+            # A coalesced follower or idempotent replay only waited on another request's run
+            profile.tag(shared=shared)
+        except IdempotencyKeyConflict as e:
+            return jsonify({"error": str(e)}), 422
+        except StageFailed as e:
+            return jsonify({"error": str(e)}), 503
+
+    result = project(result, parse_fields(request.args.get("fields")))
+    response = json_response({'description': 'Loan calculation successful', "result": result}, layout)
+    if profile.id:
+        response.headers["X-Profile-Id"] = profile.id
+    return response
+
+@app.route("/api/optimize-allocation", methods=["POST"])
+@swag_from({
+    'tags': ['Loan Calculation'],
+    'parameters': [
+        {
+            'name': 'layout',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['records', 'columnar'],
+            'required': False,
+            'description': 'records (default) or columnar, which returns tables as {column: [values]}'
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'required': ['totalPortfolioValue', 'listOfSelectedTokens', 'months'],
+                'properties': {
+                    'totalPortfolioValue': {'type': 'number', 'example': 100000},
+                    'listOfSelectedTokens': {'type': 'array', 'items': {'type': 'string'},
+                                             'example': ['BTC', 'ETH', 'SOL']},
+                    'months': {'type': 'integer', 'example': 6},
+                    'objective': {'type': 'string', 'enum': list(OBJECTIVES), 'example': 'max_loan'},
+                    'rule_set': {'type': 'string', 'enum': ['quantile', 'threshold'], 'example': 'quantile'},
+                    'max_weight': {'type': 'number', 'example': DEFAULT_MAX_WEIGHT},
+                    'min_weight': {'type': 'number', 'example': DEFAULT_MIN_WEIGHT},
+                    'max_liquidation_probability': {'type': 'number', 'example': 0.6,
+                                                    'description': 'defaults to the equal-weight split\'s probability'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {'description': 'Best allocation found, with the equal-weight split for comparison'},
+        400: {'description': 'Missing or invalid fields, or weight bounds no allocation can meet'},
+        422: {'description': 'No allocation meets max_liquidation_probability; the result holds the closest one'},
+        500: {'description': 'Internal server error'}
+    }
+})
+def optimize_allocation_route():
+    data = request.json
+    totalPortfolioValue = data.get("totalPortfolioValue")
+    listOfSelectedTokens = data.get("listOfSelectedTokens")
+    months = data.get("months")
+
+    if not all([totalPortfolioValue, listOfSelectedTokens, months]):
+        return jsonify({"error": "Missing required fields"}), 400
+    if not isinstance(listOfSelectedTokens, list) or not all(
+            isinstance(token, str) and token for token in listOfSelectedTokens):
+        return jsonify({"error": "listOfSelectedTokens must be a non-empty list of token symbols"}), 400
+
+    layout = request.args.get("layout", "records")
+    if layout not in LAYOUTS:
+        return jsonify({"error": f"Unknown layout {layout!r}, expected one of {', '.join(LAYOUTS)}"}), 400
+
+    try:
+        total_value, months = float(totalPortfolioValue), int(months)
+        options = {
+            "objective": data.get("objective", "max_loan"),
+            "rule_set": data.get("rule_set", "quantile"),
+            "max_weight": float(data.get("max_weight", DEFAULT_MAX_WEIGHT)),
+            "min_weight": float(data.get("min_weight", DEFAULT_MIN_WEIGHT)),
+            "max_liquidation_probability": data.get("max_liquidation_probability", DEFAULT_MAX_LIQUIDATION_PROBABILITY),
+        }
+        if options["max_liquidation_probability"] is not None:
+            options["max_liquidation_probability"] = float(options["max_liquidation_probability"])
+    except (TypeError, ValueError):
+        return jsonify({"error": "Numeric fields must be numbers"}), 400
+
+    market_df = fetch_data_app()
+    correlation_model = None
+    if len(listOfSelectedTokens) > EXACT_CORRELATION_MAX_ASSETS:
+        correlation_model = get_correlation_model()
+    try:
+        result = optimize_allocation(market_df, listOfSelectedTokens, total_value, months,
+                                     correlation_model=correlation_model, **options)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not result["feasible"]:
+        response = json_response({
+            "error": (f"No allocation keeps the liquidation probability within "
+                      f"{options['max_liquidation_probability']:.0%}; the lowest found is "
+                      f"{result['best']['liquidation_probability']:.0%}"),
+            "result": result,
+        }, layout)
+        response.status_code = 422
+        return response
+
+    return json_response({'description': 'Allocation optimization successful', "result": result}, layout)
 
 if __name__ == "__main__":
     app.run(port=5000)
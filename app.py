@@ -1,12 +1,19 @@
 from dotenv import load_dotenv
 import streamlit as st
-from agent import run_finance_agent
+from agent import build_research_agent, deterministic_result, research_agent_resources, run_finance_agent
 import os
 import pandas as pd
+import numpy as np
 import json
 from portfolios import SAMPLE_PORTFOLIOS
 import datetime
-from cmc_fetcher import fetch_data_app
+from cmc_fetcher import fetch_data_app, get_snapshot_version, last_market_data
+from coingecko_fetcher import get_crypto_correlation_matrix
+from pricing_engine import PricingContext, evaluate, threshold_tier_rules
+from quote_table import cached_correlation_matrix, lookup_quotes
+from deadlines import Deadline, StageFailed
+from factor_correlation import EXACT_CORRELATION_MAX_ASSETS, get_correlation_model
+from llm_scheduler import PRIORITY_INTERACTIVE
 
 load_dotenv()
 
@@ -19,78 +26,47 @@ def fetch_data():
     return fetch_data_app()
 
 
+# Display formats for the numeric columns of the asset-based loan breakdown
+LOAN_BREAKDOWN_FORMATS = {
+    "24h Vol (%)": "{:.2f}",
+    "Collateral ($)": "${:,.2f}",
+    "Loan Amount ($)": "${:,.2f}",
+}
+
+
 # -------- LOGIC from loan_calc4.py: LTV & INTEREST RULES --------
-def classify_risk(symbol, vol, mcap):
-    """Classify asset risk into tiers based on volatility and market cap."""
-    if vol < 3 and mcap > 1e10:
-        return "Tier 1"
-    elif vol < 6 and mcap > 5e9:
-        return "Tier 1.5"
-    elif vol < 10:
-        return "Tier 2"
-    else:
-        return "Tier 3"
-
-def ltv_by_risk(tier, vol):
-    """Determine Loan-to-Value (LTV) based on risk tier and volatility."""
-    base = {'Tier 1': 70, 'Tier 1.5': 65, 'Tier 2': 55, 'Tier 3': 45}
-    adj = 0
-    if vol > 7:
-        adj = -5
-    elif vol < 2:
-        adj = +2
-    return max(0, base.get(tier, 50) + adj)
-
-def interest_by_risk(tier, vol):
-    """Determine interest rate based on risk tier and volatility."""
-    base_rate = 3.0  # Base risk-free rate
-    premium = {'Tier 1': 4, 'Tier 1.5': 4.5, 'Tier 2': 5, 'Tier 3': 6}
-    adj = 1 if vol > 10 else 0
-    return base_rate + premium.get(tier, 5) + adj
-
-def calculate_aetherum_loan(allocations, selected_tokens, user_portfolio, df, months, should_show_df_result=True):
-    """Calculate loan metrics based on the rules from loan_calc4.py."""
-    results = []
-    total_collateral = 0
-    total_loan = 0
-    total_interest_amount = 0
-
-    for symbol in selected_tokens:
-        if symbol not in df['Symbol'].values:
-            continue
-
-        coin = df[df['Symbol'] == symbol].iloc[0]
-        vol = abs(coin['24h Change (%)'])
-        mcap = coin['Market Cap']
-        portfolio_amount = user_portfolio.get(symbol, 0)
-
-        tier = classify_risk(symbol, vol, mcap)
-        ltv = ltv_by_risk(tier, vol)
-        interest = interest_by_risk(tier, vol)
-        loan_amount = portfolio_amount * ltv / 100
-        interest_amount = loan_amount * interest / 100
-
-        results.append({
+# The tier, LTV and interest tables live in pricing_engine.threshold_tier_rules.
+def calculate_aetherum_loan(allocations, selected_tokens, user_portfolio, df, months, should_show_df_result=True, quote=None):
+    """Calculate loan metrics based on the rules from loan_calc4.py.
+
+    ``quote`` is a precomputed ``threshold_tier_rules`` result; when omitted it
+    is priced from ``df``.
+    """
+    if quote is None:
+        portfolio = {symbol: user_portfolio.get(symbol, 0) for symbol in selected_tokens}
+        quote = threshold_tier_rules(PricingContext(df, portfolio))
+
+    results = [
+        {
             "Asset": symbol,
-            "Risk Tier": tier,
-            "24h Vol (%)": f"{vol:.2f}",
-            "LTV (%)": ltv,
-            "Interest Rate (%)": interest,
-            "Collateral ($)": f"${portfolio_amount:,.2f}",
-            "Loan Amount ($)": f"${loan_amount:,.2f}",
+            "Risk Tier": quote["tiers"][i],
+            "24h Vol (%)": float(quote["volatility"][i]),
+            "LTV (%)": round(float(quote["ltv"][i]) * 100, 6),
+            "Interest Rate (%)": round(float(quote["interest_rate"][i]) * 100, 6),
+            "Collateral ($)": float(quote["amounts"][i]),
+            "Loan Amount ($)": float(quote["loan_amounts"][i]),
             "allocation": allocations[symbol]
-        })
-
-        total_collateral += portfolio_amount
-        total_loan += loan_amount
-        total_interest_amount += interest_amount
-
+        }
+        for i, symbol in enumerate(quote["symbols"])
+    ]
     df_result = pd.DataFrame(results)
 
+    total_collateral = quote["total_collateral"]
+    total_loan = quote["total_loan"]
     if total_collateral > 0 and total_loan > 0:
-        portfolio_ltv = (total_loan / total_collateral) * 100
-        weighted_interest = (total_interest_amount / total_loan) * 100
-        liquidation_ltv = portfolio_ltv * 1.2
+        portfolio_ltv = quote["weighted_ltv"] * 100
+        weighted_interest = quote["weighted_interest"] * 100
+        liquidation_ltv = quote["liquidation_ltv"] * 100
         expense_ratio = 0.05  # Fixed 5% from loan_calc4.py
         emi = (total_loan * (1 + weighted_interest / 100)) / months
     else:
@@ -113,7 +89,37 @@ def calculate_aetherum_loan(allocations, selected_tokens, user_portfolio, df, mo
 
     return summary
 
-def calculate_loan_api(totalPortfolioValue, listOfSelectedTokens, months, payout, inception_date, bank):
+def load_correlation_matrix(symbols, deadline):
+    """Correlations of ``symbols`` within the correlation budget.
+
+    Late or missing history falls back to the quote table's matrix, and to
+    unknown correlations (None) when that doesn't cover the portfolio.
+    """
+    matrix = deadline.run("correlation", lambda: get_crypto_correlation_matrix(symbols),
+                          fallback=lambda: cached_correlation_matrix(symbols))
+    return matrix if matrix is not None else cached_correlation_matrix(symbols)
+
+
+def note_missing_correlations(quote, deadline):
+    """Mark the correlation stage degraded when ``quote`` priced assets without a correlation.
+
+    Checked on the quote itself so that the quote table and the engine
+    report the same portfolio the same way.
+    """
+    if len(quote["symbols"]) < 2 or "correlation" in deadline.degraded:
+        return
+    missing = [symbol for symbol, average in zip(quote["symbols"], quote["average_correlation"]) if np.isnan(average)]
+    if missing:
+        deadline.degrade("correlation", f"no price history for {', '.join(missing)}")
+
+
+def calculate_loan_api(totalPortfolioValue, listOfSelectedTokens, months, payout, inception_date, bank, priority=PRIORITY_INTERACTIVE, deadline=None):
+    """Quote a loan with both calculators within ``deadline`` (a new ``Deadline`` by default).
+
+    Stages that run out of time fall back and are listed under
+    ``deadline.degraded_stages``; ``degraded`` is set when any did.
+    """
+    deadline = Deadline() if deadline is None else deadline
     
     # TOTAL_PORTFOLIO_VALUE = 1_000_000  # Fixed $1M total portfolio value
     TOTAL_PORTFOLIO_VALUE = totalPortfolioValue
@@ -121,7 +127,9 @@ def calculate_loan_api(totalPortfolioValue, listOfSelectedTokens, months, payout
     portfolio_type = "Custom"
 
     # --- Real-time Crypto Data ---
-    market_df = fetch_data()
+    market_df = deadline.run("market", fetch_data, fallback=last_market_data)
+    if market_df is None:
+        raise StageFailed("market", deadline.degraded["market"])
     if market_df.empty:
         raise Exception("Error while fetching market data.")
 
@@ -170,7 +178,32 @@ def calculate_loan_api(totalPortfolioValue, listOfSelectedTokens, months, payout
         - Inception Date: {inception_date}
         - Bank: {bank}
         """
-        agent_response, loan_metrics = run_finance_agent(prompt, allocations)
+        # Common shapes come from the per-snapshot quote table; anything else is
+        # priced once by the engine and shared by both calculators
+        snapshot_version = get_snapshot_version()
+        quotes = deadline.timed("pricing", lambda: lookup_quotes(user_portfolio, market_df, snapshot_version))
+        if quotes is None:
+            # Index-like baskets use the stored factor model instead of a k x k matrix
+            correlation_model = None
+            if len(user_portfolio) > EXACT_CORRELATION_MAX_ASSETS:
+                correlation_model = get_correlation_model()
+            ctx = PricingContext(market_df, user_portfolio, correlation_model=correlation_model)
+            if not ctx.uses_factor_model:
+                ctx.correlation_matrix = load_correlation_matrix(ctx.symbols, deadline)
+            # Every response needs a quote, so pricing is timed but never skipped
+            quotes = deadline.timed("pricing", lambda: evaluate(ctx))
+        note_missing_correlations(quotes["quantile"], deadline)
+
+        # The agent may only wait for the scheduler as long as the stage can
+        analysis_budget = deadline.budget("analysis")
+        agent_response, loan_metrics = deadline.run(
+            "analysis",
+            lambda: run_finance_agent(prompt, allocations, market_df=market_df, quote=quotes["quantile"],
+                                      priority=priority, timeout=analysis_budget),
+            fallback=lambda: deterministic_result(quotes["quantile"], user_portfolio, allocations),
+        )
+        if loan_metrics.get("analysis_source") == "deterministic" and "analysis" not in deadline.degraded:
+            deadline.degrade("analysis", "shed by the LLM scheduler")
         
         # if ~isinstance(loan_metrics, dict):
         #     raise Exception("Failed to calculate loan metrics from AI Agent.")
@@ -178,7 +211,7 @@ def calculate_loan_api(totalPortfolioValue, listOfSelectedTokens, months, payout
         ###
 
         # --- Aetherum (Hard-coded Rules) Loan Calculation ---
-        aetherum_loan_details = calculate_aetherum_loan(allocations, selected_tokens, user_portfolio, market_df, months, False)
+        aetherum_loan_details = calculate_aetherum_loan(allocations, selected_tokens, user_portfolio, market_df, months, False, quote=quotes["threshold"])
 
         length = "1 month" if months == 1 else f"{months} months"
 
@@ -188,31 +221,96 @@ def calculate_loan_api(totalPortfolioValue, listOfSelectedTokens, months, payout
             "aetherum_loan_details": aetherum_loan_details,
             "loan_length": length,
             "loan_frequency": "monthly",
+            "degraded": bool(deadline.degraded),
+            "deadline": deadline.report(),
         }
 
+# -------- Streamlit caching: every widget interaction reruns the script --------
+MARKET_DATA_TTL_SECONDS = 300
+SNAPSHOT_VERSION_TTL_SECONDS = 30
+
+
+@st.cache_data(ttl=SNAPSHOT_VERSION_TTL_SECONDS, show_spinner=False)
+def cached_snapshot_version():
+    """Snapshot version, re-read from Redis at most every SNAPSHOT_VERSION_TTL_SECONDS."""
+    return get_snapshot_version()
+
+
+@st.cache_data(ttl=MARKET_DATA_TTL_SECONDS, show_spinner="Fetching market data...")
+def load_market_data(snapshot_version):
+    """Market snapshot for ``snapshot_version``; the version is only used as the cache key."""
+    return fetch_data()
+
+
+@st.cache_resource
+def get_research_resources():
+    """The research agent's model client and tools, shared by all sessions of this server."""
+    return research_agent_resources()
+
+
+def get_research_agent():
+    """This session's research agent, built once on the shared model client and tools.
+
+    An agent keeps the state of its runs, so sessions don't share one.
+    """
+    if "research_agent" not in st.session_state:
+        model, tools = get_research_resources()
+        st.session_state.research_agent = build_research_agent(model=model, tools=tools)
+    return st.session_state.research_agent
+
+
+@st.cache_data(ttl=MARKET_DATA_TTL_SECONDS, show_spinner="Running Aetherum AI agent...")
+def quote_agent_loan(prompt, allocations, snapshot_version, _research_agent):
+    """Memoized agent quote for one set of loan inputs on one market snapshot.
+
+    ``_research_agent`` is left out of the cache key: any session's agent gives the same quote.
+    """
+    market_df = load_market_data(snapshot_version)
+    return run_finance_agent(prompt, allocations, research_agent=_research_agent, market_df=market_df)
+
+
+@st.cache_data(ttl=MARKET_DATA_TTL_SECONDS, show_spinner=False)
+def quote_aetherum_loan(allocations, selected_tokens, user_portfolio, months, snapshot_version):
+    """Memoized hard-coded rules quote for one set of loan inputs on one market snapshot."""
+    market_df = load_market_data(snapshot_version)
+    return calculate_aetherum_loan(allocations, selected_tokens, user_portfolio, market_df, months)
+
+
 def main():
     st.title("Finance Agent Streamlit App")
-    
-    TOTAL_PORTFOLIO_VALUE = 1_000_000  # Fixed $1M total portfolio value
-    
-    st.header("Portfolio Selection")
-    portfolio_type = st.selectbox(
-        "Select Portfolio Type",
-        ["Custom"] + list(SAMPLE_PORTFOLIOS.keys()),
-        index=0
-    )
+
+    snapshot_version = cached_snapshot_version()
 
     # --- Real-time Crypto Data ---
     st.header("Real-Time Crypto Market Data")
-    market_df = fetch_data()
+    market_df = load_market_data(snapshot_version)
     if not market_df.empty:
         st.dataframe(market_df)
     else:
         st.info("Could not fetch market data.")
 
+    loan_section(market_df, snapshot_version)
+
+
+@st.fragment
+def loan_section(market_df, snapshot_version):
+    """Portfolio selection, loan form and results.
+
+    Runs as a fragment so widget interactions rerun only this section and
+    leave the market table above untouched.
+    """
+    TOTAL_PORTFOLIO_VALUE = 1_000_000  # Fixed $1M total portfolio value
+
+    st.header("Portfolio Selection")
+    portfolio_type = st.selectbox(
+        "Select Portfolio Type",
+        ["Custom"] + list(SAMPLE_PORTFOLIOS.keys()),
+        index=0
+    )
+
     # Update portfolio based on selection
     if portfolio_type == "Custom":
-        available_tokens = market_df['Symbol'].tolist()
+        available_tokens = market_df['Symbol'].tolist() if not market_df.empty else []
         selected_tokens = st.multiselect(
             "Select tokens for your portfolio:",
             available_tokens,
@@ -239,6 +337,10 @@ def main():
     else:
         user_portfolio = SAMPLE_PORTFOLIOS[portfolio_type]
         selected_tokens = list(user_portfolio.keys())
+        allocations = {
+            token: amount / TOTAL_PORTFOLIO_VALUE * 100
+            for token, amount in user_portfolio.items()
+        }
         st.info(f"Using pre-defined {portfolio_type} portfolio.")
 
     # Display selected portfolio
@@ -280,7 +382,7 @@ def main():
             - Inception Date: {inception_date}
             - Bank: {bank}
             """
-            agent_response, loan_metrics = run_finance_agent(prompt, allocations)
+            agent_response, loan_metrics = quote_agent_loan(prompt, allocations, snapshot_version, get_research_agent())
             
             st.header("Aetherum AI Agent Loan Calculator")
             if isinstance(loan_metrics, dict):
@@ -300,10 +402,10 @@ def main():
 
             # --- Aetherum (Hard-coded Rules) Loan Calculation ---
             st.header("Aetherum Loan")
-            aetherum_loan_details = calculate_aetherum_loan(allocations, selected_tokens, user_portfolio, market_df, months)
+            aetherum_loan_details = quote_aetherum_loan(allocations, selected_tokens, user_portfolio, months, snapshot_version)
 
             st.subheader("Asset-Based Loan Breakdown")
-            st.dataframe(aetherum_loan_details["df_result"])
+            st.dataframe(aetherum_loan_details["df_result"].style.format(LOAN_BREAKDOWN_FORMATS))
 
             st.subheader("Final Loan Details")
             st.write(f"**Total Collateral Selected:** ${aetherum_loan_details['total_collateral']:,.2f}")
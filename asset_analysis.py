@@ -0,0 +1,228 @@
+"""Per-asset market analysis pre-warmed after each market refresh.
+
+Writing the market insights section is the slow part of a quote: the
+research agent searches the news for every coin in the portfolio, on every
+request. Instead, the refresher (``python cmc_fetcher.py``) asks the agent for
+a short section on each of the top collateral tokens once per snapshot and
+stores it in Redis. ``run_finance_agent`` then stitches the cached sections
+for the portfolio's coins together with the deterministic figures, without a
+model call, or with one short call (no tools) when
+``ASSET_ANALYSIS_COMPOSE_WITH_MODEL`` is set. The figures always come from
+the live quote and sections are told not to repeat prices, so the newest
+section of each coin is used while it is younger than
+``ASSET_ANALYSIS_MAX_AGE_SECONDS``, whichever snapshot it was written for.
+
+The refresher is a process of its own and can't see the workers' LLM
+queues. Its runs are paced by a separate ``ASSET_ANALYSIS_TOKENS_PER_MINUTE``
+budget, which is left out of the workers' ``LLM_TOKENS_PER_MINUTE``.
+"""
+import json
+import os
+import threading
+import time
+
+import redis
+
+from cmc_fetcher import REFRESH_INTERVAL_SECONDS, r
+from llm_scheduler import PRIORITY_BATCH, LLMScheduler, QueueFull, estimate_tokens, scheduler, usage_tokens
+
+ASSET_ANALYSIS_TOP_N = int(os.getenv("ASSET_ANALYSIS_TOP_N", "10"))
+# Sections older than this are not used; the TTL just clears out old ones
+ASSET_ANALYSIS_MAX_AGE_SECONDS = int(os.getenv("ASSET_ANALYSIS_MAX_AGE_SECONDS", "1800"))
+ASSET_ANALYSIS_TTL_SECONDS = int(os.getenv("ASSET_ANALYSIS_TTL_SECONDS", "3600"))
+ASSET_ANALYSIS_TOKENS_PER_MINUTE = int(os.getenv("ASSET_ANALYSIS_TOKENS_PER_MINUTE", "600"))
+ASSET_ANALYSIS_COMPOSE_WITH_MODEL = os.getenv("ASSET_ANALYSIS_COMPOSE_WITH_MODEL", "").lower() in ("1", "true", "yes")
+
+# Expected answer sizes, used for the scheduler's token estimates
+SECTION_OUTPUT_TOKENS = 300
+COMPOSE_OUTPUT_TOKENS = 400
+
+# Section headings of the agent's expected output
+INSIGHTS_HEADING = "**Insights into the current market conditions**"
+INTEREST_HEADING = "**Interest rate determined based on the current market conditions**"
+
+_KEY_PREFIX = "ASSET_ANALYSIS:"
+_warm_lock = threading.Lock()
+
+# The refresher's own budget; one run at a time, each waiting up to a refresh interval
+warm_scheduler = LLMScheduler(
+    max_concurrency=1, tokens_per_minute=ASSET_ANALYSIS_TOKENS_PER_MINUTE, queue_timeout=REFRESH_INTERVAL_SECONDS
+)
+
+
+def build_asset_analyst():
+    """Create the agent that writes one short market section per asset."""
+    from agno.models.groq import Groq
+    from agno.agent import Agent
+    from agno.tools.duckduckgo import DuckDuckGoTools
+    from agno.tools.newspaper4k import Newspaper4kTools
+    from textwrap import dedent
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    return Agent(
+        model=Groq(id="llama3-70b-8192"),
+        tools=[DuckDuckGoTools(), Newspaper4kTools()],
+        description="You are a professional crypto financial analyst.",
+        instructions=dedent("""
+            Search the latest news for the given coin and summarize its current market
+            conditions in 3 to 5 sentences, using the market data provided.
+            Do not repeat prices or percentage changes, and do not give investment
+            advice or any loan, LTV or interest rate figures.
+        """),
+        markdown=True,
+        add_datetime_to_instructions=True,
+    )
+
+
+def build_composer():
+    """Create the tool-less agent that merges cached sections for one portfolio."""
+    from agno.models.groq import Groq
+    from agno.agent import Agent
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    return Agent(
+        model=Groq(id="llama3-70b-8192"),
+        description="You are a professional crypto financial analyst.",
+        instructions=(
+            "Condense the per-coin notes into one short overview of the market conditions "
+            "for this portfolio. Do not change any of the figures you are given."
+        ),
+        markdown=True,
+    )
+
+
+def _section_prompt(row):
+    return (
+        f"Coin: {row['Name']} ({row['Symbol']})\n"
+        f"Price: ${row['Last Price']:,.4f}\n"
+        f"Change 24h / 7d / 30d / 90d (%): {row['24h Change (%)']:.2f} / {row['7d Change (%)']:.2f} / "
+        f"{row['30d Change (%)']:.2f} / {row['90d Change (%)']:.2f}\n"
+        f"Market cap: ${row['Market Cap']:,.0f}"
+    )
+
+
+def warm_asset_analyses(market_df, snapshot_version, top_n=ASSET_ANALYSIS_TOP_N, analyst=None):
+    """Generate and store a section for each of the ``top_n`` tokens in ``market_df``.
+
+    Runs are paced by ``warm_scheduler``, within the refresher's
+    ``ASSET_ANALYSIS_TOKENS_PER_MINUTE``; a run it sheds leaves that symbol
+    with its previous section, if any. Sections younger than half of
+    ``ASSET_ANALYSIS_MAX_AGE_SECONDS`` are kept as they are, so the budget
+    goes to the stale ones. Returns the symbols that were refreshed.
+    """
+    if analyst is None:
+        analyst = build_asset_analyst()
+
+    rows = market_df.drop_duplicates('Symbol').head(top_n)
+    fresh = get_asset_analyses(rows['Symbol'], max_age_seconds=ASSET_ANALYSIS_MAX_AGE_SECONDS / 2)
+    warmed = []
+    for _, row in rows[~rows['Symbol'].isin(fresh)].iterrows():
+        prompt = _section_prompt(row)
+        estimated_tokens = estimate_tokens(prompt, SECTION_OUTPUT_TOKENS)
+        try:
+            response, _ = warm_scheduler.run(lambda: analyst.run(prompt), estimated_tokens)
+        except QueueFull as e:
+            print(f"Skipped warming {row['Symbol']}: {e}")
+            continue
+        used_tokens = usage_tokens(response)
+        if used_tokens is not None:
+            warm_scheduler.charge(used_tokens - estimated_tokens)
+
+        section = {
+            "symbol": row['Symbol'],
+            "analysis": getattr(response, "content", str(response)).strip(),
+            "snapshot_version": snapshot_version,
+            "generated_at": time.time(),
+        }
+        r.set(f"{_KEY_PREFIX}{row['Symbol']}", json.dumps(section), ex=ASSET_ANALYSIS_TTL_SECONDS)
+        warmed.append(row['Symbol'])
+    return warmed
+
+
+def warm_in_background(market_df, snapshot_version):
+    """Refresh hook: warm the sections in a thread unless a warm-up is still running."""
+    if not _warm_lock.acquire(blocking=False):
+        print(f"Asset analysis warm-up still running, skipping snapshot {snapshot_version}")
+        return
+
+    def _run():
+        try:
+            warmed = warm_asset_analyses(market_df, snapshot_version)
+            print(f"Warmed asset analysis for {', '.join(warmed) or 'no symbols'} on snapshot {snapshot_version}")
+        except Exception as e:
+            print(f"Error warming asset analysis for snapshot {snapshot_version}: {e}")
+        finally:
+            _warm_lock.release()
+
+    threading.Thread(target=_run, name="asset-analysis-warm", daemon=True).start()
+
+
+def get_asset_analyses(symbols, max_age_seconds=ASSET_ANALYSIS_MAX_AGE_SECONDS):
+    """The newest cached section of each of ``symbols``, keyed by symbol.
+
+    Missing sections, and those older than ``max_age_seconds``, are left out.
+    """
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    try:
+        cached = r.mget([f"{_KEY_PREFIX}{symbol}" for symbol in symbols])
+    except redis.RedisError as e:
+        print(f"Error reading asset analysis: {e}")
+        return {}
+    oldest = time.time() - max_age_seconds
+    sections = {}
+    for symbol, raw in zip(symbols, cached):
+        if raw:
+            section = json.loads(raw)
+            if section["generated_at"] >= oldest:
+                sections[symbol] = section["analysis"]
+    return sections
+
+
+def compose_analysis(sections, quote, composer=None, priority=PRIORITY_BATCH):
+    """Answer in the agent's output format from cached sections and the quote.
+
+    Without ``composer`` the sections are listed as they are; with one, a
+    single short model call condenses them, falling back to the plain listing
+    if the scheduler sheds it.
+    """
+    insights = "\n\n".join(f"**{symbol}**: {sections[symbol]}" for symbol in quote["symbols"])
+    if composer is not None:
+        prompt = f"Per-coin notes:\n\n{insights}"
+        estimated_tokens = estimate_tokens(prompt, COMPOSE_OUTPUT_TOKENS)
+        try:
+            response, _ = scheduler.run(lambda: composer.run(prompt), estimated_tokens, priority=priority)
+            used_tokens = usage_tokens(response)
+            if used_tokens is not None:
+                scheduler.charge(used_tokens - estimated_tokens)
+            insights = getattr(response, "content", str(response)).strip()
+        except QueueFull as e:
+            print(f"Compose run shed, listing cached sections as they are: {e}")
+
+    return format_analysis(insights, quote)
+
+
+def format_analysis(insights, quote):
+    """The agent's two-section answer, with the interest section built from ``quote``."""
+    rows = "\n".join(
+        f"- {symbol}: {tier or 'Untiered'} at {rate:.2%}"
+        for symbol, tier, rate in zip(quote["symbols"], quote["tiers"], quote["interest_rate"])
+    )
+    return (
+        f"{INSIGHTS_HEADING}\n\n"
+        f"{insights}\n\n"
+        f"{INTEREST_HEADING}\n\n"
+        f"{rows}\n\n"
+        f"Weighted interest rate: {quote['weighted_interest']:.2%}"
+    )
+
+
+def insights_section(analysis):
+    """The market insights text of an answer, without either heading."""
+    insights = analysis.split(INTEREST_HEADING, 1)[0]
+    return insights.replace(INSIGHTS_HEADING, "", 1).strip()
@@ -0,0 +1,213 @@
+"""Historical backtest of the LTV policies in ``pricing_engine``.
+
+For every day in a market panel and every portfolio, a hypothetical loan is
+originated under each policy and followed for ``horizon_days``. The loan is
+liquidated on the first day its LTV, including accrued interest, reaches the
+policy's liquidation LTV; any shortfall of collateral against debt on that day
+is a loss. All dates and portfolios are evaluated together as arrays, so
+years of daily data run in well under a second per policy.
+
+Usage::
+
+    python backtest.py --snapshots snapshots --horizon 90
+    python backtest.py --fetch-days 365 --horizon 30
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from pricing_engine import (
+    LIQUIDATION_MULTIPLIER,
+    quantile_policy_interest,
+    quantile_policy_ltv,
+    quantile_tier_codes,
+    threshold_policy_interest,
+    threshold_policy_ltv,
+    threshold_tier_codes,
+    volatility_score,
+)
+
+POLICIES = ("quantile", "threshold")
+
+# Days of prices the correlation adjustment looks back over, as in get_crypto_correlation_matrix
+CORRELATION_WINDOW_DAYS = 90
+
+
+def run_backtest(panel, portfolios, horizon_days=90, policies=POLICIES, correlation_window=CORRELATION_WINDOW_DAYS):
+    """Backtest ``policies`` over a market panel.
+
+    ``panel`` is the dict of (date x symbol) DataFrames produced by
+    ``market_snapshots.load_panel`` or ``panel_from_history``; ``portfolios``
+    maps a name to ``{symbol: weight}``. Returns one row of statistics per
+    policy and portfolio.
+    """
+    names = list(portfolios)
+    symbols = sorted({symbol for weights in portfolios.values() for symbol in weights})
+    missing = [symbol for symbol in symbols if symbol not in panel['price'].columns]
+    if missing:
+        raise ValueError(f"No market history for {', '.join(missing)}")
+
+    dates = panel['price'].index
+    prices = panel['price'][symbols].ffill().to_numpy(dtype=float)
+    weights = np.array([[portfolios[name].get(symbol, 0.0) for symbol in symbols] for name in names], dtype=float)
+    weights = weights / weights.sum(axis=1, keepdims=True)
+    members = weights > 0
+
+    paths, valid = _collateral_paths(prices, weights, members, horizon_days)
+    # Only originate where every member has a full set of policy inputs that day
+    known = np.logical_and.reduce([np.isfinite(panel[field][symbols].to_numpy(dtype=float)) for field in panel])
+    valid &= (known[None] | ~members[:, None, :]).all(axis=-1)[:, :paths.shape[1]]
+
+    rows = []
+    for policy in policies:
+        if policy == "quantile":
+            ltv, interest_rate = _quantile_policy(panel, symbols, members, correlation_window)
+            interest_weights = np.broadcast_to(weights[:, None, :], ltv.shape)
+        elif policy == "threshold":
+            ltv, interest_rate = _threshold_policy(panel, symbols)
+            ltv, interest_rate = ltv[None], interest_rate[None]
+            interest_weights = ltv * weights[:, None, :]
+        else:
+            raise ValueError(f"Unknown policy {policy!r}, expected one of {', '.join(POLICIES)}")
+
+        weighted_ltv = np.einsum('ptu,pu->pt', np.broadcast_to(ltv, interest_weights.shape), weights)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weighted_interest = (interest_weights * interest_rate).sum(axis=-1) / interest_weights.sum(axis=-1)
+
+        n_loans = paths.shape[1]
+        stats = _simulate(paths, valid, weighted_ltv[:, :n_loans], weighted_interest[:, :n_loans], horizon_days)
+        for i, name in enumerate(names):
+            rows.append({"policy": policy, "portfolio": name, **{key: val[i] for key, val in stats.items()}})
+
+    result = pd.DataFrame(rows)
+    result.attrs["start"] = dates[0] if len(dates) else None
+    result.attrs["end"] = dates[-1] if len(dates) else None
+    return result
+
+
+def _collateral_paths(prices, weights, members, horizon_days):
+    """Collateral value of each portfolio over each loan's life, per unit at origination.
+
+    Returns ``paths`` shaped (portfolios, origination dates, horizon + 1) and a
+    mask of the loans whose member prices exist for the whole horizon.
+    """
+    n_dates = prices.shape[0] - horizon_days
+    if n_dates <= 0:
+        raise ValueError(f"Panel has {prices.shape[0]} days, need more than the {horizon_days}-day horizon")
+    windows = np.lib.stride_tricks.sliding_window_view(prices, horizon_days + 1, axis=0)[:n_dates]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        relative = windows / prices[:n_dates, :, None]
+    finite = np.isfinite(relative).all(axis=-1)
+    valid = (finite[None] | ~members[:, None, :]).all(axis=-1)
+    relative = np.where(np.isfinite(relative), relative, 0.0)
+    return np.einsum('tuh,pu->pth', relative, weights), valid
+
+
+def _quantile_policy(panel, symbols, members, correlation_window):
+    """Per-date LTV and rate under the quantile-tier policy, shaped (portfolios, dates, symbols).
+
+    Tiers come from risk-score quartiles across the whole panel universe;
+    volatility quartiles and average correlations are taken within each
+    portfolio, as ``quantile_tier_rules`` does for a live request.
+    """
+    vol = volatility_score(panel['change_24h'], panel['change_7d'], panel['change_30d'], panel['change_90d'])
+    rank = panel['market_cap'].rank(axis=1, ascending=False)
+    codes = pd.DataFrame(quantile_tier_codes((vol * rank).to_numpy(dtype=float)), index=vol.index, columns=vol.columns)
+    codes = codes[symbols].to_numpy()
+    vol = vol[symbols].to_numpy(dtype=float)
+
+    member_vol = np.where(members[:, None, :], vol[None], np.nan)
+    average_correlation = _rolling_average_correlation(panel['price'][symbols], members, correlation_window)
+    with np.errstate(invalid='ignore'):
+        _, ltv = quantile_policy_ltv(codes[None], member_vol, average_correlation)
+    return ltv, np.broadcast_to(quantile_policy_interest(codes)[None], ltv.shape)
+
+
+def _threshold_policy(panel, symbols):
+    """Per-date LTV and rate under the threshold-tier policy, shaped (dates, symbols)."""
+    abs_change = panel['change_24h'][symbols].abs().to_numpy(dtype=float)
+    market_cap = panel['market_cap'][symbols].to_numpy(dtype=float)
+    codes = threshold_tier_codes(abs_change, market_cap)
+    with np.errstate(invalid='ignore'):
+        return threshold_policy_ltv(codes, abs_change), threshold_policy_interest(codes, abs_change)
+
+
+def _rolling_average_correlation(prices, members, window):
+    """Mean absolute price correlation of each symbol to the other portfolio members.
+
+    Shaped (portfolios, dates, symbols); NaN until ``window`` days of history exist.
+    """
+    n_dates, n_symbols = prices.shape
+    correlations = prices.rolling(window, min_periods=window).corr().to_numpy(dtype=float)
+    correlations = np.abs(correlations.reshape(n_dates, n_symbols, n_symbols))
+    correlations[:, np.arange(n_symbols), np.arange(n_symbols)] = np.nan
+    known = np.isfinite(correlations)
+    members = members.astype(float)
+    totals = np.einsum('tij,pj->pti', np.where(known, correlations, 0.0), members)
+    counts = np.einsum('tij,pj->pti', known.astype(float), members)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+
+def _simulate(paths, valid, weighted_ltv, weighted_interest, horizon_days):
+    """Liquidation frequency and losses for loans originated at every date."""
+    days = np.arange(horizon_days + 1)
+    debt = weighted_ltv[..., None] * (1 + weighted_interest[..., None] * days / 365)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        path_ltv = debt / paths
+    breached = path_ltv >= (weighted_ltv * LIQUIDATION_MULTIPLIER)[..., None]
+    breached[..., 0] = False
+
+    originated = valid & np.isfinite(weighted_ltv) & (weighted_ltv > 0)
+    liquidated = breached.any(axis=-1) & originated
+    first_breach = breached.argmax(axis=-1)
+    at_breach = np.take_along_axis(paths, first_breach[..., None], axis=-1)[..., 0]
+    debt_at_breach = np.take_along_axis(debt, first_breach[..., None], axis=-1)[..., 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        loss_rate = np.where(liquidated, np.maximum(0.0, debt_at_breach - at_breach) / weighted_ltv, 0.0)
+
+    loans = originated.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            "loans": loans,
+            "mean_ltv": np.where(originated, weighted_ltv, 0.0).sum(axis=-1) / loans,
+            "liquidation_rate": liquidated.sum(axis=-1) / loans,
+            "mean_days_to_liquidation": np.where(liquidated, first_breach, 0).sum(axis=-1) / liquidated.sum(axis=-1),
+            "mean_loss_rate": loss_rate.sum(axis=-1) / loans,
+            "worst_loss_rate": loss_rate.max(axis=-1),
+            "loss_given_liquidation": loss_rate.sum(axis=-1) / liquidated.sum(axis=-1),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the LTV policies against recorded or historical market data.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--snapshots", help="directory of recorded daily snapshots")
+    source.add_argument("--history", help="snapshot file whose history window to replay")
+    source.add_argument("--fetch-days", type=int, help="fetch this many days of daily history from CoinGecko")
+    parser.add_argument("--horizon", type=int, default=90, help="loan horizon in days")
+    parser.add_argument("--policy", action="append", choices=POLICIES, help="policies to run, all by default")
+    args = parser.parse_args()
+
+    from portfolios import SAMPLE_PORTFOLIOS
+    from market_snapshots import load_panel, load_snapshot, panel_from_history
+
+    if args.snapshots:
+        panel = load_panel(args.snapshots)
+    elif args.history:
+        _, history = load_snapshot(args.history)
+        if history is None:
+            parser.error(f"{args.history} has no history window")
+        panel = panel_from_history(*history)
+    else:
+        from coingecko_fetcher import COIN_ID_MAP, get_daily_history
+        panel = panel_from_history(*get_daily_history(list(COIN_ID_MAP), days=args.fetch_days))
+
+    result = run_backtest(panel, SAMPLE_PORTFOLIOS, horizon_days=args.horizon, policies=args.policy or POLICIES)
+    print(f"Backtest {result.attrs['start']} -> {result.attrs['end']}, {args.horizon}-day loans")
+    print(result.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+
+
+if __name__ == "__main__":
+    main()
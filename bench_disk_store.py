@@ -0,0 +1,142 @@
+"""Read/write latency benchmark for ``disk_store.DiskStore``.
+
+Fills a fresh store, then measures single-process writes, hits and misses,
+and a mixed read/write workload from several processes sharing the file, as
+gunicorn workers do. ``--compare-files`` runs the same single-process
+workload against the old one-JSON-file-per-key layout.
+
+Usage::
+
+    python bench_disk_store.py --entries 20000 --value-bytes 4096 --processes 4
+    python bench_disk_store.py --max-bytes 8000000 --compare-files
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from disk_store import DiskStore
+
+TTL_SECONDS = 3600
+
+
+def _timed(fn, keys):
+    latencies = np.empty(len(keys))
+    for i, key in enumerate(keys):
+        started_at = time.perf_counter()
+        fn(key)
+        latencies[i] = time.perf_counter() - started_at
+    return latencies
+
+
+def _report(name, latencies):
+    micros = latencies * 1e6
+    p50, p95, p99 = np.percentile(micros, [50, 95, 99])
+    print(f"{name:<24} {len(latencies):>8} {len(latencies) / latencies.sum():>10.0f} "
+          f"{p50:>9.1f} {p95:>9.1f} {p99:>9.1f}")
+
+
+def _mixed_worker(path, max_bytes, n_ops, n_keys, value, write_share, seed, queue):
+    store = DiskStore(path, max_bytes, compact_interval=0)
+    rng = random.Random(seed)
+    reads, writes = [], []
+    for _ in range(n_ops):
+        key = f"key-{rng.randrange(n_keys)}"
+        started_at = time.perf_counter()
+        if rng.random() < write_share:
+            store.set(key, value, TTL_SECONDS)
+            writes.append(time.perf_counter() - started_at)
+        else:
+            store.get(key)
+            reads.append(time.perf_counter() - started_at)
+    queue.put((reads, writes))
+
+
+def bench_store(directory, args, value):
+    path = os.path.join(directory, "bench.sqlite3")
+    store = DiskStore(path, args.max_bytes, compact_interval=0)
+    keys = [f"key-{i}" for i in range(args.entries)]
+
+    _report("store set", _timed(lambda key: store.set(key, value, TTL_SECONDS), keys))
+    sample = random.Random(0).sample(keys, min(args.reads, len(keys)))
+    _report("store get (hit/evicted)", _timed(store.get, sample))
+    _report("store get (miss)", _timed(store.get, [f"missing-{i}" for i in range(args.reads)]))
+
+    started_at = time.perf_counter()
+    result = store.compact(force=True)
+    print(f"compaction took {(time.perf_counter() - started_at) * 1000:.1f} ms: {result}")
+
+    queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_mixed_worker, args=(
+            path, args.max_bytes, args.ops_per_process, args.entries, value, args.write_share, seed, queue))
+        for seed in range(args.processes)
+    ]
+    started_at = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    results = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started_at
+    reads = np.array([latency for worker_reads, _ in results for latency in worker_reads])
+    writes = np.array([latency for _, worker_writes in results for latency in worker_writes])
+    if len(reads):
+        _report(f"{args.processes}-proc get", reads)
+    if len(writes):
+        _report(f"{args.processes}-proc set", writes)
+    print(f"{args.processes} processes: {(len(reads) + len(writes)) / elapsed:.0f} ops/s overall, "
+          f"store {store.stats()}")
+
+
+def bench_files(directory, args, value):
+    """The previous layout: one JSON file per key, never evicted."""
+    cache_dir = os.path.join(directory, "files")
+    os.makedirs(cache_dir)
+    payload = json.dumps({"timestamp": time.time(), "response": value.decode("latin-1")})
+    keys = [f"key-{i}" for i in range(args.entries)]
+
+    def write(key):
+        with open(os.path.join(cache_dir, f"{key}.json"), "w") as f:
+            f.write(payload)
+
+    def read(key):
+        path = os.path.join(cache_dir, f"{key}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                json.load(f)
+
+    _report("files set", _timed(write, keys))
+    _report("files get (hit)", _timed(read, random.Random(0).sample(keys, min(args.reads, len(keys)))))
+    _report("files get (miss)", _timed(read, [f"missing-{i}" for i in range(args.reads)]))
+    total = sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir))
+    print(f"files: {len(os.listdir(cache_dir))} files, {total} bytes (no cap)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite response store.")
+    parser.add_argument("--entries", type=int, default=10000, help="entries written in the fill phase")
+    parser.add_argument("--value-bytes", type=int, default=4096, help="size of each value")
+    parser.add_argument("--reads", type=int, default=5000, help="reads per read phase")
+    parser.add_argument("--max-bytes", type=int, default=256 * 1024 * 1024, help="store byte cap")
+    parser.add_argument("--processes", type=int, default=4, help="concurrent processes in the mixed phase")
+    parser.add_argument("--ops-per-process", type=int, default=2000)
+    parser.add_argument("--write-share", type=float, default=0.2, help="fraction of mixed ops that are writes")
+    parser.add_argument("--compare-files", action="store_true", help="also run the old JSON-file layout")
+    args = parser.parse_args()
+
+    value = os.urandom(args.value_bytes // 2).hex().encode()[:args.value_bytes]
+    print(f"{'operation':<24} {'ops':>8} {'ops/s':>10} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9}")
+    with tempfile.TemporaryDirectory(prefix="bench-disk-store-") as directory:
+        bench_store(directory, args, value)
+        if args.compare_files:
+            bench_files(directory, args, value)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,137 @@
-import os
-import json
-import time
-from datetime import datetime
-
-class ResponseCache:
-    def __init__(self, cache_dir="cache", ttl_hours=24):
-        self.cache_dir = cache_dir
-        self.ttl_seconds = ttl_hours * 3600
-        os.makedirs(cache_dir, exist_ok=True)
-
-    def _generate_cache_key(self, prompt, portfolio):
-        """Generate a unique cache key based on prompt and portfolio"""
-        # Convert portfolio to dict if it's a string
-        if isinstance(portfolio, str):
-            portfolio_dict = {}
-            for line in portfolio.split('\n'):
-                if '$' in line and 'in' in line:
-                    parts = line.split('$')[1].split('in')
-                    amount = float(parts[0].replace(',', '').strip())
-                    symbol = parts[1].strip()
-                    portfolio_dict[symbol] = amount
-            portfolio = portfolio_dict
-            
-        cache_data = {
-            "prompt": prompt,
-            "portfolio": dict(sorted(portfolio.items()))
-        }
-        cache_str = json.dumps(cache_data, sort_keys=True)
-        return str(hash(cache_str))
-
-    def get_cached_response(self, prompt, portfolio):
-        """Get cached response if it exists and is not expired"""
-        cache_key = self._generate_cache_key(prompt, portfolio)
-        cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
-        
-        if os.path.exists(cache_file):
-            with open(cache_file, 'r') as f:
-                cached_data = json.load(f)
-            
-            # Check if cache is still valid
-            if time.time() - cached_data['timestamp'] < self.ttl_seconds:
-                return cached_data['response'], cached_data['loan_metrics']
-        
-        return None, None
-
-    def cache_response(self, prompt, portfolio, response, loan_metrics):
-        """Cache the response and loan metrics"""
-        cache_key = self._generate_cache_key(prompt, portfolio)
-        cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
-        
-        cache_data = {
-            'timestamp': time.time(),
-            'response': response,
-            'loan_metrics': loan_metrics
-        }
-        
-        with open(cache_file, 'w') as f:
-            json.dump(cache_data, f, default=str)
\ No newline at end of file
+import os
+import re
+import json
+import bisect
+import hashlib
+import threading
+from disk_store import DISK_STORE_MAX_BYTES, open_store
+
+# "exact" keys on the prompt and dollar amounts; "regime" keys on the symbol
+# set, loan term bucket and each asset's tier and volatility bucket, so
+# portfolios that differ only in amounts share one analysis. Exact entries
+# only hold for the market snapshot they were written on; regime entries
+# carry the market state in their key and outlive snapshot changes, but
+# their text cites that day's news, so they expire after
+# RESPONSE_CACHE_REGIME_TTL_SECONDS (three market refreshes by default).
+CACHE_MODES = ("exact", "regime")
+RESPONSE_CACHE_REGIME_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_REGIME_TTL_SECONDS", "900"))
+
+# Names of the one-JSON-file-per-key entries written before the SQLite store
+LEGACY_ENTRY_NAME = re.compile(r"(-?\d+|(regime-)?[0-9a-f]{64})\.json")
+# Cache directories this process has already cleared of legacy entries
+_cleared_dirs = set()
+_cleared_lock = threading.Lock()
+
+# Upper edges (months) of the loan term buckets
+LOAN_TERM_BUCKETS = (6, 12, 24)
+# Upper edges of the volatility score buckets
+VOLATILITY_BUCKETS = (2.0, 5.0, 10.0)
+
+
+def regime_fingerprint(quote, months):
+    """Amount-free description of a quote's market regime.
+
+    ``quote`` is a ``pricing_engine`` quote; only its symbols, tiers and
+    volatility scores are used.
+    """
+    assets = sorted(
+        (symbol, tier or "Untiered", bisect.bisect_left(VOLATILITY_BUCKETS, float(volatility)))
+        for symbol, tier, volatility in zip(quote["symbols"], quote["tiers"], quote["volatility"])
+    )
+    return {
+        "symbols": [symbol for symbol, _, _ in assets],
+        "term_bucket": bisect.bisect_left(LOAN_TERM_BUCKETS, months) if months else None,
+        "assets": assets,
+    }
+
+
+def remove_legacy_entries(cache_dir):
+    """Delete the JSON files the cache wrote before it moved to SQLite, once per process.
+
+    Nothing reads them any more and the store's byte cap doesn't count them.
+    """
+    with _cleared_lock:
+        if cache_dir in _cleared_dirs:
+            return
+        _cleared_dirs.add(cache_dir)
+    for name in os.listdir(cache_dir):
+        if LEGACY_ENTRY_NAME.fullmatch(name):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass  # another worker removed it first
+
+
+class ResponseCache:
+    """Agent responses kept in one size-capped SQLite store per ``cache_dir``, shared by all workers."""
+
+    STORE_FILE = "responses.sqlite3"
+
+    def __init__(self, cache_dir="cache", ttl_hours=24, mode="exact", max_bytes=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {', '.join(CACHE_MODES)}")
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_hours * 3600
+        if mode == "regime":
+            self.ttl_seconds = min(self.ttl_seconds, RESPONSE_CACHE_REGIME_TTL_SECONDS)
+        self.mode = mode
+        max_bytes = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", DISK_STORE_MAX_BYTES)) if max_bytes is None else max_bytes
+        self.store = open_store(os.path.join(cache_dir, self.STORE_FILE), max_bytes)
+        remove_legacy_entries(cache_dir)
+
+    def _generate_cache_key(self, prompt, portfolio, quote=None, months=None):
+        """Generate a unique cache key based on prompt and portfolio.
+
+        In "regime" mode the key comes from ``regime_fingerprint(quote, months)``
+        instead, and the prompt and amounts are ignored.
+        """
+        if self.mode == "regime":
+            cache_str = json.dumps(regime_fingerprint(quote, months), sort_keys=True)
+            return "regime-" + hashlib.sha256(cache_str.encode()).hexdigest()
+
+        # Convert portfolio to dict if it's a string
+        if isinstance(portfolio, str):
+            portfolio_dict = {}
+            for line in portfolio.split('\n'):
+                if '$' in line and 'in' in line:
+                    parts = line.split('$')[1].split('in')
+                    amount = float(parts[0].replace(',', '').strip())
+                    symbol = parts[1].strip()
+                    portfolio_dict[symbol] = amount
+            portfolio = portfolio_dict
+            
+        cache_data = {
+            "prompt": prompt,
+            "portfolio": dict(sorted(portfolio.items()))
+        }
+        cache_str = json.dumps(cache_data, sort_keys=True)
+        # hash() is salted per process, so keys would never match across restarts
+        return hashlib.sha256(cache_str.encode()).hexdigest()
+
+    def get_cached_response(self, prompt, portfolio, quote=None, months=None, snapshot_version=None):
+        """Get cached response if it exists and is not expired
+
+        In "exact" mode an entry written on another snapshot than
+        ``snapshot_version`` is dropped and treated as a miss.
+        """
+        cache_key = self._generate_cache_key(prompt, portfolio, quote, months)
+        cached = self.store.get(cache_key)
+        if cached is None:
+            return None, None
+        cached_data = json.loads(cached)
+        if (self.mode == "exact" and snapshot_version is not None
+                and cached_data.get('snapshot_version') != snapshot_version):
+            self.store.delete(cache_key)
+            return None, None
+        return cached_data['response'], cached_data['loan_metrics']
+
+    def cache_response(self, prompt, portfolio, response, loan_metrics, quote=None, months=None,
+                       snapshot_version=None):
+        """Cache the response and loan metrics"""
+        cache_key = self._generate_cache_key(prompt, portfolio, quote, months)
+        cache_data = {
+            'response': response,
+            'loan_metrics': loan_metrics,
+            'snapshot_version': snapshot_version,
+        }
+        self.store.set(cache_key, json.dumps(cache_data, default=str).encode(), self.ttl_seconds)
@@ -1,32 +1,72 @@
 from dotenv import load_dotenv
 import os
 import json
+import time
+import hashlib
+import threading
 import redis
 from requests import Session
 from requests.exceptions import ConnectionError, Timeout, TooManyRedirects
 import requests
 import pandas as pd
+from market_snapshots import load_snapshot, record_snapshot
 
 load_dotenv()
 
 API_KEY = os.getenv("CMC_API_KEY")
-url = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest'
+CMC_API_URL = os.getenv("CMC_API_URL", "https://pro-api.coinmarketcap.com")
+url = f'{CMC_API_URL}/v1/cryptocurrency/listings/latest'
 headers = {'Accepts': 'application/json', 'X-CMC_PRO_API_KEY': API_KEY}
 params = {'start': '1', 'limit': '100', 'convert': 'USD'}
 r = redis.Redis(host=os.getenv("REDIS_HOST"), port=os.getenv("REDIS_PORT"), username=os.getenv("REDIS_USERNAME"), password=os.getenv("REDIS_PASSWORD"),)
 
+# Set CMC_REPLAY_SNAPSHOT to a recorded snapshot file to serve it instead of live
+# data, and SNAPSHOT_RECORD_DIR to record every new listing that is fetched.
+REPLAY_SNAPSHOT = os.getenv("CMC_REPLAY_SNAPSHOT")
+RECORD_DIR = os.getenv("SNAPSHOT_RECORD_DIR")
 
-def fetch_data_app():
-    
-    if r.exists("CMC_DATA"):
-        data = json.loads(r.get("CMC_DATA"))
-    else:
-        data = None
+REFRESH_INTERVAL_SECONDS = int(os.getenv("CMC_REFRESH_INTERVAL_SECONDS", "300"))
+# Bounds each CMC call, so a hung connection can't hold a thread forever
+CMC_TIMEOUT_SECONDS = 10
+
+# Called as hook(df, version) after refresh_market_data stores a new snapshot
+_refresh_hooks = []
+_last_refreshed_version = None
+
+# The refresher publishes each new snapshot version here; workers subscribe
+# and keep the snapshot in memory instead of reading Redis on every request.
+SNAPSHOT_CHANNEL = "CMC_DATA_UPDATES"
+SNAPSHOT_SUBSCRIBE = os.getenv("CMC_SNAPSHOT_SUBSCRIBE", "1") != "0"
+# Pub/sub drops messages sent while a worker is reconnecting, so the stored
+# version is also re-read this often as a backstop
+SNAPSHOT_RECONCILE_SECONDS = float(os.getenv("CMC_SNAPSHOT_RECONCILE_SECONDS", "60"))
+SNAPSHOT_RESUBSCRIBE_SECONDS = 5
+
+# (version, df) of the subscribed snapshot, swapped as a whole; None while not subscribed
+_snapshot = None
+# Called as hook(version, df) in each worker after it swaps in a new snapshot
+_snapshot_hooks = []
+_subscriber_pid = None
+_subscriber_lock = threading.Lock()
+# (thread, stop event) of this process's subscriber
+_subscriber = None
+# Last listing this process loaded, for when a fetch fails or runs out of time,
+# and the Redis payload it came from, so an unchanged listing isn't parsed again
+_last_market_df = None
+_last_payload = None
+
+# Without a cached snapshot every call hits CMC, so requests inside the same
+# window are treated as seeing the same market data.
+LIVE_SNAPSHOT_WINDOW_SECONDS = 60
+# A listing stored without CMC_DATA_VERSION (e.g. by an older refresher) is
+# versioned by its digest, reused for this long instead of hashed per request
+DERIVED_VERSION_TTL_SECONDS = 30
+# (expires_at, version) of the last derived version
+_derived_version = None
 
-    if not data or len(data) <= 0:
-        res = requests.get(url, headers=headers, params=params)
-        data = res.json()['data']
 
+def listing_to_dataframe(data):
+    """Convert the CMC listings payload into the market DataFrame used everywhere."""
     return pd.DataFrame([{
         'Name': coin['name'],
         'Symbol': coin['symbol'],
@@ -37,4 +77,247 @@ def fetch_data_app():
         '90d Change (%)': coin['quote']['USD']['percent_change_90d'],
         'Market Cap': coin['quote']['USD']['market_cap']
     } for coin in data])
-    
+
+
+def fetch_data_app(record=True):
+    """The current market listing as a DataFrame.
+
+    With ``record=False`` the listing is not written to ``SNAPSHOT_RECORD_DIR``
+    and no snapshot subscriber is started, for one-off reads such as the
+    snapshot recorder's own.
+    """
+    global _last_market_df, _last_payload
+    if REPLAY_SNAPSHOT:
+        return load_snapshot(REPLAY_SNAPSHOT)[0]
+
+    snapshot = _subscribed_snapshot() if record else _snapshot
+    if snapshot is not None:
+        return snapshot[1].copy()
+
+    raw = r.get("CMC_DATA")
+    if raw and raw == _last_payload:
+        return _last_market_df.copy()  # unchanged listing, already parsed and recorded
+    data = json.loads(raw) if raw else None
+
+    if not data or len(data) <= 0:
+        res = requests.get(url, headers=headers, params=params, timeout=CMC_TIMEOUT_SECONDS)
+        data = res.json()['data']
+        raw = None
+
+    df = listing_to_dataframe(data)
+    if record:
+        _record(df)
+        _last_market_df, _last_payload = df, raw
+    else:
+        _last_market_df = df
+    return df.copy()
+
+
+def last_market_data():
+    """The most recent listing this process has seen, or None; the fallback when a fetch can't finish."""
+    snapshot = _snapshot
+    if snapshot is not None:
+        return snapshot[1].copy()
+    return None if _last_market_df is None else _last_market_df.copy()
+
+
+def _record(df):
+    if RECORD_DIR:
+        try:
+            record_snapshot(df, directory=RECORD_DIR)
+        except OSError as e:
+            print(f"Error recording snapshot: {e}")
+
+
+def get_snapshot_version():
+    """Return a short identifier for the market snapshot requests are priced against."""
+    if REPLAY_SNAPSHOT:
+        return f"replay-{os.path.basename(REPLAY_SNAPSHOT)}"
+    snapshot = _subscribed_snapshot()
+    if snapshot is not None:
+        return snapshot[0]
+    try:
+        version = r.get("CMC_DATA_VERSION")
+        if version:
+            return version.decode() if isinstance(version, bytes) else str(version)
+        version = _derived_snapshot_version()
+        if version:
+            return version
+    except redis.RedisError as e:
+        print(f"Error reading snapshot version: {e}")
+    return f"live-{int(time.time() // LIVE_SNAPSHOT_WINDOW_SECONDS)}"
+
+
+def _derived_snapshot_version():
+    """Digest of the stored listing, for snapshots stored without a version; None if there is none.
+
+    The listing is read and hashed at most once per ``DERIVED_VERSION_TTL_SECONDS``.
+    """
+    global _derived_version
+    derived = _derived_version
+    if derived is not None and derived[0] > time.monotonic():
+        return derived[1]
+    raw = r.get("CMC_DATA")
+    if not raw:
+        return None
+    version = hashlib.sha1(raw).hexdigest()[:16]
+    _derived_version = (time.monotonic() + DERIVED_VERSION_TTL_SECONDS, version)
+    return version
+
+
+def on_refresh(hook):
+    """Register ``hook(df, version)`` to run after each new snapshot is stored."""
+    _refresh_hooks.append(hook)
+    return hook
+
+
+def refresh_market_data():
+    """Fetch the latest listing from CMC, store it in Redis and run the refresh hooks.
+
+    Returns the snapshot version. Hooks only run when the listing changed.
+    """
+    global _last_refreshed_version
+    res = requests.get(url, headers=headers, params=params, timeout=CMC_TIMEOUT_SECONDS)
+    res.raise_for_status()
+    payload = json.dumps(res.json()['data']).encode()
+    version = hashlib.sha1(payload).hexdigest()[:16]
+
+    pipe = r.pipeline()
+    pipe.set("CMC_DATA", payload)
+    pipe.set("CMC_DATA_VERSION", version)
+    pipe.publish(SNAPSHOT_CHANNEL, version)
+    pipe.execute()
+
+    if version != _last_refreshed_version:
+        _last_refreshed_version = version
+        df = listing_to_dataframe(json.loads(payload))
+        # Recorded here once, rather than by every worker that loads it
+        _record(df)
+        for hook in _refresh_hooks:
+            try:
+                hook(df, version)
+            except Exception as e:
+                print(f"Error in refresh hook {getattr(hook, '__name__', hook)}: {e}")
+    return version
+
+
+def on_snapshot_change(hook):
+    """Register ``hook(version, df)`` to run in this process whenever the subscribed snapshot changes."""
+    _snapshot_hooks.append(hook)
+    return hook
+
+
+def _subscribed_snapshot():
+    """The in-memory snapshot, starting this process's subscriber on first use; None to fall back to Redis."""
+    if SNAPSHOT_SUBSCRIBE and _subscriber_pid != os.getpid():
+        _start_subscriber()
+    return _snapshot
+
+
+def _start_subscriber():
+    global _subscriber_pid, _snapshot, _subscriber
+    with _subscriber_lock:
+        # One subscriber per process; a forked worker starts its own
+        if _subscriber_pid == os.getpid():
+            return
+        _subscriber_pid = os.getpid()
+        _snapshot = None
+        stop = threading.Event()
+        thread = threading.Thread(target=_follow_snapshots, args=(stop,), name="snapshot-subscriber", daemon=True)
+        _subscriber = (thread, stop)
+    thread.start()
+
+
+def stop_subscriber(timeout=None):
+    """Stop this process's snapshot subscriber and drop its snapshot.
+
+    Requests read Redis again, and the next one starts a new subscriber if
+    ``SNAPSHOT_SUBSCRIBE`` is still set. The subscriber notices within
+    ``SNAPSHOT_RECONCILE_SECONDS``; ``timeout`` bounds the wait for it.
+    """
+    global _subscriber_pid, _snapshot, _subscriber
+    with _subscriber_lock:
+        subscriber, _subscriber = _subscriber, None
+        _subscriber_pid = None
+        _snapshot = None
+    if subscriber is not None:
+        thread, stop = subscriber
+        stop.set()
+        thread.join(timeout)
+
+
+def _load_snapshot():
+    """Swap in the snapshot stored in Redis if its version differs from the one held."""
+    global _snapshot
+    pipe = r.pipeline()
+    pipe.get("CMC_DATA_VERSION")
+    pipe.get("CMC_DATA")
+    version, raw = pipe.execute()
+    if not raw:
+        return  # nothing stored yet; requests keep falling back to Redis / CMC
+    version = version.decode() if version else hashlib.sha1(raw).hexdigest()[:16]
+    if _snapshot is not None and _snapshot[0] == version:
+        return
+    df = listing_to_dataframe(json.loads(raw))
+    _snapshot = (version, df)
+    for hook in _snapshot_hooks:
+        try:
+            hook(version, df)
+        except Exception as e:
+            print(f"Error in snapshot hook {getattr(hook, '__name__', hook)}: {e}")
+
+
+def _follow_snapshots(stop):
+    """Keep ``_snapshot`` in step with the refresher's version-change messages until ``stop`` is set."""
+    global _snapshot
+    while not stop.is_set():
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(SNAPSHOT_CHANNEL)
+            # Load after subscribing so a refresh in between isn't missed
+            _load_snapshot()
+            while not stop.is_set():
+                message = pubsub.get_message(timeout=SNAPSHOT_RECONCILE_SECONDS)
+                if message is None:
+                    pubsub.ping()  # surfaces a dead connection
+                    _load_snapshot()
+                elif message["type"] == "message":
+                    _load_snapshot()
+        except (redis.RedisError, KeyError, ValueError) as e:
+            print(f"Snapshot subscription lost, reading Redis per request until it recovers: {e}")
+            _snapshot = None
+        finally:
+            pubsub.close()
+        stop.wait(SNAPSHOT_RESUBSCRIBE_SECONDS)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Keep the CMC snapshot in Redis fresh.")
+    parser.add_argument("--interval", type=int, default=REFRESH_INTERVAL_SECONDS, help="seconds between refreshes")
+    parser.add_argument("--once", action="store_true", help="refresh a single time and exit")
+    parser.add_argument("--no-warm", action="store_true", help="skip pre-warming per-asset analyses")
+    parser.add_argument("--no-factor-model", action="store_true",
+                        help="skip fitting the factor correlation model (large baskets use the exact matrix)")
+    args = parser.parse_args()
+
+    if not args.no_warm:
+        from asset_analysis import warm_in_background
+        on_refresh(warm_in_background)
+    if not args.no_factor_model:
+        from factor_correlation import fit_in_background
+        on_refresh(fit_in_background)
+
+    while True:
+        try:
+            print(f"Market snapshot {refresh_market_data()}")
+        except (requests.exceptions.RequestException, redis.RedisError, KeyError) as e:
+            print(f"Error refreshing market data: {e}")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import datetime
+import os
+import time
+import requests
+import pandas as pd
+
+COINGECKO_API_URL = os.getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
+# Bounds each history call, so a hung connection can't hold a thread forever
+COINGECKO_TIMEOUT_SECONDS = 10
+# Fewest days of shared history a pair of coins is correlated over
+CORRELATION_MIN_DAYS = 30
+
+COIN_ID_MAP = {
+    'BTC': 'bitcoin', 'ETH': 'ethereum', 'SOL': 'solana', 'XRP': 'ripple',
+    'LINK': 'chainlink', 'DOT': 'polkadot', 'ADA': 'cardano', 'AVAX': 'avalanche-2'
+}
+# Coins looked up by market cap for symbols COIN_ID_MAP doesn't name, and how
+# long that lookup is kept
+COIN_ID_LOOKUP_SIZE = 250
+COIN_ID_LOOKUP_TTL_SECONDS = 24 * 3600
+
+_coin_ids = None
+_coin_ids_fetched_at = 0.0
+
+
+def coin_id_map():
+    """CoinGecko ids by upper-case symbol: ``COIN_ID_MAP``, plus the top coins by market cap.
+
+    Where several coins share a symbol the largest one is taken. The lookup
+    is refreshed daily; if it fails, the last one (or ``COIN_ID_MAP`` alone)
+    is used.
+    """
+    global _coin_ids, _coin_ids_fetched_at
+    if _coin_ids is not None and time.time() - _coin_ids_fetched_at < COIN_ID_LOOKUP_TTL_SECONDS:
+        return _coin_ids
+    params = {"vs_currency": "usd", "order": "market_cap_desc", "per_page": COIN_ID_LOOKUP_SIZE, "page": 1}
+    try:
+        response = requests.get(f"{COINGECKO_API_URL}/coins/markets", params=params,
+                                timeout=COINGECKO_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        coins = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching CoinGecko coin ids: {e}")
+        _coin_ids_fetched_at = time.time()  # don't retry on every call
+        return _coin_ids or COIN_ID_MAP
+    ids = {}
+    for coin in coins:
+        ids.setdefault(coin['symbol'].upper(), coin['id'])
+    _coin_ids, _coin_ids_fetched_at = {**ids, **COIN_ID_MAP}, time.time()
+    return _coin_ids
+
+
+def get_crypto_historical_data(coin_id, vs_currency, days):
+    """Fetches historical prices and market caps for a given number of days."""
+    end_date = datetime.datetime.now()
+    start_date = end_date - datetime.timedelta(days=days)
+    from_timestamp = int(start_date.timestamp())
+    to_timestamp = int(end_date.timestamp())
+    url = f"{COINGECKO_API_URL}/coins/{coin_id}/market_chart/range"
+    params = {"vs_currency": vs_currency, "from": from_timestamp, "to": to_timestamp}
+    try:
+        response = requests.get(url, params=params, timeout=COINGECKO_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        data = response.json()
+        prices = data.get('prices', [])
+        df_prices = pd.DataFrame(prices, columns=['timestamp', 'price'])
+        market_caps = pd.DataFrame(data.get('market_caps', []), columns=['timestamp', 'market_cap'])
+        df_prices = df_prices.merge(market_caps, on='timestamp', how='left')
+        df_prices['timestamp'] = pd.to_datetime(df_prices['timestamp'], unit='ms')
+        df_prices = df_prices.set_index('timestamp')
+        return df_prices
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data for {coin_id}: {e}")
+        return None
+
+
+def get_daily_history(crypto_symbols, vs_currency="usd", days=90):
+    """Daily mean prices and market caps, as two (date x symbol) DataFrames."""
+    prices, market_caps = {}, {}
+    coin_ids = coin_id_map()
+    for symbol in crypto_symbols:
+        coin_id = coin_ids.get(symbol.upper())
+        if not coin_id:
+            continue
+        df_crypto = get_crypto_historical_data(coin_id, vs_currency, days)
+        if df_crypto is not None and not df_crypto.empty:
+            daily = df_crypto.resample('D').mean()
+            prices[symbol] = daily['price']
+            market_caps[symbol] = daily['market_cap']
+    return pd.DataFrame(prices), pd.DataFrame(market_caps)
+
+
+def get_crypto_correlation_matrix(crypto_symbols, vs_currency="usd", days=90):
+    """Calculates the correlation matrix for a list of cryptocurrencies.
+
+    Each pair is correlated over the days both coins have prices, so a coin
+    with a short history doesn't shorten every other pair's window, and the
+    correlations of a set of coins don't depend on which other coins were
+    fetched with them. Pairs sharing fewer than ``CORRELATION_MIN_DAYS`` are
+    NaN.
+    """
+    all_prices, _ = get_daily_history(crypto_symbols, vs_currency, days)
+    if all_prices.empty:
+        return None
+    return all_prices.corr(min_periods=CORRELATION_MIN_DAYS)
@@ -0,0 +1,123 @@
+"""Per-request deadline with a time budget for each stage of a loan quote.
+
+A loan request goes through four stages: the market fetch, the price
+history behind the correlation matrix, deterministic pricing and the LLM
+analysis. ``Deadline.run`` gives a stage the smaller of its budget and what
+is left of the request's deadline. It runs the stage on a pool thread and,
+if the stage overruns or fails, returns the stage's fallback instead and
+records the stage as degraded. A stage that overruns keeps running in the
+background (Python can't interrupt a blocked call) but nothing waits on it.
+The pools are bounded, so a hung upstream can tie up at most
+``STAGE_WORKERS`` threads; stages queued behind them time out like any
+other. The LLM analysis, the stage most likely to overrun, has a pool of
+its own (``ANALYSIS_STAGE_WORKERS``) so that runs left behind by it can
+never hold up the market and correlation stages of later requests.
+
+A profiled request's stages are sampled on their pool threads too.
+"""
+import concurrent.futures
+import os
+import time
+
+from request_profiler import propagate
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+STAGE_WORKERS = int(os.getenv("DEADLINE_STAGE_WORKERS", "32"))
+ANALYSIS_STAGE_WORKERS = int(os.getenv("DEADLINE_ANALYSIS_STAGE_WORKERS", "16"))
+
+# Seconds each stage may take at most, whatever is left of the deadline
+STAGE_BUDGETS = {
+    "market": 3.0,
+    "correlation": 5.0,
+    "pricing": 2.0,
+    "analysis": 20.0,
+}
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="deadline-stage")
+# Stages with a pool of their own; the rest share ``_executor``
+_stage_executors = {
+    "analysis": concurrent.futures.ThreadPoolExecutor(
+        max_workers=ANALYSIS_STAGE_WORKERS, thread_name_prefix="deadline-analysis"
+    ),
+}
+
+
+class StageFailed(Exception):
+    """A stage the response can't do without failed and had no fallback."""
+
+    def __init__(self, stage, reason):
+        super().__init__(f"{stage} stage failed: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+class Deadline:
+    """Time left for one request, and how each of its stages went."""
+
+    def __init__(self, seconds=REQUEST_DEADLINE_SECONDS, budgets=None):
+        self.seconds = seconds
+        self.budgets = {**STAGE_BUDGETS, **(budgets or {})}
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds
+        self.timings = {}
+        self.degraded = {}
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, stage):
+        """Seconds ``stage`` may take: its own budget, capped by the time left."""
+        return min(self.budgets[stage], self.remaining())
+
+    def degrade(self, stage, reason):
+        """Record that ``stage`` fell back instead of producing its normal result."""
+        self.degraded[stage] = reason
+
+    def run(self, stage, fn, fallback=None):
+        """Return ``fn()`` if it finishes within ``stage``'s budget, else ``fallback()``.
+
+        A stage that raises also falls back. ``fallback`` may be None when
+        the stage's result is optional.
+        """
+        budget = self.budget(stage)
+        started_at = time.monotonic()
+        try:
+            if budget <= 0:
+                raise concurrent.futures.TimeoutError
+            executor = _stage_executors.get(stage, _executor)
+            future = executor.submit(propagate(fn, f"stage:{stage}"))
+            try:
+                return future.result(timeout=budget)
+            except concurrent.futures.TimeoutError:
+                future.cancel()  # drops it if it never left the queue
+                raise
+        except concurrent.futures.TimeoutError:
+            self.degrade(stage, f"over its {budget:.1f}s budget")
+        except Exception as e:
+            self.degrade(stage, f"failed: {e!r}")
+        finally:
+            self._record(stage, started_at)
+        return fallback() if fallback is not None else None
+
+    def timed(self, stage, fn):
+        """Run ``fn()`` inline and record its time; for stages that can't be skipped or replaced."""
+        started_at = time.monotonic()
+        try:
+            return fn()
+        finally:
+            self._record(stage, started_at)
+            if self.timings[stage] > self.budgets[stage]:
+                print(f"{stage} stage took {self.timings[stage]:.2f}s, over its {self.budgets[stage]:.1f}s budget")
+
+    def _record(self, stage, started_at):
+        # A stage may take more than one step (e.g. a table lookup, then the engine)
+        self.timings[stage] = self.timings.get(stage, 0.0) + time.monotonic() - started_at
+
+    def report(self):
+        """Stage timings and fallbacks, for the response."""
+        return {
+            "deadline_seconds": self.seconds,
+            "elapsed_seconds": time.monotonic() - self.started_at,
+            "stage_seconds": dict(self.timings),
+            "degraded_stages": dict(self.degraded),
+        }
@@ -0,0 +1,219 @@
+"""Size-bounded key/value store on a single SQLite file.
+
+Replaces the one-JSON-file-per-key layout of the response cache. Every
+gunicorn worker opens the same file in WAL mode: reads never block, and each
+write is one ``BEGIN IMMEDIATE`` transaction, so concurrent workers never
+see a partial entry. Triggers keep a running byte total, and a write that
+would take the store over ``max_bytes`` evicts the least recently read
+entries in the same transaction, so the cap holds at all times. A
+background thread per process purges expired entries and returns freed
+pages to the filesystem; workers take turns so one compaction runs per
+interval across the fleet.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+DISK_STORE_MAX_BYTES = int(os.getenv("DISK_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+DISK_STORE_COMPACT_INTERVAL_SECONDS = float(os.getenv("DISK_STORE_COMPACT_INTERVAL_SECONDS", "300"))
+
+# Bytes charged per entry on top of its key and value, for row and index overhead
+ROW_OVERHEAD_BYTES = 64
+# Reads only refresh an entry's LRU timestamp when it is older than this, so hot keys don't write on every hit
+ACCESS_RESOLUTION_SECONDS = 30
+# Eviction frees down to this fraction of the cap, so a full store doesn't evict on every write
+EVICTION_TARGET = 0.9
+# Seconds a connection waits for another worker's write to finish
+BUSY_TIMEOUT_SECONDS = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL NOT NULL);
+INSERT OR IGNORE INTO meta VALUES ('bytes', 0), ('compacted_at', 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE meta SET value = value + NEW.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+    UPDATE meta SET value = value - OLD.size + NEW.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE meta SET value = value - OLD.size WHERE name = 'bytes';
+END;
+"""
+
+
+class DiskStore:
+    """Byte-capped, TTL- and LRU-evicting store of ``bytes`` values keyed by string."""
+
+    def __init__(self, path, max_bytes=DISK_STORE_MAX_BYTES, compact_interval=DISK_STORE_COMPACT_INTERVAL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compact_interval = compact_interval
+        self._local = threading.local()
+        self._compactor_pid = None
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # executescript commits on its own, so the schema carries its own transaction
+        self._connection().executescript(f"BEGIN IMMEDIATE;{_SCHEMA}COMMIT;")
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork (gunicorn preload)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None,
+                                   check_same_thread=False)
+            # auto_vacuum only takes effect before the first table is created
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+            self._start_compactor()
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def get(self, key):
+        """The value stored under ``key``, or None if it is missing or expired."""
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at <= now:
+            return None
+        if now - accessed_at > ACCESS_RESOLUTION_SECONDS:
+            try:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.OperationalError:
+                pass  # a busy store just skips the LRU refresh
+        return value
+
+    def set(self, key, value, ttl_seconds):
+        """Store ``value`` under ``key`` for ``ttl_seconds``, evicting LRU entries to stay under the cap."""
+        size = len(key.encode()) + len(value) + ROW_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return False
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+                (key, value, size, now + ttl_seconds, now),
+            )
+            total = self._total_bytes(conn)
+            if total > self.max_bytes:
+                self._evict(conn, total - int(self.max_bytes * EVICTION_TARGET), keep=key)
+        return True
+
+    def delete(self, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def compact(self, force=False):
+        """Purge expired entries and release free pages; return what was done.
+
+        Unless ``force`` is set, this is skipped when another worker compacted
+        within the last half interval.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            compacted_at = conn.execute("SELECT value FROM meta WHERE name = 'compacted_at'").fetchone()[0]
+            if not force and now - compacted_at < self.compact_interval / 2:
+                return None
+            expired = conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,)).rowcount
+            total = self._total_bytes(conn)
+            evicted = self._evict(conn, total - self.max_bytes) if total > self.max_bytes else 0
+            conn.execute("UPDATE meta SET value = ? WHERE name = 'compacted_at'", (now,))
+        conn = self._connection()
+        conn.execute("PRAGMA incremental_vacuum")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {"expired": expired, "evicted": evicted, **self.stats()}
+
+    def stats(self):
+        conn = self._connection()
+        entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        file_bytes = sum(
+            os.path.getsize(path) for path in (self.path, f"{self.path}-wal") if os.path.exists(path)
+        )
+        return {"entries": entries, "bytes": int(self._total_bytes(conn)), "max_bytes": self.max_bytes,
+                "file_bytes": file_bytes}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _total_bytes(conn):
+        return conn.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+
+    @staticmethod
+    def _evict(conn, overflow, keep=None):
+        """Delete least recently read entries until ``overflow`` bytes are freed; return the count."""
+        victims, freed = [], 0
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            if freed >= overflow:
+                break
+            if key != keep:
+                victims.append((key,))
+                freed += size
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        return len(victims)
+
+    def _start_compactor(self):
+        with self._lock:
+            if self._compactor_pid == os.getpid() or self.compact_interval <= 0:
+                return
+            self._compactor_pid = os.getpid()
+        threading.Thread(target=self._compact_periodically, name="disk-store-compactor", daemon=True).start()
+
+    def _compact_periodically(self):
+        while True:
+            time.sleep(self.compact_interval)
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                print(f"Error compacting {self.path}: {e}")
+
+
+class _Transaction:
+    """``BEGIN IMMEDIATE`` ... ``COMMIT``, rolled back if the block raises."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(path, max_bytes=DISK_STORE_MAX_BYTES):
+    """The process-wide ``DiskStore`` for ``path``, opened on first use."""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = DiskStore(path, max_bytes)
+        return store
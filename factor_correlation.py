@@ -0,0 +1,245 @@
+"""Low-rank factor model of asset correlations.
+
+The exact path correlates daily prices with ``DataFrame.corr()`` and averages
+each column of the k x k matrix, which is quadratic in the basket size. This
+model is fitted once per market snapshot on the whole universe's history: the
+standardized price series are reduced to ``n_factors`` principal factors, so
+each asset is a row of loadings ``L[i]`` and ``corr(i, j) ~ L[i] . L[j]``.
+The mean correlation of every member of a portfolio to the others is then
+``(L[i] . sum(L[members]) - |L[i]|^2) / (n - 1)``, O(k * f) in time and memory.
+
+The exact policy averages *absolute* correlations, which no low-rank model
+reproduces; the factor average is signed, so it matches whenever a basket's
+correlations are non-negative, as they nearly always are for crypto prices.
+``PricingContext`` therefore keeps the exact matrix for portfolios of up to
+``EXACT_CORRELATION_MAX_ASSETS`` and uses the model above that, provided the
+model covers every asset in the portfolio.
+
+The market refresher (``python cmc_fetcher.py``) fits the model after each
+new snapshot and stores it in Redis; workers only read it. A fit on 90 days
+of daily prices barely moves between snapshots, so workers use the stored
+model while it is younger than ``FACTOR_MODEL_MAX_AGE_SECONDS``, whichever
+snapshot it was fitted for, and price with the exact matrix otherwise.
+
+Usage::
+
+    python factor_correlation.py --fetch-days 90 --factors 3
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+FACTOR_MODEL_FACTORS = 5
+# Portfolios up to this size use the exact matrix, which is cheap at this size
+EXACT_CORRELATION_MAX_ASSETS = 32
+# Days of daily history the model is fitted on, as in get_crypto_correlation_matrix
+FACTOR_MODEL_HISTORY_DAYS = 90
+# Share of those days an asset needs prices for to be in the model
+FACTOR_MODEL_MIN_COVERAGE = 0.9
+# Stored models older than this are not used
+FACTOR_MODEL_MAX_AGE_SECONDS = int(os.getenv("FACTOR_MODEL_MAX_AGE_SECONDS", "86400"))
+# Seconds between Redis reads for a newer model once one is loaded
+FACTOR_MODEL_RECHECK_SECONDS = 60
+
+_KEY = "FACTOR_MODEL"
+
+
+class FactorCorrelationModel:
+    """Per-asset factor loadings whose inner products approximate price correlations."""
+
+    def __init__(self, symbols, loadings):
+        self.symbols = list(symbols)
+        self.loadings = loadings
+        self._positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    @classmethod
+    def fit(cls, prices, n_factors=FACTOR_MODEL_FACTORS):
+        """Fit on a (date x symbol) price DataFrame, using the dates where every price is known.
+
+        Assets priced on fewer than ``FACTOR_MODEL_MIN_COVERAGE`` of the dates
+        are left out rather than cutting every other asset's history short.
+        """
+        min_days = max(1, int(np.ceil(FACTOR_MODEL_MIN_COVERAGE * len(prices))))
+        prices = prices.dropna(axis=1, thresh=min_days).dropna()
+        values = prices.to_numpy(dtype=float)
+        std = values.std(axis=0, ddof=1)
+        keep = np.isfinite(std) & (std > 0)
+        values, symbols = values[:, keep], prices.columns[keep]
+        if values.shape[0] < 2 or values.shape[1] == 0:
+            return cls([], np.empty((0, 0)))
+
+        standardized = (values - values.mean(axis=0)) / values.std(axis=0, ddof=1)
+        # Thin SVD of the T x k data matrix: corr = V S^2 V^T / (T - 1)
+        _, singular_values, vt = np.linalg.svd(standardized, full_matrices=False)
+        n_factors = min(n_factors, len(singular_values))
+        loadings = vt[:n_factors].T * singular_values[:n_factors] / np.sqrt(values.shape[0] - 1)
+        return cls(symbols, loadings)
+
+    def __contains__(self, symbol):
+        return symbol in self._positions
+
+    def covers(self, symbols):
+        """Whether every one of ``symbols`` has loadings."""
+        return all(symbol in self._positions for symbol in symbols)
+
+    def to_json(self, snapshot_version, fitted_at):
+        return json.dumps({
+            "snapshot_version": snapshot_version,
+            "fitted_at": fitted_at,
+            "symbols": [str(symbol) for symbol in self.symbols],
+            "factors": self.loadings.shape[1],
+            "loadings": self.loadings.tolist(),
+        })
+
+    @classmethod
+    def from_json(cls, raw):
+        """The stored model and when it was fitted (a Unix timestamp)."""
+        data = json.loads(raw)
+        loadings = np.array(data["loadings"], dtype=float).reshape(len(data["symbols"]), data["factors"])
+        return cls(data["symbols"], loadings), data["fitted_at"]
+
+    def average_correlation(self, symbols):
+        """Mean model correlation of each of ``symbols`` to the other known ones, NaN where unknown."""
+        averages = np.full(len(symbols), np.nan)
+        known = [i for i, symbol in enumerate(symbols) if symbol in self._positions]
+        if len(known) < 2:
+            return averages
+        loadings = self.loadings[[self._positions[symbols[i]] for i in known]]
+        totals = loadings @ loadings.sum(axis=0) - np.einsum('if,if->i', loadings, loadings)
+        averages[known] = totals / (len(known) - 1)
+        return averages
+
+    def matrix(self, symbols):
+        """Model correlation matrix for ``symbols`` (k x k, for validation and small baskets)."""
+        symbols = [symbol for symbol in symbols if symbol in self._positions]
+        loadings = self.loadings[[self._positions[symbol] for symbol in symbols]]
+        matrix = loadings @ loadings.T
+        np.fill_diagonal(matrix, 1.0)
+        return pd.DataFrame(matrix, index=symbols, columns=symbols)
+
+
+def validate(prices, n_factors=FACTOR_MODEL_FACTORS, sizes=(2, 3, 4, 8), samples=200, seed=0):
+    """Compare model averages with the exact matrix on random portfolios drawn from ``prices``.
+
+    Returns one row per portfolio size with the worst and mean absolute error
+    against both the signed and the absolute (policy) exact averages.
+    """
+    from pricing_engine import average_correlation
+
+    model = FactorCorrelationModel.fit(prices, n_factors)
+    exact = prices[model.symbols].corr()
+    rng = np.random.default_rng(seed)
+    rows = []
+    for size in sizes:
+        if size > len(model.symbols):
+            continue
+        signed_errors, absolute_errors = [], []
+        for _ in range(samples):
+            symbols = list(rng.choice(model.symbols, size, replace=False))
+            approx = model.average_correlation(symbols)
+            sub = exact.loc[symbols, symbols].to_numpy(dtype=float)
+            signed = (sub.sum(axis=0) - 1) / (size - 1)
+            signed_errors.append(np.abs(approx - signed))
+            absolute_errors.append(np.abs(approx - average_correlation(exact.loc[symbols, symbols], symbols)))
+        signed_errors, absolute_errors = np.concatenate(signed_errors), np.concatenate(absolute_errors)
+        rows.append({
+            "size": size,
+            "max_error": signed_errors.max(),
+            "mean_error": signed_errors.mean(),
+            "max_error_vs_abs": absolute_errors.max(),
+            "mean_error_vs_abs": absolute_errors.mean(),
+        })
+    return pd.DataFrame(rows)
+
+
+# The model this process last read from Redis, when it was fitted, and when Redis was read
+_model = None
+_model_fitted_at = None
+_checked_at = 0.0
+_fit_lock = threading.Lock()
+
+
+def get_correlation_model(max_age_seconds=FACTOR_MODEL_MAX_AGE_SECONDS):
+    """The newest stored factor model, or None if none is younger than ``max_age_seconds``."""
+    global _model, _model_fitted_at, _checked_at
+    now = time.time()
+    if _model is None or now - _checked_at >= FACTOR_MODEL_RECHECK_SECONDS:
+        import redis
+        from cmc_fetcher import r
+
+        try:
+            raw = r.get(_KEY)
+        except redis.RedisError as e:
+            print(f"Error reading factor model: {e}")
+            raw = None
+        if raw:
+            _model, _model_fitted_at = FactorCorrelationModel.from_json(raw)
+            _checked_at = now
+    if _model is None or now - _model_fitted_at > max_age_seconds:
+        return None
+    return _model
+
+
+def fit_and_store(market_df, snapshot_version):
+    """Fit the model on the history of the listing's symbols and store it for the workers."""
+    from cmc_fetcher import r
+    from coingecko_fetcher import get_daily_history
+
+    symbols = list(dict.fromkeys(market_df['Symbol']))
+    prices, _ = get_daily_history(symbols, days=FACTOR_MODEL_HISTORY_DAYS)
+    model = FactorCorrelationModel.fit(prices)
+    r.set(_KEY, model.to_json(snapshot_version, time.time()))
+    return model
+
+
+def fit_in_background(market_df, snapshot_version):
+    """Refresh hook: fit the model in a thread unless a fit is still running."""
+    if not _fit_lock.acquire(blocking=False):
+        print(f"Factor model fit still running, skipping snapshot {snapshot_version}")
+        return
+
+    def _run():
+        try:
+            model = fit_and_store(market_df, snapshot_version)
+            print(f"Fitted factor model on {len(model.symbols)} assets for snapshot {snapshot_version}")
+        except Exception as e:
+            print(f"Error fitting factor model for snapshot {snapshot_version}: {e}")
+        finally:
+            _fit_lock.release()
+
+    threading.Thread(target=_run, name="factor-model-fit", daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the factor correlation model against the exact matrix.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--history", help="snapshot file whose history window to use")
+    source.add_argument("--fetch-days", type=int, help="fetch this many days of daily history from CoinGecko")
+    parser.add_argument("--factors", type=int, default=FACTOR_MODEL_FACTORS)
+    parser.add_argument("--samples", type=int, default=200, help="random portfolios per size")
+    args = parser.parse_args()
+
+    if args.history:
+        from market_snapshots import load_snapshot
+
+        _, history = load_snapshot(args.history)
+        if history is None:
+            parser.error(f"{args.history} has no history window")
+        prices = history[0]
+    else:
+        from coingecko_fetcher import COIN_ID_MAP, get_daily_history
+
+        prices, _ = get_daily_history(list(COIN_ID_MAP), days=args.fetch_days)
+
+    result = validate(prices, args.factors, samples=args.samples)
+    print(f"{args.factors}-factor model on {prices.shape[1]} assets, {len(prices.dropna())} days")
+    print(result.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+
+
+if __name__ == "__main__":
+    main()
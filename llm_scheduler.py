@@ -0,0 +1,223 @@
+"""Admission control for LLM agent runs.
+
+Every ``research_agent.run`` goes through one ``LLMScheduler`` per process.
+It caps concurrent runs, spends a tokens-per-minute budget sized to the
+Groq quota, serves interactive requests before batch re-pricing, and sheds
+load when the queue is full, when the budget can't admit a run within its
+timeout, or when a request has waited too long. Callers catch
+``QueueFull`` and answer with the deterministic quote instead.
+
+The budget is per process. The market refresher spends its own
+``ASSET_ANALYSIS_TOKENS_PER_MINUTE`` warming per-asset analyses (see
+``asset_analysis``), so set ``LLM_TOKENS_PER_MINUTE`` to what is left of
+the provider quota divided by the worker count. The defaults split Groq's
+6000 tokens per minute between one worker and the refresher.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "batch": PRIORITY_BATCH}
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "16"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "5400"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "5"))
+
+# Recent queue waits kept for the wait-time percentiles in stats()
+WAIT_SAMPLES = 200
+
+
+class QueueFull(Exception):
+    """Raised when a run is shed instead of being admitted."""
+
+
+class TokenBudget:
+    """Token bucket refilled continuously at ``tokens_per_minute``."""
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def seconds_until(self, tokens):
+        """Time until ``tokens`` are available (capped at a full bucket)."""
+        self.refill()
+        missing = min(tokens, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def spend(self, tokens):
+        self.refill()
+        self.tokens -= tokens
+
+
+class _Waiter:
+    def __init__(self, priority, tokens):
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.shed = False
+
+
+class LLMScheduler:
+    """Bounded, prioritized, token-budgeted gate in front of LLM calls."""
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE,
+                 tokens_per_minute=LLM_TOKENS_PER_MINUTE, queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.budget = TokenBudget(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._admitted = 0
+        self._shed = 0
+
+    def run(self, fn, estimated_tokens, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """Run ``fn()`` once admitted and return ``(result, wait_seconds)``.
+
+        Raises ``QueueFull`` if the run is shed. Once the real usage is known,
+        ``charge`` the difference from ``estimated_tokens``.
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        waiter = self._enqueue(priority, estimated_tokens, timeout)
+        wait_seconds = self._wait_for_admission(waiter, timeout)
+        try:
+            result = fn()
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
+        return result, wait_seconds
+
+    def charge(self, tokens):
+        """Correct the budget once a run's real usage is known (negative refunds)."""
+        with self._cond:
+            self.budget.spend(tokens)
+            self._cond.notify_all()
+
+    def stats(self):
+        """Queue depth, running count, wait times and shed count."""
+        with self._cond:
+            queued = [waiter for _, _, waiter in self._queue if not waiter.shed]
+            waits = sorted(self._waits)
+            now = time.monotonic()
+            self.budget.refill()
+            return {
+                "running": self._running,
+                "max_concurrency": self.max_concurrency,
+                "queued": len(queued),
+                "queued_by_priority": {
+                    name: sum(1 for waiter in queued if waiter.priority == level)
+                    for name, level in PRIORITIES.items()
+                },
+                "oldest_wait_seconds": max((now - waiter.enqueued_at for waiter in queued), default=0.0),
+                "wait_p50_seconds": _percentile(waits, 0.5),
+                "wait_p95_seconds": _percentile(waits, 0.95),
+                "tokens_available": round(self.budget.tokens),
+                "admitted": self._admitted,
+                "shed": self._shed,
+            }
+
+    def _enqueue(self, priority, tokens, timeout):
+        with self._cond:
+            live = [entry for entry in self._queue if not entry[2].shed]
+            # Shed at once if the budget can't cover this run and those ahead of it in time
+            budget_wait = self._budget_wait(priority, tokens, live)
+            if budget_wait > timeout:
+                self._shed += 1
+                raise QueueFull(f"LLM run would wait about {budget_wait:.0f}s for tokens")
+            if len(live) >= self.max_queue:
+                # Make room by shedding the newest lower-priority waiter, if any
+                victims = [entry for entry in live if entry[0] > priority]
+                if not victims:
+                    self._shed += 1
+                    raise QueueFull("LLM queue is full")
+                victim = max(victims, key=lambda entry: (entry[0], entry[1]))[2]
+                victim.shed = True
+                self._cond.notify_all()
+            waiter = _Waiter(priority, tokens)
+            heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+            # A new head of the queue changes who should be admitted next
+            self._cond.notify_all()
+            return waiter
+
+    def _wait_for_admission(self, waiter, timeout):
+        deadline = waiter.enqueued_at + timeout
+        with self._cond:
+            while True:
+                self._drop_shed_head()
+                if waiter.shed:
+                    self._shed += 1
+                    raise QueueFull("LLM run shed for higher-priority work")
+                now = time.monotonic()
+                if now >= deadline:
+                    waiter.shed = True
+                    self._shed += 1
+                    self._cond.notify_all()
+                    raise QueueFull(f"LLM run waited more than {timeout:.0f}s for admission")
+
+                wait = deadline - now
+                if self._queue[0][2] is waiter and self._running < self.max_concurrency:
+                    budget_wait = self.budget.seconds_until(waiter.tokens)
+                    if budget_wait == 0:
+                        heapq.heappop(self._queue)
+                        self.budget.spend(waiter.tokens)
+                        self._running += 1
+                        self._admitted += 1
+                        waited = now - waiter.enqueued_at
+                        self._waits.append(waited)
+                        # The next waiter is now at the head and may be admissible already
+                        self._cond.notify_all()
+                        return waited
+                    wait = min(wait, budget_wait)
+                self._cond.wait(wait)
+
+    def _budget_wait(self, priority, tokens, live):
+        """Seconds of refill before the budget covers ``tokens`` after every waiter ahead."""
+        ahead = sum(min(entry[2].tokens, self.budget.capacity) for entry in live if entry[0] <= priority)
+        self.budget.refill()
+        missing = ahead + min(tokens, self.budget.capacity) - self.budget.tokens
+        return max(0.0, missing / self.budget.rate)
+
+    def _drop_shed_head(self):
+        while self._queue and self._queue[0][2].shed:
+            heapq.heappop(self._queue)
+            self._cond.notify_all()
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def usage_tokens(response):
+    """Total tokens reported by an agno run response, or None if unavailable."""
+    metrics = getattr(response, "metrics", None) or {}
+    total = metrics.get("total_tokens") if isinstance(metrics, dict) else None
+    if isinstance(total, (list, tuple)):
+        total = sum(total)
+    return total if isinstance(total, (int, float)) else None
+
+
+def estimate_tokens(text, expected_output_tokens=800):
+    """Rough token count for a prompt (about 4 characters per token) plus its answer."""
+    return len(text) // 4 + expected_output_tokens
+
+
+scheduler = LLMScheduler()
@@ -0,0 +1,384 @@
+"""Load test ``api.py`` against local stand-ins for Redis, CMC, CoinGecko and the LLM.
+
+Starts the ``stub_services`` stand-ins, launches the API under gunicorn
+pointed at them, and drives ``/api/calculate-loan`` at each target rate.
+Requests are sent open-loop on a fixed schedule and latency is measured from
+the scheduled send time, so a saturated server shows up as latency rather
+than as a lower offered rate. Each stage reports throughput, p50/p95/p99
+latency, error rate and the peak RSS of every gunicorn worker.
+
+Usage::
+
+    python loadtest.py --rates 2 5 10 --duration 30 --workers 4 --llm-latency 2
+    python loadtest.py --rates 5 10 --save-baseline loadtest-baseline.json
+    python loadtest.py --rates 5 10 --baseline loadtest-baseline.json
+    python loadtest.py --rates 20 --env LLM_TOKENS_PER_MINUTE=600000 --env LLM_MAX_CONCURRENCY=16
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from portfolios import SAMPLE_PORTFOLIOS
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Loan terms offered by the UI
+LOAN_TERMS = [6, 12, 24, 36]
+# Share of requests that use a sample portfolio's tokens rather than a random basket
+SAMPLE_PORTFOLIO_SHARE = 0.5
+# A run regresses when throughput drops or p95 latency rises by more than this fraction
+DEFAULT_TOLERANCE = 0.10
+# ... or when the error rate rises by more than this many points
+ERROR_RATE_TOLERANCE = 0.01
+
+MEMORY_SAMPLE_SECONDS = 1.0
+STARTUP_TIMEOUT_SECONDS = 90
+
+
+def start_stubs(llm_latency, llm_jitter, upstream_latency, seed):
+    """Start every stand-in; return ``(servers, env)`` with the env vars that point the API at them."""
+    from stub_services import (
+        FakeCMCHandler,
+        FakeCoinGeckoHandler,
+        FakeLLMHandler,
+        FakeRedisServer,
+        fake_listing,
+        start_http_stub,
+    )
+
+    listing = fake_listing(seed=seed)
+    servers = {
+        "redis": FakeRedisServer().start(),
+        "cmc": start_http_stub(FakeCMCHandler, listing=listing, latency=upstream_latency),
+        "coingecko": start_http_stub(FakeCoinGeckoHandler, latency=upstream_latency),
+        "llm": start_http_stub(FakeLLMHandler, latency=llm_latency, jitter=llm_jitter),
+    }
+
+    def url(name):
+        host, port = servers[name].server_address[:2]
+        return f"http://{host}:{port}"
+
+    env = {
+        "REDIS_HOST": servers["redis"].server_address[0],
+        "REDIS_PORT": str(servers["redis"].server_address[1]),
+        "REDIS_USERNAME": "",
+        "REDIS_PASSWORD": "",
+        "CMC_API_URL": url("cmc"),
+        "CMC_API_KEY": "loadtest",
+        "COINGECKO_API_URL": f"{url('coingecko')}/api/v3",
+        "GROQ_BASE_URL": url("llm"),
+        "GROQ_API_KEY": "loadtest",
+        "PHI_API_KEY": "loadtest",
+        "CMC_REPLAY_SNAPSHOT": "",
+        "SNAPSHOT_RECORD_DIR": "",
+    }
+    return servers, env, listing
+
+
+def seed_market_data(redis_server, listing):
+    """Store the fake listing the way the refresher does, so workers read it from Redis."""
+    payload = json.dumps(listing).encode()
+    with redis_server.lock:
+        redis_server.data[b"CMC_DATA"] = payload
+        redis_server.data[b"CMC_DATA_VERSION"] = b"loadtest"
+
+
+def start_api(env, port, workers, threads, cwd):
+    """Launch ``api:app`` under gunicorn and wait until it answers the health check."""
+    command = [
+        sys.executable, "-m", "gunicorn",
+        "--pythonpath", REPO_DIR,
+        "--workers", str(workers),
+        "--threads", str(threads),
+        "--bind", f"127.0.0.1:{port}",
+        "--timeout", "120",
+        "api:app",
+    ]
+    process = subprocess.Popen(command, cwd=cwd, env={**os.environ, **env})
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/api", timeout=1).ok and len(worker_pids(process.pid)) >= workers:
+                return process, base_url
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"API did not come up within {STARTUP_TIMEOUT_SECONDS}s")
+
+
+def worker_pids(master_pid):
+    """PIDs of the gunicorn workers forked by ``master_pid`` (Linux /proc only)."""
+    pids = []
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, so split after its closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master_pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def rss_mb(pid):
+    """Resident memory of ``pid`` in MB, or None if it can't be read."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler:
+    """Tracks the peak RSS of each gunicorn worker while a stage runs."""
+
+    def __init__(self, master_pid, interval=MEMORY_SAMPLE_SECONDS):
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            for pid in worker_pids(self.master_pid):
+                rss = rss_mb(pid)
+                if rss is not None:
+                    self.peaks[pid] = max(rss, self.peaks.get(pid, 0.0))
+            if self._stop.wait(self.interval):
+                return
+
+
+def request_payloads(listing, seed):
+    """Endless stream of loan requests: sample portfolio baskets and random top-token baskets."""
+    rng = random.Random(seed)
+    top_tokens = [coin["symbol"] for coin in listing[:20]]
+    sample_baskets = [list(portfolio) for portfolio in SAMPLE_PORTFOLIOS.values()]
+    while True:
+        if rng.random() < SAMPLE_PORTFOLIO_SHARE:
+            tokens = rng.choice(sample_baskets)
+        else:
+            tokens = rng.sample(top_tokens, rng.randint(1, 4))
+        yield {
+            "totalPortfolioValue": rng.randrange(100_000, 5_000_000, 1_000),
+            "listOfSelectedTokens": tokens,
+            "months": rng.choice(LOAN_TERMS),
+            "payout": "USDC",
+            "inception_date": "2024-01-01",
+            "bank": "Load Test Bank",
+        }
+
+
+def run_stage(base_url, rate, duration, concurrency, payloads, timeout):
+    """Offer ``rate`` requests/second for ``duration`` seconds; return the raw samples."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    latencies, errors = [], {}
+    lock = threading.Lock()
+
+    def send(scheduled_at, payload):
+        try:
+            response = session.post(f"{base_url}/api/calculate-loan", json=payload, timeout=timeout)
+            outcome = None if response.status_code == 200 else f"HTTP {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            outcome = type(e).__name__
+        elapsed = time.monotonic() - scheduled_at
+        with lock:
+            if outcome is None:
+                latencies.append(elapsed)
+            else:
+                errors[outcome] = errors.get(outcome, 0) + 1
+
+    total = int(rate * duration)
+    started_at = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            scheduled_at = started_at + i / rate
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, scheduled_at, next(payloads))
+    return latencies, errors, total, time.monotonic() - started_at
+
+
+def summarize(rate, latencies, errors, sent, elapsed, memory_peaks):
+    """Stage statistics as a flat, JSON-serializable dict."""
+    failed = sum(errors.values())
+    latencies_ms = np.array(latencies) * 1000
+    percentiles = np.percentile(latencies_ms, [50, 95, 99]).tolist() if len(latencies_ms) else [None] * 3
+    peaks = list(memory_peaks.values())
+    return {
+        "rate": rate,
+        "sent": sent,
+        "ok": len(latencies),
+        "errors": errors,
+        "error_rate": failed / sent if sent else 0.0,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentiles[0],
+        "p95_ms": percentiles[1],
+        "p99_ms": percentiles[2],
+        "workers": len(peaks),
+        "worker_peak_rss_mb": max(peaks) if peaks else None,
+        "worker_mean_peak_rss_mb": sum(peaks) / len(peaks) if peaks else None,
+    }
+
+
+def compare(stages, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compare stages to a saved baseline by rate; return ``(rows, regressions)``."""
+    previous = {stage["rate"]: stage for stage in baseline["stages"]}
+    rows, regressions = [], []
+    for stage in stages:
+        old = previous.get(stage["rate"])
+        if old is None:
+            continue
+        metrics = ("throughput", "p50_ms", "p95_ms", "p99_ms", "error_rate", "worker_peak_rss_mb")
+        rows.append({"rate": stage["rate"], "metrics": {key: (old[key], stage[key]) for key in metrics}})
+
+        if old["throughput"] and stage["throughput"] < old["throughput"] * (1 - tolerance):
+            regressions.append(f"{stage['rate']:g}/s: throughput {old['throughput']:.2f} -> {stage['throughput']:.2f}")
+        if old["p95_ms"] and stage["p95_ms"] and stage["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{stage['rate']:g}/s: p95 {old['p95_ms']:.0f}ms -> {stage['p95_ms']:.0f}ms")
+        if stage["error_rate"] > old["error_rate"] + ERROR_RATE_TOLERANCE:
+            regressions.append(f"{stage['rate']:g}/s: error rate {old['error_rate']:.2%} -> {stage['error_rate']:.2%}")
+    return rows, regressions
+
+
+def _format(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(stages):
+    print(f"{'rate/s':>7} {'sent':>6} {'ok/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'peak RSS MB':>12}")
+    for stage in stages:
+        print(
+            f"{stage['rate']:>7g} {stage['sent']:>6} {stage['throughput']:>7.2f} "
+            f"{_format(stage['p50_ms'], '8.0f')} {_format(stage['p95_ms'], '8.0f')} {_format(stage['p99_ms'], '8.0f')} "
+            f"{stage['error_rate']:>7.2%} {_format(stage['worker_peak_rss_mb'], '12.1f')}"
+        )
+        if stage["errors"]:
+            print(f"{'':>7} errors: {', '.join(f'{name} x{count}' for name, count in stage['errors'].items())}")
+
+
+def print_comparison(rows):
+    print(f"\n{'rate/s':>7} {'metric':<20} {'baseline':>10} {'current':>10} {'change':>8}")
+    for row in rows:
+        for key, (old, new) in row["metrics"].items():
+            change = f"{(new - old) / old:+.1%}" if old and new is not None else "-"
+            print(f"{row['rate']:>7g} {key:<20} {_format(old, '10.2f')} {_format(new, '10.2f')} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test api.py against local stand-ins for its upstreams.")
+    parser.add_argument("--rates", type=float, nargs="+", default=[1, 2, 5], help="offered requests/second, one stage each")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per stage")
+    parser.add_argument("--warmup", type=float, default=5, help="unrecorded seconds at the first rate")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="threads per gunicorn worker")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--url", help="drive an already running API instead of starting one")
+    parser.add_argument("--concurrency", type=int, default=64, help="client connections in flight")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout in seconds")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds the fake LLM takes per call")
+    parser.add_argument("--llm-jitter", type=float, default=0.5, help="extra random fake LLM latency, up to this many seconds")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="seconds the fake CMC/CoinGecko take per call")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the API workers, e.g. LLM_TOKENS_PER_MINUTE=60000")
+    parser.add_argument("--cold", action="store_true", help="don't seed Redis, so every request fetches the listing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save-baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed fractional throughput drop / p95 rise before the run fails")
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    servers, env, listing = start_stubs(args.llm_latency, args.llm_jitter, args.upstream_latency, args.seed)
+    env.update(extra_env)
+    if not args.cold:
+        seed_market_data(servers["redis"], listing)
+
+    process = None
+    workdir = tempfile.TemporaryDirectory(prefix="loadtest-")
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+            print("Driving an external API; point it at the stand-ins with:")
+            for key, value in env.items():
+                print(f"  {key}={value}")
+        else:
+            # Run from a scratch directory so response cache files don't leak between runs
+            process, base_url = start_api(env, args.port, args.workers, args.threads, workdir.name)
+
+        payloads = request_payloads(listing, args.seed)
+        if args.warmup > 0:
+            run_stage(base_url, args.rates[0], args.warmup, args.concurrency, payloads, args.timeout)
+
+        stages = []
+        for rate in args.rates:
+            with MemorySampler(process.pid if process else -1) as memory:
+                samples = run_stage(base_url, rate, args.duration, args.concurrency, payloads, args.timeout)
+            stages.append(summarize(rate, *samples, memory.peaks))
+            print(f"Finished {rate:g}/s stage")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        for server in servers.values():
+            server.shutdown()
+        workdir.cleanup()
+
+    print(f"\n{args.workers} workers x {args.threads} threads, {args.duration:g}s stages, "
+          f"LLM latency {args.llm_latency:g}s (+{args.llm_jitter:g}s)\n")
+    print_report(stages)
+
+    config = {key: getattr(args, key) for key in ("workers", "threads", "duration", "llm_latency", "llm_jitter",
+                                                   "upstream_latency", "cold", "seed", "concurrency")}
+    config["env"] = extra_env
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"config": config, "stages": stages}, f, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print(f"\nWarning: baseline was recorded with {baseline['config']}")
+        rows, regressions = compare(stages, baseline, args.tolerance)
+        print_comparison(rows)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Record and replay CoinMarketCap snapshots.
+
+Each snapshot is one compressed ``.npz`` file holding the listing columns
+returned by ``fetch_data_app`` as typed arrays, plus an optional daily
+price/market-cap history window. Files are named
+``<UTC timestamp>-<content digest>.npz`` so a directory of them sorts by time
+and an unchanged listing is never stored twice.
+
+Usage::
+
+    python market_snapshots.py record --directory snapshots --history-days 90
+"""
+import argparse
+import datetime
+import glob
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+
+# Listing column -> array name inside the snapshot file
+LISTING_FIELDS = {
+    'Last Price': 'price',
+    '24h Change (%)': 'change_24h',
+    '7d Change (%)': 'change_7d',
+    '30d Change (%)': 'change_30d',
+    '90d Change (%)': 'change_90d',
+    'Market Cap': 'market_cap',
+}
+
+# (directory, digest) pairs known to be on disk, so repeats skip the glob
+_recorded_digests = set()
+
+
+def snapshot_digest(df):
+    """Short content digest of a listing DataFrame."""
+    digest = hashlib.sha1(df['Symbol'].astype(str).str.cat(sep=',').encode())
+    for column in LISTING_FIELDS:
+        digest.update(np.ascontiguousarray(df[column].to_numpy(dtype=float)).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def record_snapshot(df, history=None, directory=SNAPSHOT_DIR, timestamp=None):
+    """Store a listing snapshot and optional history window; return the file path.
+
+    ``history`` is a ``(prices, market_caps)`` pair of (date x symbol)
+    DataFrames as returned by ``coingecko_fetcher.get_daily_history``.
+    Returns None when an identical listing was already recorded.
+    """
+    digest = snapshot_digest(df)
+    recorded = (os.path.abspath(directory), digest)
+    if recorded in _recorded_digests or glob.glob(os.path.join(directory, f"*-{digest}.npz")):
+        _recorded_digests.add(recorded)
+        return None
+
+    timestamp = timestamp or datetime.datetime.now(datetime.timezone.utc)
+    arrays = {
+        'timestamp': np.array(int(timestamp.timestamp()), dtype=np.int64),
+        'symbols': df['Symbol'].to_numpy(dtype=str),
+        'names': df['Name'].to_numpy(dtype=str),
+    }
+    for column, name in LISTING_FIELDS.items():
+        arrays[name] = df[column].to_numpy(dtype=float)
+
+    if history is not None:
+        prices, market_caps = history
+        market_caps = market_caps.reindex(index=prices.index, columns=prices.columns)
+        arrays['history_symbols'] = prices.columns.to_numpy(dtype=str)
+        arrays['history_dates'] = (prices.index.to_numpy(dtype='datetime64[s]')).astype(np.int64)
+        arrays['history_prices'] = prices.to_numpy(dtype=float)
+        arrays['history_market_caps'] = market_caps.to_numpy(dtype=float)
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{timestamp.strftime('%Y%m%dT%H%M%SZ')}-{digest}.npz")
+    # Write under a temporary name first so readers never see a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+    _recorded_digests.add(recorded)
+    return path
+
+
+def load_snapshot(path):
+    """Load a recorded snapshot as ``(listing_df, history)``.
+
+    ``listing_df`` has the same columns as ``fetch_data_app``; ``history`` is a
+    ``(prices, market_caps)`` pair, or None when no window was recorded.
+    """
+    with np.load(path) as data:
+        listing = {'Name': data['names'], 'Symbol': data['symbols']}
+        for column, name in LISTING_FIELDS.items():
+            listing[column] = data[name]
+        df = pd.DataFrame(listing)[['Name', 'Symbol', *LISTING_FIELDS]]
+
+        history = None
+        if 'history_prices' in data:
+            index = pd.to_datetime(data['history_dates'], unit='s')
+            columns = data['history_symbols']
+            history = (
+                pd.DataFrame(data['history_prices'], index=index, columns=columns),
+                pd.DataFrame(data['history_market_caps'], index=index, columns=columns),
+            )
+    return df, history
+
+
+def snapshot_time(path):
+    """Recording time of a snapshot file, read from its name."""
+    stamp = os.path.basename(path).split('-')[0]
+    return pd.Timestamp(datetime.datetime.strptime(stamp, '%Y%m%dT%H%M%SZ'))
+
+
+def list_snapshots(directory=SNAPSHOT_DIR):
+    """Snapshot files in ``directory``, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, '*.npz')))
+
+
+def load_panel(directory=SNAPSHOT_DIR):
+    """Stack daily snapshots into (date x symbol) DataFrames, one per listing field.
+
+    When several snapshots fall on the same day the last one wins. Returns a
+    dict keyed by the array names in ``LISTING_FIELDS``.
+    """
+    frames = {name: {} for name in LISTING_FIELDS.values()}
+    for path in list_snapshots(directory):
+        day = snapshot_time(path).normalize()
+        with np.load(path) as data:
+            symbols = data['symbols']
+            for name in frames:
+                frames[name][day] = pd.Series(data[name], index=symbols).groupby(level=0).first()
+    return {name: pd.DataFrame(rows).T.sort_index() for name, rows in frames.items()}
+
+
+def panel_from_history(prices, market_caps):
+    """Build the ``load_panel`` layout from daily price and market-cap history.
+
+    Percent changes are derived from the prices the same way CoinMarketCap
+    reports them, so history predating the recorder can be backtested too.
+    """
+    prices = prices.sort_index().ffill()
+    return {
+        'price': prices,
+        'change_24h': prices.pct_change(1, fill_method=None) * 100,
+        'change_7d': prices.pct_change(7, fill_method=None) * 100,
+        'change_30d': prices.pct_change(30, fill_method=None) * 100,
+        'change_90d': prices.pct_change(90, fill_method=None) * 100,
+        'market_cap': market_caps.reindex(index=prices.index, columns=prices.columns).ffill(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record the current CoinMarketCap snapshot.")
+    parser.add_argument("command", choices=["record"])
+    parser.add_argument("--directory", default=SNAPSHOT_DIR)
+    parser.add_argument("--history-days", type=int, default=90,
+                        help="days of daily history to store with the snapshot, 0 to skip")
+    args = parser.parse_args()
+
+    from cmc_fetcher import fetch_data_app
+    from coingecko_fetcher import COIN_ID_MAP, get_daily_history
+
+    # Recorded below together with its history, not by the fetch itself
+    df = fetch_data_app(record=False)
+    history = None
+    if args.history_days > 0:
+        symbols = [symbol for symbol in df['Symbol'] if symbol in COIN_ID_MAP]
+        history = get_daily_history(symbols, days=args.history_days)
+    path = record_snapshot(df, history, directory=args.directory)
+    print(path or "Snapshot unchanged, nothing recorded.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Shared pricing engine for the Aetherum loan calculators.
+
+A request builds one ``PricingContext`` from the market snapshot: volatility
+scores, market-cap ranks, quantile tiers and correlations are derived once
+and held as arrays aligned with the portfolio symbols. Rule sets are plain
+functions over that context, so pricing a portfolio under several policies
+makes no extra passes over the market data.
+
+The policy helpers work on NumPy arrays with assets on the last axis and also
+accept 2-D (dates x assets) inputs, which the backtester relies on.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+from coingecko_fetcher import get_crypto_correlation_matrix
+from factor_correlation import EXACT_CORRELATION_MAX_ASSETS
+
+TIER_LABELS = ['Tier 1', 'Tier 1.5', 'Tier 2', 'Tier 3']
+LIQUIDATION_MULTIPLIER = 1.2
+
+# Quantile-tier policy (agent and aetherum_loan_calculator), as fractions
+QUANTILE_BASE_LTV = np.array([0.70, 0.60, 0.50, 0.40])
+QUANTILE_UNTIERED_LTV = 0.30
+QUANTILE_BASE_RATE = 0.03
+QUANTILE_RISK_PREMIUM = np.array([0.04, 0.045, 0.05, 0.06])
+QUANTILE_UNTIERED_PREMIUM = 0.07
+
+# Threshold-tier policy (Streamlit app), in percent like loan_calc4.py
+THRESHOLD_BASE_LTV = np.array([70, 65, 55, 45])
+THRESHOLD_BASE_RATE = 3.0
+THRESHOLD_RISK_PREMIUM = np.array([4, 4.5, 5, 6])
+
+
+def volatility_score(change_24h, change_7d, change_30d, change_90d):
+    """Blend of absolute percent changes, each scaled down by its window length."""
+    return (
+        np.abs(change_24h) +
+        np.abs(change_7d) / 7 +
+        np.abs(change_30d) / 30 +
+        np.abs(change_90d) / 90
+    )
+
+
+def quantile_tier_codes(risk_score):
+    """Quartile of each risk score along the last axis, as in ``pd.qcut(q=4)``.
+
+    Codes index ``TIER_LABELS``; -1 marks a missing score.
+    """
+    risk_score = np.asarray(risk_score, dtype=float)
+    codes = np.full(risk_score.shape, -1)
+    if risk_score.size == 0 or np.isnan(risk_score).all():
+        return codes
+    with warnings.catch_warnings():
+        # Rows without any score (e.g. dates before a listing) are expected
+        warnings.simplefilter("ignore", RuntimeWarning)
+        edges = np.nanquantile(risk_score, [0.25, 0.5, 0.75], axis=-1, keepdims=True)
+    tiers = (risk_score > edges[0]).astype(int) + (risk_score > edges[1]) + (risk_score > edges[2])
+    return np.where(np.isnan(risk_score), codes, tiers)
+
+
+def threshold_tier_codes(abs_change_24h, market_cap):
+    """Tier from fixed volatility and market-cap thresholds."""
+    return np.select(
+        [(abs_change_24h < 3) & (market_cap > 1e10), (abs_change_24h < 6) & (market_cap > 5e9), abs_change_24h < 10],
+        [0, 1, 2],
+        3,
+    )
+
+
+def tier_labels(codes):
+    """Map tier codes back to their labels, None for untiered assets."""
+    return [TIER_LABELS[code] if code >= 0 else None for code in np.asarray(codes).ravel()]
+
+
+def quantile_policy_ltv(tier_codes, volatility_scores, average_correlation):
+    """Baseline and adjusted LTVs under the quantile-tier policy.
+
+    Assets in the top volatility quartile of the portfolio lose 5 points and
+    those in the bottom quartile gain 2; a mean absolute correlation above 0.8
+    costs 5 points and one below 0.5 adds 2.
+    """
+    baseline = _lookup(QUANTILE_BASE_LTV, tier_codes, QUANTILE_UNTIERED_LTV)
+    ltv = baseline
+    if np.shape(volatility_scores)[-1] > 0:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            vol_75 = np.nanquantile(volatility_scores, 0.75, axis=-1, keepdims=True)
+            vol_25 = np.nanquantile(volatility_scores, 0.25, axis=-1, keepdims=True)
+        ltv = np.where(
+            volatility_scores > vol_75, np.maximum(0.2, baseline - 0.05),
+            np.where(volatility_scores < vol_25, np.minimum(0.85, baseline + 0.02), baseline),
+        )
+    correlation_adjustment = np.where(
+        average_correlation > 0.8, -0.05, np.where(average_correlation < 0.5, 0.02, 0.0)
+    )
+    return baseline, np.clip(ltv + correlation_adjustment, 0.2, 0.85)
+
+
+def quantile_policy_interest(tier_codes):
+    """Annual interest rate under the quantile-tier policy."""
+    return QUANTILE_BASE_RATE + _lookup(QUANTILE_RISK_PREMIUM, tier_codes, QUANTILE_UNTIERED_PREMIUM)
+
+
+def threshold_policy_ltv(tier_codes, abs_change_24h):
+    """LTV under the threshold-tier policy: -5 points above 7% daily move, +2 below 2%."""
+    adjustment = np.where(abs_change_24h > 7, -5, np.where(abs_change_24h < 2, 2, 0))
+    return np.maximum(0, THRESHOLD_BASE_LTV[tier_codes] + adjustment) / 100
+
+
+def threshold_policy_interest(tier_codes, abs_change_24h):
+    """Annual interest rate under the threshold-tier policy, +1 point above 10% daily move."""
+    adjustment = np.where(abs_change_24h > 10, 1, 0)
+    return (THRESHOLD_BASE_RATE + THRESHOLD_RISK_PREMIUM[tier_codes] + adjustment) / 100
+
+
+def add_risk_columns(df):
+    """Return a copy of the market snapshot with volatility, rank, risk score and tier columns."""
+    df = df.copy()
+    df['Volatility Score'] = volatility_score(
+        df['24h Change (%)'], df['7d Change (%)'], df['30d Change (%)'], df['90d Change (%)']
+    )
+    df['Market Cap Rank'] = df['Market Cap'].rank(ascending=False)
+    df['Risk Score'] = df['Volatility Score'] * df['Market Cap Rank']
+    df['Risk Tier'] = pd.Categorical.from_codes(
+        quantile_tier_codes(df['Risk Score'].to_numpy(dtype=float)), categories=TIER_LABELS
+    )
+    return df
+
+
+class PricingContext:
+    """Intermediates shared by every rule set, computed once per request.
+
+    Per-asset arrays follow the order of ``symbols``: the portfolio symbols
+    that are present in the market snapshot. Correlations are fetched on first
+    use, so rule sets that don't need them cost no history requests. Given a
+    ``correlation_model`` (see ``factor_correlation``), portfolios larger than
+    ``EXACT_CORRELATION_MAX_ASSETS`` take their average correlations from it
+    and never build the k x k matrix, as long as it covers all their assets.
+    """
+
+    PER_ASSET_FIELDS = (
+        'abs_change_24h', 'volatility_score', 'market_cap', 'market_cap_rank', 'risk_score', 'quantile_tier_codes'
+    )
+
+    def __init__(self, market_df, portfolio, correlation_matrix=None, correlation_model=None):
+        self.market_df = add_risk_columns(market_df)
+        rows = self.market_df.drop_duplicates('Symbol').set_index('Symbol')
+        self.symbols = [symbol for symbol in portfolio if symbol in rows.index]
+        selected = rows.loc[self.symbols]
+
+        self.amounts = np.array([portfolio[symbol] for symbol in self.symbols], dtype=float)
+        self.abs_change_24h = selected['24h Change (%)'].abs().to_numpy(dtype=float)
+        self.volatility_score = selected['Volatility Score'].to_numpy(dtype=float)
+        self.market_cap = selected['Market Cap'].to_numpy(dtype=float)
+        self.market_cap_rank = selected['Market Cap Rank'].to_numpy(dtype=float)
+        self.risk_score = selected['Risk Score'].to_numpy(dtype=float)
+        self.quantile_tier_codes = selected['Risk Tier'].cat.codes.to_numpy(dtype=int)
+
+        self.correlation_model = correlation_model
+        self._correlation_matrix = correlation_matrix
+        self._correlation_loaded = correlation_matrix is not None
+        self._average_correlation = None
+
+    def subset(self, portfolio):
+        """Context for another portfolio drawn from this one's symbols, without recomputing.
+
+        Correlations are sliced from this context's matrix if it is already
+        loaded, so a context built over a whole universe can price many
+        sub-portfolios with a single history fetch.
+        """
+        positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+        symbols = [symbol for symbol in portfolio if symbol in positions]
+        index = np.array([positions[symbol] for symbol in symbols], dtype=int)
+
+        ctx = object.__new__(PricingContext)
+        ctx.market_df = self.market_df
+        ctx.symbols = symbols
+        ctx.amounts = np.array([portfolio[symbol] for symbol in symbols], dtype=float)
+        for name in self.PER_ASSET_FIELDS:
+            setattr(ctx, name, getattr(self, name)[index])
+
+        ctx.correlation_model = self.correlation_model
+        ctx._correlation_loaded = self._correlation_loaded
+        ctx._correlation_matrix = None
+        if self._correlation_matrix is not None:
+            matrix = self._correlation_matrix
+            if isinstance(matrix, dict):
+                matrix = pd.DataFrame(matrix)
+            present = [symbol for symbol in symbols if symbol in matrix.columns]
+            ctx._correlation_matrix = matrix.loc[present, present] if present else None
+        ctx._average_correlation = None
+        return ctx
+
+    @property
+    def uses_factor_model(self):
+        """Whether average correlations come from the factor model instead of the exact matrix."""
+        return (
+            self.correlation_model is not None
+            and not self._correlation_loaded
+            and len(self.symbols) > EXACT_CORRELATION_MAX_ASSETS
+            # Assets the model has no loadings for would silently lose their adjustment
+            and self.correlation_model.covers(self.symbols)
+        )
+
+    @property
+    def correlation_matrix(self):
+        if not self._correlation_loaded:
+            self._correlation_matrix = get_crypto_correlation_matrix(self.symbols)
+            self._correlation_loaded = True
+        return self._correlation_matrix
+
+    @correlation_matrix.setter
+    def correlation_matrix(self, matrix):
+        """Use ``matrix`` (None for unknown correlations) instead of fetching history."""
+        self._correlation_matrix = matrix
+        self._correlation_loaded = True
+        self._average_correlation = None
+
+    @property
+    def average_correlation(self):
+        """Mean absolute correlation of each asset to the others, NaN where unknown."""
+        if self._average_correlation is None:
+            if self.uses_factor_model:
+                self._average_correlation = self.correlation_model.average_correlation(self.symbols)
+            else:
+                self._average_correlation = average_correlation(self.correlation_matrix, self.symbols)
+        return self._average_correlation
+
+
+def average_correlation(correlation_matrix, symbols):
+    """Mean absolute off-diagonal correlation for each of ``symbols``, NaN where unknown."""
+    averages = np.full(len(symbols), np.nan)
+    if correlation_matrix is None:
+        return averages
+    if isinstance(correlation_matrix, dict):
+        correlation_matrix = pd.DataFrame(correlation_matrix)
+    matrix = np.abs(correlation_matrix.to_numpy(dtype=float))
+    np.fill_diagonal(matrix, np.nan)
+    counts = (~np.isnan(matrix)).sum(axis=0)
+    means = np.where(counts > 0, np.nansum(matrix, axis=0) / np.maximum(counts, 1), np.nan)
+    positions = {symbol: i for i, symbol in enumerate(correlation_matrix.columns)}
+    for i, symbol in enumerate(symbols):
+        if symbol in positions:
+            averages[i] = means[positions[symbol]]
+    return averages
+
+
+def quantile_tier_rules(ctx):
+    """Quantile-tier policy used by the AI agent and ``aetherum_loan_calculator``."""
+    baseline, ltv = quantile_policy_ltv(ctx.quantile_tier_codes, ctx.volatility_score, ctx.average_correlation)
+    interest = quantile_policy_interest(ctx.quantile_tier_codes)
+    quote = _quote(ctx, ctx.quantile_tier_codes, ctx.volatility_score, baseline, ltv, interest, ctx.amounts)
+    # Large baskets priced with the factor model carry no k x k matrix
+    quote["correlation_matrix"] = None if ctx.uses_factor_model else ctx.correlation_matrix
+    # NaN for assets priced without a correlation adjustment
+    quote["average_correlation"] = ctx.average_correlation
+    return quote
+
+
+def threshold_tier_rules(ctx):
+    """Threshold-tier policy used by the Streamlit app's hard-coded rules."""
+    codes = threshold_tier_codes(ctx.abs_change_24h, ctx.market_cap)
+    ltv = threshold_policy_ltv(codes, ctx.abs_change_24h)
+    interest = threshold_policy_interest(codes, ctx.abs_change_24h)
+    return _quote(ctx, codes, ctx.abs_change_24h, ltv, ltv, interest, ctx.amounts * ltv)
+
+
+RULE_SETS = {
+    "quantile": quantile_tier_rules,
+    "threshold": threshold_tier_rules,
+}
+
+
+def evaluate(ctx, rule_sets=None):
+    """Price the context's portfolio under each named rule set (all by default)."""
+    return {name: RULE_SETS[name](ctx) for name in (rule_sets or RULE_SETS)}
+
+
+def scale_quote(quote, value):
+    """Scale a quote priced per unit of collateral to a portfolio worth ``value``."""
+    scaled = dict(quote)
+    for key in ("amounts", "loan_amounts", "total_collateral", "total_loan"):
+        scaled[key] = quote[key] * value
+    return scaled
+
+
+def _lookup(table, codes, default):
+    codes = np.asarray(codes)
+    return np.where(codes >= 0, table[np.clip(codes, 0, None)], default)
+
+
+def _quote(ctx, codes, volatility, baseline_ltv, ltv, interest, interest_weights):
+    """Per-asset arrays and portfolio totals shared by every rule set's output.
+
+    The weighted interest rate is averaged with ``interest_weights``: collateral
+    for the quantile policy, loan amounts for the threshold policy.
+    """
+    loan_amounts = ctx.amounts * ltv
+    total_collateral = float(ctx.amounts.sum())
+    total_loan = float(loan_amounts.sum())
+    weight_total = float(np.sum(interest_weights))
+    weighted_ltv = total_loan / total_collateral if total_collateral > 0 else 0.0
+    weighted_interest = float(np.sum(interest_weights * interest)) / weight_total if weight_total > 0 else 0.0
+    return {
+        "symbols": list(ctx.symbols),
+        "tiers": tier_labels(codes),
+        "volatility": volatility,
+        "amounts": ctx.amounts,
+        "baseline_ltv": baseline_ltv,
+        "ltv": ltv,
+        "interest_rate": interest,
+        "loan_amounts": loan_amounts,
+        "total_collateral": total_collateral,
+        "total_loan": total_loan,
+        "weighted_ltv": weighted_ltv,
+        "weighted_interest": weighted_interest,
+        "liquidation_ltv": weighted_ltv * LIQUIDATION_MULTIPLIER,
+    }
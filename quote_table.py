@@ -0,0 +1,151 @@
+"""Precomputed quotes for the portfolio shapes most requests use.
+
+Most traffic prices a ``SAMPLE_PORTFOLIOS`` shape or an equal-weight basket
+of top tokens. For each market snapshot the table prices every such shape
+once per unit of collateral; a matching request is then answered by a dict
+lookup and a scale by portfolio value, and anything else falls back to the
+full engine.
+"""
+import hashlib
+import itertools
+import threading
+
+import pandas as pd
+
+from portfolios import SAMPLE_PORTFOLIOS
+from pricing_engine import PricingContext, evaluate, scale_quote
+
+QUOTE_TABLE_TOP_N = 10
+QUOTE_TABLE_MAX_SIZE = 4
+
+# Weights are rounded so that amounts computed from percentages still match
+WEIGHT_DECIMALS = 6
+
+
+def shape_key(portfolio):
+    """Key of a portfolio's shape: its symbols and weights, independent of value."""
+    total = sum(portfolio.values())
+    if total <= 0:
+        return None
+    return tuple(sorted((symbol, round(amount / total, WEIGHT_DECIMALS)) for symbol, amount in portfolio.items()))
+
+
+def common_shapes(market_df, top_n=QUOTE_TABLE_TOP_N, max_size=QUOTE_TABLE_MAX_SIZE):
+    """Sample portfolios plus every equal-weight basket of up to ``max_size`` top tokens."""
+    shapes = [
+        {symbol: amount / sum(portfolio.values()) for symbol, amount in portfolio.items()}
+        for portfolio in SAMPLE_PORTFOLIOS.values()
+    ]
+    top_tokens = list(dict.fromkeys(market_df['Symbol'].head(top_n)))
+    for size in range(1, max_size + 1):
+        for tokens in itertools.combinations(top_tokens, size):
+            shapes.append({token: 1 / size for token in tokens})
+    return shapes
+
+
+class QuoteTable:
+    """Per-unit-value quotes of every rule set for common shapes on one snapshot."""
+
+    def __init__(self, snapshot_version, entries, correlation_matrix=None):
+        self.snapshot_version = snapshot_version
+        self.entries = entries
+        # Correlations of the whole universe, kept as a fallback for requests whose own fetch runs late
+        self.correlation_matrix = correlation_matrix
+
+    @classmethod
+    def build(cls, market_df, snapshot_version, top_n=QUOTE_TABLE_TOP_N, max_size=QUOTE_TABLE_MAX_SIZE):
+        """Price every common shape with one context and one correlation fetch."""
+        shapes = common_shapes(market_df, top_n, max_size)
+        universe = {symbol: 1.0 for shape in shapes for symbol in shape}
+        context = PricingContext(market_df, universe)
+        context.correlation_matrix  # fetch once for the whole universe before slicing
+
+        entries = {}
+        for shape in shapes:
+            sub_context = context.subset(shape)
+            # Shapes with symbols missing from the snapshot go through the full engine
+            if len(sub_context.symbols) == len(shape):
+                entries[shape_key(shape)] = evaluate(sub_context)
+        return cls(snapshot_version, entries, context.correlation_matrix)
+
+    def lookup(self, portfolio):
+        """Quotes of every rule set for ``portfolio``, or None when its shape isn't in the table."""
+        entry = self.entries.get(shape_key(portfolio))
+        if entry is None:
+            return None
+        value = sum(portfolio.values())
+        return {name: scale_quote(quote, value) for name, quote in entry.items()}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+_table = None
+_building_version = None
+_lock = threading.Lock()
+
+
+def table_version(market_df, snapshot_version):
+    """Version a table is built for: the snapshot's, or a digest of the listing for live reads.
+
+    Live versions (``live-<window>``) change every window whether or not the
+    listing did, and would rebuild the table each time.
+    """
+    if not snapshot_version.startswith("live-"):
+        return snapshot_version
+    digest = hashlib.sha1(pd.util.hash_pandas_object(market_df, index=False).to_numpy().tobytes())
+    return f"listing-{digest.hexdigest()[:16]}"
+
+
+def lookup_quotes(portfolio, market_df, snapshot_version):
+    """Look ``portfolio`` up in the table for ``snapshot_version``.
+
+    When the snapshot has moved on, a rebuild starts in the background and
+    None is returned until it finishes, so requests never wait on it.
+    """
+    version = table_version(market_df, snapshot_version)
+    table = _table
+    if table is not None and table.snapshot_version == version:
+        return table.lookup(portfolio)
+    rebuild_in_background(market_df, version)
+    return None
+
+
+def cached_correlation_matrix(symbols):
+    """Correlations of ``symbols`` from the latest table, whatever its snapshot, or None.
+
+    Ninety days of history barely move between snapshots, so a previous
+    table's matrix is a fair stand-in. None unless it covers at least two of
+    ``symbols``.
+    """
+    matrix = _table.correlation_matrix if _table is not None else None
+    if matrix is None:
+        return None
+    present = [symbol for symbol in symbols if symbol in matrix.columns]
+    return matrix.loc[present, present] if len(present) >= 2 else None
+
+
+def rebuild_in_background(market_df, snapshot_version):
+    """Start building the table for ``snapshot_version`` unless it is built or being built."""
+    global _building_version
+    with _lock:
+        if _building_version != snapshot_version:
+            _building_version = snapshot_version
+            threading.Thread(
+                target=_rebuild, args=(market_df, snapshot_version), name="quote-table-build", daemon=True
+            ).start()
+
+
+def _rebuild(market_df, snapshot_version):
+    global _table, _building_version
+    try:
+        table = QuoteTable.build(market_df, snapshot_version)
+    except Exception as e:
+        print(f"Error building quote table for snapshot {snapshot_version}: {e}")
+        with _lock:
+            if _building_version == snapshot_version:
+                _building_version = None  # let the next request retry
+        return
+    with _lock:
+        if _building_version == snapshot_version:
+            _table = table
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import threading
+import time
+
+
+class IdempotencyKeyConflict(Exception):
+    """Raised when an idempotency key is reused with different request inputs."""
+
+
+class _Flight:
+    def __init__(self, key, fingerprint):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Share one in-flight computation between concurrent callers with the same key.
+
+    Finished flights stay reachable through their idempotency key for
+    ``idempotency_ttl_seconds`` so that a client retrying after the result was
+    produced gets the same answer instead of starting a new run.
+    """
+
+    def __init__(self, idempotency_ttl_seconds=600):
+        self.idempotency_ttl_seconds = idempotency_ttl_seconds
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._idempotency_keys = {}
+
+    def do(self, key, fn, idempotency_key=None, fingerprint=None):
+        """Run ``fn`` once per ``key`` and return ``(result, shared)``.
+
+        ``fingerprint`` identifies the request inputs an idempotency key may be
+        reused with; it defaults to ``key``.
+        """
+        fingerprint = key if fingerprint is None else fingerprint
+        with self._lock:
+            self._expire_idempotency_keys()
+            flight = None
+            if idempotency_key:
+                entry = self._idempotency_keys.get(idempotency_key)
+                if entry:
+                    flight = entry[0]
+                    if flight.fingerprint != fingerprint:
+                        raise IdempotencyKeyConflict(
+                            f"Idempotency key {idempotency_key!r} was used for a different request."
+                        )
+            if flight is None:
+                flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(key, fingerprint)
+                self._flights[key] = flight
+            if idempotency_key and idempotency_key not in self._idempotency_keys:
+                self._idempotency_keys[idempotency_key] = (flight, None)
+
+        if leader:
+            try:
+                flight.result = fn()
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                    expires_at = time.time() + self.idempotency_ttl_seconds
+                    for idem_key, (idem_flight, _) in list(self._idempotency_keys.items()):
+                        if idem_flight is flight:
+                            # Failed runs are not remembered, a retry should try again.
+                            if flight.error is None:
+                                self._idempotency_keys[idem_key] = (flight, expires_at)
+                            else:
+                                del self._idempotency_keys[idem_key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, not leader
+
+    def in_flight(self):
+        """Number of computations currently running."""
+        with self._lock:
+            return len(self._flights)
+
+    def _expire_idempotency_keys(self):
+        now = time.time()
+        for idem_key, (_, expires_at) in list(self._idempotency_keys.items()):
+            if expires_at is not None and expires_at < now:
+                del self._idempotency_keys[idem_key]
+
+
+def loan_request_key(total_portfolio_value, tokens, months, payout, inception_date, bank, snapshot_version=None,
+                     priority=None):
+    """Normalize loan inputs into a stable key for coalescing identical requests.
+
+    ``priority`` keeps runs of different LLM priorities apart, so an
+    interactive request never waits on a batch run that may be shed.
+    """
+    key_data = {
+        "value": round(float(total_portfolio_value), 2),
+        "tokens": sorted(str(token) for token in tokens),
+        "months": int(months),
+        "payout": str(payout),
+        "inception_date": str(inception_date),
+        "bank": str(bank),
+        "snapshot": snapshot_version,
+        "priority": priority,
+    }
+    key_str = json.dumps(key_data, sort_keys=True)
+    return hashlib.sha256(key_str.encode()).hexdigest()
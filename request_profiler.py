@@ -0,0 +1,273 @@
+"""Opt-in sampling profiler for individual API requests.
+
+A request is profiled when it carries ``X-Profile-Token`` matching
+``REQUEST_PROFILE_TOKEN``, or at random with probability
+``REQUEST_PROFILE_SAMPLE_RATE``. While it runs, a helper thread reads the
+stacks of the request thread and of the stage threads working for it every
+``REQUEST_PROFILE_INTERVAL_SECONDS`` and counts each distinct stack, so the
+cost is one stack walk per thread and interval whatever the code is doing,
+and nothing at all for requests that aren't profiled.
+
+Profiles are written to ``REQUEST_PROFILE_DIR`` as JSON, shared by every
+worker, and the oldest are removed past ``REQUEST_PROFILE_KEEP``. The stacks
+are in the folded format read by ``flamegraph.pl`` and speedscope.
+"""
+import collections
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+REQUEST_PROFILE_TOKEN = os.getenv("REQUEST_PROFILE_TOKEN")
+REQUEST_PROFILE_SAMPLE_RATE = float(os.getenv("REQUEST_PROFILE_SAMPLE_RATE", "0"))
+REQUEST_PROFILE_INTERVAL_SECONDS = float(os.getenv("REQUEST_PROFILE_INTERVAL_SECONDS", "0.005"))
+REQUEST_PROFILE_DIR = os.getenv("REQUEST_PROFILE_DIR", "profiles")
+REQUEST_PROFILE_KEEP = int(os.getenv("REQUEST_PROFILE_KEEP", "200"))
+
+PROFILE_HEADER = "X-Profile-Token"
+# Functions listed in a profile's summary, by samples spent in the function itself
+TOP_FRAMES = 15
+
+
+def authorized(token):
+    """Whether ``token`` matches the configured profiling token."""
+    if not (REQUEST_PROFILE_TOKEN and token):
+        return False
+    # compare_digest only takes str when both sides are ASCII, and header values needn't be
+    return hmac.compare_digest(token.encode(), REQUEST_PROFILE_TOKEN.encode())
+
+
+def should_profile(headers):
+    """Whether to profile a request with ``headers``: a valid token, or the sampling rate."""
+    token = headers.get(PROFILE_HEADER)
+    if token is not None:
+        return authorized(token)
+    return REQUEST_PROFILE_SAMPLE_RATE > 0 and random.random() < REQUEST_PROFILE_SAMPLE_RATE
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+_local = threading.local()
+
+
+def current_profiler():
+    """The profiler sampling this thread, or None."""
+    return getattr(_local, "profiler", None)
+
+
+def propagate(fn, label):
+    """Wrap ``fn`` so that, run on another thread, it is sampled by this thread's profiler.
+
+    Its stacks are filed under ``label``. Without an active profiler ``fn``
+    is returned unchanged.
+    """
+    profiler = current_profiler()
+    if profiler is None:
+        return fn
+
+    def attached():
+        with profiler.attach(label):
+            return fn()
+    return attached
+
+
+class SamplingProfiler:
+    """Counts the stacks of a request's threads, sampled from a helper thread.
+
+    The thread that creates it is sampled from the start; work the request
+    hands to other threads joins through ``attach`` (see ``propagate``).
+    Each stack is rooted at the label of the thread it was sampled on.
+    """
+
+    def __init__(self, thread_id=None, interval=REQUEST_PROFILE_INTERVAL_SECONDS):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.threads = {self.thread_id: "request"}
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started_at = None
+        self.duration = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, label):
+        """Context manager sampling the calling thread under ``label`` while it runs."""
+        return _Attached(self, label)
+
+    def start(self):
+        self.started_at = time.time()
+        if self.thread_id == threading.get_ident():
+            _local.profiler = self
+        self._thread = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if current_profiler() is self:
+            _local.profiler = None
+        self.duration = time.time() - self.started_at
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, label in list(self.threads.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(label)
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def top_frames(self, limit=TOP_FRAMES):
+        """Functions with the most samples at the top of the stack, with their share of samples."""
+        own = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        return [
+            {"frame": frame, "samples": count, "share": count / self.samples}
+            for frame, count in own.most_common(limit)
+        ]
+
+
+class _Attached:
+    def __init__(self, profiler, label):
+        self.profiler = profiler
+        self.label = label
+
+    def __enter__(self):
+        self.previous = current_profiler()
+        _local.profiler = self.profiler
+        self.profiler.threads[threading.get_ident()] = self.label
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.threads.pop(threading.get_ident(), None)
+        _local.profiler = self.previous
+
+
+class ProfileStore:
+    """Profiles as one JSON file each in a directory shared by all workers."""
+
+    def __init__(self, directory=REQUEST_PROFILE_DIR, keep=REQUEST_PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+    def _path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def save(self, profiler, **metadata):
+        """Store a stopped profiler's samples with ``metadata``; return the profile id."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Ids sort by start time, so the listing and pruning don't need to open the files
+        profile_id = f"{int(profiler.started_at * 1000):013d}-{uuid.uuid4().hex[:8]}"
+        profile = {
+            "id": profile_id,
+            "started_at": profiler.started_at,
+            "duration": profiler.duration,
+            "samples": profiler.samples,
+            "interval": profiler.interval,
+            **metadata,
+            "top_frames": profiler.top_frames(),
+            "stacks": dict(profiler.stacks),
+        }
+        tmp_path = f"{self._path(profile_id)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(profile, f)
+        os.replace(tmp_path, self._path(profile_id))
+        self._prune()
+        return profile_id
+
+    def ids(self):
+        """Stored profile ids, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((name[:-len(".json")] for name in names if name.endswith(".json")), reverse=True)
+
+    def get(self, profile_id):
+        """The stored profile, or None if there is no such id."""
+        if profile_id not in self.ids():
+            return None  # also keeps ids from naming paths outside the directory
+        return self._read(profile_id)
+
+    def list(self, limit=50):
+        """Metadata of the newest ``limit`` profiles, without their stacks."""
+        summaries = []
+        for profile_id in self.ids()[:limit]:
+            profile = self._read(profile_id)
+            if profile is not None:
+                profile.pop("stacks")
+                summaries.append(profile)
+        return summaries
+
+    def _read(self, profile_id):
+        try:
+            with open(self._path(profile_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None  # pruned in the meantime
+
+    def _prune(self):
+        for profile_id in self.ids()[self.keep:]:
+            try:
+                os.remove(self._path(profile_id))
+            except FileNotFoundError:
+                pass  # another worker pruned it
+
+
+def folded(profile):
+    """A stored profile's stacks in folded format, one ``frame;frame;frame count`` line each."""
+    stacks = sorted(profile["stacks"].items(), key=lambda item: item[1], reverse=True)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+profile_store = ProfileStore()
+
+
+class profiled:
+    """Profile the enclosed block of the current thread when ``enabled`` and store it on exit.
+
+    ``id`` is the stored profile's id afterwards, or None when the block
+    wasn't profiled or the profile couldn't be stored. ``tag`` adds metadata
+    learned while the block runs.
+    """
+
+    def __init__(self, enabled, store=None, **metadata):
+        self.enabled = enabled
+        self.store = store
+        self.metadata = metadata
+        self.id = None
+        self._profiler = None
+
+    def tag(self, **metadata):
+        self.metadata.update(metadata)
+
+    def __enter__(self):
+        if self.enabled:
+            self._profiler = SamplingProfiler().start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._profiler is None:
+            return
+        self._profiler.stop()
+        try:
+            self.id = (self.store or profile_store).save(
+                self._profiler, error=None if exc is None else repr(exc), **self.metadata
+            )
+        except OSError as e:
+            print(f"Error storing request profile: {e}")
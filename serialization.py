@@ -0,0 +1,150 @@
+import gzip
+import zlib
+
+import numpy as np
+import orjson
+import pandas as pd
+
+LAYOUTS = ("records", "columnar")
+
+# Bodies smaller than this are sent uncompressed, gzip overhead is not worth it
+MIN_COMPRESS_BYTES = 1024
+
+
+def dataframe_to_native(df, layout="records"):
+    """Convert a DataFrame into plain lists/dicts in the requested layout."""
+    if layout == "columnar":
+        return {
+            "index": _column_values(df.index),
+            "columns": {str(col): _column_values(df[col]) for col in df.columns},
+        }
+    return df.to_dict(orient="records" if df.shape[0] > 1 else "index")
+
+
+def to_native(obj, layout="records"):
+    """Recursively convert pandas objects so the JSON encoder can handle them.
+
+    With the columnar layout, lists of uniform records (such as per-asset rows)
+    are also turned into a ``{column: [values]}`` mapping.
+    """
+    if isinstance(obj, pd.DataFrame):
+        return dataframe_to_native(obj, layout)
+    if isinstance(obj, pd.Series):
+        return _column_values(obj)
+    if isinstance(obj, dict):
+        return {key: to_native(val, layout) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        if layout == "columnar" and _is_records(obj):
+            columns = list(obj[0].keys())
+            return {col: [to_native(row[col], layout) for row in obj] for col in columns}
+        return [to_native(val, layout) for val in obj]
+    return obj
+
+
+def project(obj, fields):
+    """Keep only the dotted field paths in ``fields``, e.g. ``["aetherum_loan_details.total_loan"]``.
+
+    Paths descend through dicts by key and apply to every element of a list.
+    """
+    if not fields:
+        return obj
+    tree = {}
+    for field in fields:
+        node = tree
+        for part in field.split("."):
+            node = node.setdefault(part, {})
+    return _project(obj, tree)
+
+
+def parse_fields(value):
+    """Parse a ``?fields=`` query value into a list of field paths."""
+    if not value:
+        return []
+    return [field.strip() for field in value.split(",") if field.strip()]
+
+
+def dumps(obj):
+    """Encode ``obj`` to JSON bytes, handling NumPy and pandas values natively."""
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def compress(body, accept_encoding):
+    """Compress ``body`` with the best encoding the client accepts.
+
+    Returns ``(body, content_encoding)``; ``content_encoding`` is None when the
+    body is sent as-is.
+    """
+    if len(body) < MIN_COMPRESS_BYTES or not accept_encoding:
+        return body, None
+    qualities = _encoding_qualities(accept_encoding)
+    wildcard = qualities.get("*", 0.0)
+    # The client's preferred encoding wins; gzip on ties
+    encoding = max(("gzip", "deflate"), key=lambda coding: qualities.get(coding, wildcard))
+    if qualities.get(encoding, wildcard) <= 0:
+        return body, None
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=5), "gzip"
+    return zlib.compress(body, 5), "deflate"
+
+
+def _encoding_qualities(accept_encoding):
+    """Map each coding in an Accept-Encoding header to its q-value; unparsable q-values count as 0."""
+    qualities = {}
+    for part in accept_encoding.split(","):
+        coding, *params = [item.strip() for item in part.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities
+
+
+def _project(obj, tree):
+    if not tree:
+        return obj
+    if isinstance(obj, dict):
+        return {key: _project(obj[key], subtree) for key, subtree in tree.items() if key in obj}
+    if isinstance(obj, (list, tuple)):
+        return [_project(item, tree) for item in obj]
+    if isinstance(obj, pd.DataFrame):
+        columns = [col for col in tree if col in obj.columns]
+        return obj[columns]
+    return obj
+
+
+def _is_records(obj):
+    if not obj or not isinstance(obj[0], dict):
+        return False
+    keys = obj[0].keys()
+    return all(isinstance(row, dict) and row.keys() == keys for row in obj)
+
+
+def _column_values(values):
+    if isinstance(values, pd.CategoricalIndex) or isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+        return [None if pd.isna(val) else str(val) for val in values]
+    if values.dtype.kind in "biuf":
+        return np.ascontiguousarray(values.to_numpy())
+    return values.tolist()
+
+
+def _default(obj):
+    if isinstance(obj, pd.DataFrame):
+        return dataframe_to_native(obj)
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return _column_values(obj)
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if pd.api.types.is_scalar(obj) and pd.isna(obj):
+        return None
+    return str(obj)
@@ -0,0 +1,364 @@
+"""Local stand-ins for the services ``api.py`` depends on, for load testing.
+
+* ``FakeRedisServer``: an in-memory server speaking enough of the Redis
+  protocol for ``redis-py`` (strings with expiry, MGET, transactions,
+  pub/sub).
+* ``FakeCMCHandler``: the CoinMarketCap ``listings/latest`` endpoint.
+* ``FakeCoinGeckoHandler``: the CoinGecko ``coins/markets`` and
+  ``market_chart/range`` endpoints.
+* ``FakeLLMHandler``: a Groq (OpenAI-style) chat completions endpoint that
+  answers after a configurable latency.
+
+Point the app at them with ``REDIS_HOST``/``REDIS_PORT``, ``CMC_API_URL``,
+``COINGECKO_API_URL`` and ``GROQ_BASE_URL``; ``loadtest.py`` does this.
+Market data is generated from a fixed seed, so every run sees the same prices.
+"""
+import json
+import random
+import socketserver
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from asset_analysis import INSIGHTS_HEADING, INTEREST_HEADING
+from coingecko_fetcher import COIN_ID_MAP
+
+# Listing size returned by the fake CMC endpoint, as requested by cmc_fetcher
+LISTING_SIZE = 100
+
+
+def fake_listing(size=LISTING_SIZE, seed=0):
+    """A CMC ``listings/latest`` payload: the CoinGecko-mapped coins first, then filler tokens."""
+    rng = np.random.default_rng(seed)
+    symbols = list(COIN_ID_MAP) + [f"TKN{i}" for i in range(len(COIN_ID_MAP), size)]
+    market_caps = np.sort(rng.lognormal(24, 2, len(symbols)))[::-1]
+    listing = []
+    for i, symbol in enumerate(symbols[:size]):
+        changes = rng.normal(0, [3, 8, 15, 30])
+        listing.append({
+            "id": i + 1,
+            "name": COIN_ID_MAP.get(symbol, symbol.lower()).replace("-", " ").title(),
+            "symbol": symbol,
+            "cmc_rank": i + 1,
+            "quote": {"USD": {
+                "price": float(rng.lognormal(2, 3)),
+                "percent_change_24h": float(changes[0]),
+                "percent_change_7d": float(changes[1]),
+                "percent_change_30d": float(changes[2]),
+                "percent_change_90d": float(changes[3]),
+                "market_cap": float(market_caps[i]),
+            }},
+        })
+    return listing
+
+
+def fake_market_chart(coin_id, start, end):
+    """Hourly (or daily beyond 90 days) random-walk prices and market caps between two timestamps."""
+    step = 3600 if end - start <= 90 * 86400 else 86400
+    timestamps = np.arange(start - start % step, end, step)
+    rng = np.random.default_rng(zlib.crc32(coin_id.encode()))
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(timestamps))))
+    millis = (timestamps * 1000).tolist()
+    return {
+        "prices": [list(point) for point in zip(millis, prices.tolist())],
+        "market_caps": [list(point) for point in zip(millis, (prices * 1e7).tolist())],
+        "total_volumes": [list(point) for point in zip(millis, (prices * 1e5).tolist())],
+    }
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    """Base handler: JSON responses, optional latency, no request logging."""
+
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    jitter = 0.0
+
+    def send_json(self, payload, status=200):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCMCHandler(_JSONHandler):
+    listing = None
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/v1/cryptocurrency/listings/latest":
+            return self.send_json({"status": {"error_message": "not found"}}, 404)
+        self.send_json({"status": {"error_code": 0}, "data": self.listing})
+
+
+class FakeCoinGeckoHandler(_JSONHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        # /api/v3/coins/markets: ids of the fake listing's coins
+        if parts[-2:] == ["coins", "markets"]:
+            return self.send_json([
+                {"id": COIN_ID_MAP.get(coin["symbol"], coin["symbol"].lower()), "symbol": coin["symbol"].lower()}
+                for coin in fake_listing()
+            ])
+        # /api/v3/coins/<id>/market_chart/range
+        if parts[-2:] != ["market_chart", "range"] or "coins" not in parts:
+            return self.send_json({"error": "not found"}, 404)
+        query = parse_qs(url.query)
+        coin_id = parts[parts.index("coins") + 1]
+        self.send_json(fake_market_chart(coin_id, int(query["from"][0]), int(query["to"][0])))
+
+
+class FakeLLMHandler(_JSONHandler):
+    """Answers every chat completion with a fixed two-section analysis, never with tool calls."""
+
+    completion_tokens = 400
+
+    def do_POST(self):
+        if not urlparse(self.path).path.endswith("/chat/completions"):
+            return self.send_json({"error": {"message": "not found"}}, 404)
+        request = self.read_json()
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in request.get("messages", [])) // 4
+        content = (
+            f"{INSIGHTS_HEADING}\n\nMarkets are range-bound with moderate volatility (load-test stub).\n\n"
+            f"{INTEREST_HEADING}\n\n7.00% (load-test stub)"
+        )
+        self.send_json({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": self.completion_tokens,
+                      "total_tokens": prompt_tokens + self.completion_tokens},
+        })
+
+
+def start_http_stub(handler, host="127.0.0.1", port=0, **attributes):
+    """Serve ``handler`` (with class ``attributes`` overridden) on a daemon thread; return the server."""
+    handler = type(handler.__name__, (handler,), attributes)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=handler.__name__, daemon=True).start()
+    return server
+
+
+class _Status(bytes):
+    """A simple-string reply such as OK or QUEUED."""
+
+
+class _Error(str):
+    """An error reply."""
+
+
+class _Push(list):
+    """An out-of-band message, such as a pub/sub delivery (a push type in RESP3)."""
+
+
+OK = _Status(b"OK")
+
+
+def _encode(value, protocol=2):
+    """Encode a reply in RESP2 or, after ``HELLO 3``, RESP3."""
+    if value is None:
+        return b"_\r\n" if protocol == 3 else b"$-1\r\n"
+    if isinstance(value, _Status):
+        return b"+%s\r\n" % value
+    if isinstance(value, _Error):
+        return b"-%s\r\n" % value.encode()
+    if isinstance(value, bool):
+        return _encode(int(value), protocol)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, str):
+        return _encode(value.encode(), protocol)
+    if isinstance(value, dict):
+        if protocol == 3:
+            return b"%%%d\r\n" % len(value) + b"".join(_encode(k, protocol) + _encode(v, protocol) for k, v in value.items())
+        return _encode([item for pair in value.items() for item in pair], protocol)
+    if isinstance(value, _Push) and protocol == 3:
+        return b">%d\r\n" % len(value) + b"".join(_encode(item, protocol) for item in value)
+    return b"*%d\r\n" % len(value) + b"".join(_encode(item, protocol) for item in value)
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.protocol = 2
+        self.write_lock = threading.Lock()
+        self.channels = set()
+        try:
+            self._serve()
+        finally:
+            with self.server.lock:
+                for channel in self.channels:
+                    self.server.subscribers.get(channel, set()).discard(self)
+
+    def send(self, reply):
+        # Publishes from other connections write here too
+        with self.write_lock:
+            self.wfile.write(_encode(reply, self.protocol))
+            self.wfile.flush()
+
+    def _serve(self):
+        transaction = None
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            if not command:
+                continue
+            name = command[0].upper()
+            if name == b"HELLO":
+                self.protocol = int(command[1]) if len(command) > 1 else self.protocol
+                reply = {"server": "redis", "version": "7.2.0", "proto": self.protocol,
+                         "id": id(self), "mode": "standalone", "role": "master", "modules": []}
+            elif name in (b"SUBSCRIBE", b"UNSUBSCRIBE"):
+                subscribe = name == b"SUBSCRIBE"
+                with self.server.lock:
+                    for channel in command[1:] or list(self.channels):
+                        subscribers = self.server.subscribers.setdefault(channel, set())
+                        if subscribe:
+                            subscribers.add(self)
+                            self.channels.add(channel)
+                        else:
+                            subscribers.discard(self)
+                            self.channels.discard(channel)
+                        self.send(_Push([name.lower(), channel, len(self.channels)]))
+                continue
+            elif name == b"PING" and self.channels and self.protocol == 2:
+                reply = [b"pong", command[1] if len(command) > 1 else b""]
+            elif name == b"MULTI":
+                transaction = []
+                reply = OK
+            elif name == b"EXEC" and transaction is not None:
+                with self.server.lock:
+                    reply = [self.server.execute(queued) for queued in transaction]
+                transaction = None
+            elif name == b"DISCARD":
+                transaction = None
+                reply = OK
+            elif transaction is not None:
+                transaction.append(command)
+                reply = _Status(b"QUEUED")
+            else:
+                with self.server.lock:
+                    reply = self.server.execute(command)
+            self.send(reply)
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # inline command, as sent by redis-cli / telnet
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """In-memory Redis stand-in; one shared keyspace for every connected worker."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _RedisHandler)
+        self.lock = threading.Lock()
+        self.data = {}
+        self.expires = {}
+        self.subscribers = {}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-redis", daemon=True).start()
+        return self
+
+    def _live(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _get(self, key):
+        return self.data[key] if self._live(key) else None
+
+    def execute(self, command):
+        """Run one command (the caller holds ``lock``) and return its reply value."""
+        name, args = command[0].upper().decode(), command[1:]
+        if name == "PING":
+            return _Status(b"PONG")
+        if name in ("AUTH", "SELECT", "CLIENT"):
+            return OK
+        if name == "ECHO":
+            return args[0]
+        if name == "GET":
+            return self._get(args[0])
+        if name == "MGET":
+            return [self._get(key) for key in args]
+        if name == "SET":
+            key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+            exists = self._live(key)
+            if (b"NX" in options and exists) or (b"XX" in options and not exists):
+                return None
+            self.data[key] = value
+            self.expires.pop(key, None)
+            for unit, scale in ((b"EX", 1.0), (b"PX", 0.001)):
+                if unit in options:
+                    self.expires[key] = time.time() + float(args[2 + options.index(unit) + 1]) * scale
+            return OK
+        if name == "EXISTS":
+            return sum(self._live(key) for key in args)
+        if name in ("DEL", "UNLINK"):
+            removed = sum(self._live(key) for key in args)
+            for key in args:
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return removed
+        if name == "EXPIRE":
+            if not self._live(args[0]):
+                return 0
+            self.expires[args[0]] = time.time() + float(args[1])
+            return 1
+        if name in ("INCR", "INCRBY"):
+            value = int(self._get(args[0]) or 0) + (int(args[1]) if name == "INCRBY" else 1)
+            self.data[args[0]] = str(value).encode()
+            return value
+        if name == "PUBLISH":
+            subscribers = list(self.subscribers.get(args[0], ()))
+            for subscriber in subscribers:
+                try:
+                    subscriber.send(_Push([b"message", args[0], args[1]]))
+                except OSError:
+                    pass  # the subscriber's connection is closing
+            return len(subscribers)
+        if name == "KEYS":
+            return [key for key in list(self.data) if self._live(key)]
+        if name in ("FLUSHDB", "FLUSHALL"):
+            self.data.clear()
+            self.expires.clear()
+            return OK
+        return _Error(f"ERR unknown command '{name}'")
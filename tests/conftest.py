@@ -0,0 +1,33 @@
+import pytest
+
+from cmc_fetcher import listing_to_dataframe
+from stub_services import fake_listing
+
+
+@pytest.fixture
+def market_df():
+    """A deterministic 100-coin listing in the ``fetch_data_app`` layout."""
+    return listing_to_dataframe(fake_listing(seed=0))
+
+
+class FakeRedis:
+    """The slice of ``redis.Redis`` the modules under test use, kept in a dict."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        # Like Redis, hand values back as bytes
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+
+@pytest.fixture
+def fake_redis():
+    """An empty in-memory stand-in for the Redis client."""
+    return FakeRedis()
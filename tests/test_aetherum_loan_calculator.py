@@ -0,0 +1,24 @@
+import pytest
+
+import pricing_engine
+from aetherum_loan_calculator import calculate_aetherum_loan
+
+
+@pytest.fixture(autouse=True)
+def no_history(monkeypatch):
+    monkeypatch.setattr(pricing_engine, "get_crypto_correlation_matrix", lambda symbols: None)
+
+
+def test_quotes_the_quantile_policy(market_df):
+    portfolio = dict.fromkeys(market_df["Symbol"].head(3), 1000.0)
+    quote = pricing_engine.quantile_tier_rules(pricing_engine.PricingContext(market_df, portfolio))
+    assert calculate_aetherum_loan(portfolio, market_df) == {
+        "loan_amount": quote["total_loan"],
+        "weighted_ltv": quote["weighted_ltv"],
+        "interest_rate": quote["weighted_interest"],
+    }
+
+
+def test_symbol_without_market_data_raises(market_df):
+    with pytest.raises(KeyError, match="NOPE"):
+        calculate_aetherum_loan({"BTC": 1000.0, "NOPE": 1000.0}, market_df)
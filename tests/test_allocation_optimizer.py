@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from allocation_optimizer import _erf, _fit_bounds, liquidation_probability, optimize_allocation
+
+
+def test_erf_matches_math_erf_as_float64():
+    x = np.linspace(-5, 5, 2001)
+    values = _erf(x)
+    assert values.dtype == np.float64
+    np.testing.assert_allclose(values, [math.erf(v) for v in x], atol=2e-7)
+
+
+def test_fitted_weights_stay_in_bounds_and_sum_to_one():
+    weights = _fit_bounds(np.random.default_rng(0).dirichlet(np.ones(4), 100), 0.05, 0.6)
+    assert weights.min() >= 0.05 - 1e-12 and weights.max() <= 0.6 + 1e-12
+    np.testing.assert_allclose(weights.sum(axis=1), 1.0)
+
+
+def test_liquidation_is_likelier_for_more_volatile_collateral():
+    low, high = liquidation_probability(np.array([1e-4, 1e-3]), 0.08, 12)
+    assert 0 <= low < high <= 1
+
+
+def test_optimizer_respects_the_caps(market_df):
+    tokens = list(market_df["Symbol"].head(4))
+    correlations = pd.DataFrame(np.full((4, 4), 0.5) + 0.5 * np.eye(4), index=tokens, columns=tokens)
+    result = optimize_allocation(market_df, tokens, 100_000, 6, candidates=256, rounds=2,
+                                 max_liquidation_probability=0.65, correlation_matrix=correlations)
+    allocations = result["best"]["allocations"]
+    assert sum(allocations.values()) == pytest.approx(100)
+    assert max(allocations.values()) <= 60 + 1e-6
+    assert result["feasible"] and result["best"]["liquidation_probability"] <= 0.65
+    if result["equal_weight"]["liquidation_probability"] <= 0.65:
+        assert result["best"]["weighted_ltv"] >= result["equal_weight"]["weighted_ltv"]
+
+
+def test_unknown_tokens_are_rejected(market_df):
+    with pytest.raises(ValueError, match="No market data"):
+        optimize_allocation(market_df, ["BTC", "NOPE"], 1000, 6, correlation_matrix=pd.DataFrame())
+
+
+def test_default_cap_is_the_equal_weight_risk(market_df):
+    tokens = list(market_df["Symbol"].head(4))
+    correlations = pd.DataFrame(np.full((4, 4), 0.5) + 0.5 * np.eye(4), index=tokens, columns=tokens)
+    result = optimize_allocation(market_df, tokens, 100_000, 12, candidates=256, rounds=2,
+                                 correlation_matrix=correlations)
+    assert result["feasible"]
+    assert result["constraints"]["max_liquidation_probability"] == result["equal_weight"]["liquidation_probability"]
+    assert result["best"]["liquidation_probability"] <= result["equal_weight"]["liquidation_probability"]
+    assert result["best"]["weighted_ltv"] >= result["equal_weight"]["weighted_ltv"]
+
+
+@pytest.fixture
+def client(monkeypatch, market_df):
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("PHI_API_KEY", "test")
+    api = pytest.importorskip("api")
+    monkeypatch.setattr(api, "fetch_data_app", lambda: market_df)
+    return api.app.test_client()
+
+
+@pytest.mark.parametrize("tokens", ["BTC", 7, ["BTC", 7], ["BTC", ""]])
+def test_route_rejects_tokens_that_are_not_a_list_of_symbols(client, tokens):
+    response = client.post("/api/optimize-allocation",
+                           json={"totalPortfolioValue": 1000, "listOfSelectedTokens": tokens, "months": 6})
+    assert response.status_code == 400
+
+
+def test_route_reports_an_unreachable_cap(client, market_df, monkeypatch):
+    import coingecko_fetcher
+    monkeypatch.setattr(coingecko_fetcher, "get_daily_history", lambda *args, **kwargs: (pd.DataFrame(), None))
+    tokens = list(market_df["Symbol"].head(3))
+    response = client.post("/api/optimize-allocation", json={
+        "totalPortfolioValue": 1000, "listOfSelectedTokens": tokens, "months": 36,
+        "max_liquidation_probability": 0.01,
+    })
+    assert response.status_code == 422
+    assert response.get_json()["result"]["feasible"] is False
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+import asset_analysis
+import llm_scheduler
+from asset_analysis import get_asset_analyses, warm_asset_analyses
+
+
+class FakeAnalyst:
+    def run(self, prompt):
+        return type("Response", (), {"content": f"notes on {prompt.splitlines()[0]}", "metrics": {}})()
+
+
+@pytest.fixture
+def use_fakes(monkeypatch, fake_redis):
+    monkeypatch.setattr(asset_analysis, "r", fake_redis)
+    monkeypatch.setattr(asset_analysis, "warm_scheduler", llm_scheduler.LLMScheduler(tokens_per_minute=60000))
+
+
+def test_recent_sections_are_used_across_snapshots(monkeypatch, market_df, use_fakes):
+    warmed = warm_asset_analyses(market_df, "v1", top_n=2, analyst=FakeAnalyst())
+    assert len(get_asset_analyses(warmed)) == 2
+    later = time.time() + asset_analysis.ASSET_ANALYSIS_MAX_AGE_SECONDS + 1
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert get_asset_analyses(warmed) == {}
+
+
+def test_warm_skips_fresh_sections(market_df, use_fakes):
+    warm_asset_analyses(market_df, "v1", top_n=2, analyst=FakeAnalyst())
+    assert warm_asset_analyses(market_df, "v2", top_n=3, analyst=FakeAnalyst()) == [market_df["Symbol"][2]]
+
+
+def test_warm_runs_spend_the_refresher_budget(market_df, use_fakes):
+    before = llm_scheduler.scheduler.stats()["admitted"]
+    warm_asset_analyses(market_df, "v1", top_n=2, analyst=FakeAnalyst())
+    assert llm_scheduler.scheduler.stats()["admitted"] == before
+    assert asset_analysis.warm_scheduler.stats()["admitted"] == 2
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import run_backtest
+from market_snapshots import panel_from_history
+
+SYMBOLS = ["BTC", "ETH", "SOL", "XRP"]
+PORTFOLIOS = {"majors": {"BTC": 0.5, "ETH": 0.5}, "alts": {"SOL": 0.5, "XRP": 0.5}}
+
+
+def panel(crash_day=None, days=240):
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2023-01-01", periods=days, freq="D")
+    prices = pd.DataFrame(np.exp(rng.normal(0, 0.001, (days, len(SYMBOLS))).cumsum(axis=0)),
+                          index=index, columns=SYMBOLS)
+    if crash_day is not None:
+        prices.iloc[crash_day:] *= 0.3
+    return panel_from_history(prices, prices * 1e9)
+
+
+def test_calm_market_liquidates_nothing():
+    result = run_backtest(panel(), PORTFOLIOS, horizon_days=30)
+    assert set(result["policy"]) == {"quantile", "threshold"}
+    assert (result["loans"] > 0).all()
+    assert (result["liquidation_rate"] == 0).all()
+
+
+def test_crash_liquidates_loans_open_through_it():
+    result = run_backtest(panel(crash_day=200), PORTFOLIOS, horizon_days=30)
+    assert (result["liquidation_rate"] > 0).all()
+    assert (result["worst_loss_rate"] > 0).all()
+
+
+def test_portfolio_without_history_is_rejected():
+    with pytest.raises(ValueError, match="DOGE"):
+        run_backtest(panel(), {"meme": {"DOGE": 1.0}})
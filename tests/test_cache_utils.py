@@ -0,0 +1,88 @@
+import pandas as pd
+import pytest
+
+import agent
+import cache_utils
+from cache_utils import ResponseCache, regime_fingerprint
+from pricing_engine import PricingContext, quantile_tier_rules
+
+PORTFOLIO = {"BTC": 6000.0, "ETH": 4000.0}
+PROMPT = """
+The user has:
+$6,000.00 in BTC
+$4,000.00 in ETH
+Loan parameters:
+- Loan Length: 6 months
+"""
+AGENT_ANSWER = (
+    "**Insights into the current market conditions**\n\nMarkets are calm.\n\n"
+    "**Interest rate determined based on the current market conditions**\n\n12.34% from the prompt formula"
+)
+
+
+@pytest.fixture
+def quote(market_df):
+    correlation = pd.DataFrame([[1.0, 0.6], [0.6, 1.0]], index=["BTC", "ETH"], columns=["BTC", "ETH"])
+    return quantile_tier_rules(PricingContext(market_df, PORTFOLIO, correlation_matrix=correlation))
+
+
+def test_regime_key_ignores_amounts(tmp_path, market_df, quote):
+    cache = ResponseCache(cache_dir=str(tmp_path), mode="regime")
+    cache.cache_response("prompt", PORTFOLIO, "analysis", {}, quote, 6)
+    other = quantile_tier_rules(PricingContext(market_df, {"BTC": 1.0, "ETH": 9.0}, correlation_matrix=quote["correlation_matrix"]))
+    assert cache.get_cached_response("another prompt", {}, other, 5)[0] == "analysis"
+    # Another term bucket is another regime
+    assert cache.get_cached_response("prompt", PORTFOLIO, quote, 18)[0] is None
+    assert regime_fingerprint(quote, 6)["symbols"] == ["BTC", "ETH"]
+
+
+def test_regime_entries_expire_within_a_few_refreshes(tmp_path, monkeypatch, quote):
+    monkeypatch.setattr(cache_utils, "RESPONSE_CACHE_REGIME_TTL_SECONDS", 0)
+    cache = ResponseCache(cache_dir=str(tmp_path), mode="regime")
+    cache.cache_response("prompt", PORTFOLIO, "analysis", {}, quote, 6)
+    assert cache.get_cached_response("prompt", PORTFOLIO, quote, 6)[0] is None
+    assert ResponseCache(cache_dir=str(tmp_path), mode="exact").ttl_seconds == 24 * 3600
+
+
+def test_exact_entries_expire_with_their_snapshot(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path), mode="exact")
+    cache.cache_response("prompt", PORTFOLIO, "analysis", {}, snapshot_version="v1")
+    assert cache.get_cached_response("prompt", PORTFOLIO, snapshot_version="v1")[0] == "analysis"
+    assert cache.get_cached_response("prompt", PORTFOLIO, snapshot_version="v2")[0] is None
+    # The stale entry is gone for good
+    assert cache.get_cached_response("prompt", PORTFOLIO, snapshot_version="v1")[0] is None
+
+
+def test_legacy_json_entries_are_removed(tmp_path):
+    legacy = ["-8123456789.json", "42.json", "a" * 64 + ".json", "regime-" + "b" * 64 + ".json"]
+    for name in legacy + ["notes.json"]:
+        (tmp_path / name).write_text("{}")
+    ResponseCache(cache_dir=str(tmp_path))
+    assert sorted(path.name for path in tmp_path.glob("*.json")) == ["notes.json"]
+
+
+class FakeAgent:
+    def __init__(self):
+        self.runs = 0
+
+    def run(self, prompt):
+        self.runs += 1
+        return type("Response", (), {"content": AGENT_ANSWER, "metrics": {}})()
+
+
+def test_cache_hit_and_miss_quote_the_same_rate(tmp_path, monkeypatch, market_df, quote):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("PHI_API_KEY", "test")
+    monkeypatch.setattr(agent, "get_asset_analyses", lambda symbols: {})
+    monkeypatch.setattr(agent, "get_snapshot_version", lambda: "v1")
+    research_agent = FakeAgent()
+    allocations = {"BTC": 60.0, "ETH": 40.0}
+
+    miss, miss_metrics = agent.run_finance_agent(PROMPT, allocations, research_agent, market_df, quote)
+    hit, hit_metrics = agent.run_finance_agent(PROMPT, allocations, research_agent, market_df, quote)
+    assert (miss_metrics["analysis_source"], hit_metrics["analysis_source"]) == ("agent", "cached")
+    assert research_agent.runs == 1
+    assert miss == hit
+    assert "12.34%" not in miss
+    assert f"{quote['weighted_interest']:.2%}" in miss
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import deadlines
+from deadlines import Deadline
+from pricing_engine import PricingContext, evaluate, scale_quote
+from request_profiler import SamplingProfiler
+
+
+def test_stage_over_budget_falls_back():
+    deadline = Deadline(budgets={"market": 0.05})
+    result = deadline.run("market", lambda: time.sleep(0.5) or "late", fallback=lambda: "cached")
+    assert result == "cached"
+    assert "budget" in deadline.degraded["market"]
+    assert deadline.timings["market"] < 0.3
+
+
+def test_failing_stage_falls_back():
+    deadline = Deadline()
+    assert deadline.run("correlation", lambda: 1 / 0, fallback=lambda: None) is None
+    assert "ZeroDivisionError" in deadline.degraded["correlation"]
+
+
+def test_expired_deadline_skips_the_stage():
+    deadline = Deadline(seconds=0)
+    called = []
+    assert deadline.run("market", lambda: called.append(1), fallback=lambda: "cached") == "cached"
+    assert called == []
+
+
+def test_overrunning_analysis_does_not_hold_up_other_stages(monkeypatch):
+    monkeypatch.setitem(deadlines._stage_executors, "analysis", deadlines.concurrent.futures.ThreadPoolExecutor(1))
+    release = threading.Event()
+    try:
+        first = Deadline(budgets={"analysis": 0.05})
+        first.run("analysis", release.wait)
+        assert "analysis" in first.degraded
+        # The analysis pool is now full, but the market stage runs at once
+        second = Deadline(budgets={"market": 0.5})
+        assert second.run("market", lambda: "fresh") == "fresh"
+    finally:
+        release.set()
+
+
+def test_profiled_request_samples_its_stages():
+    profiler = SamplingProfiler(interval=0.002).start()
+    try:
+        Deadline().run("correlation", lambda: time.sleep(0.1))
+    finally:
+        profiler.stop()
+    assert any(stack.startswith("stage:correlation;") for stack in profiler.stacks)
+    assert any(stack.startswith("request;") for stack in profiler.stacks)
+
+
+def test_table_and_engine_paths_degrade_alike(market_df, monkeypatch):
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("PHI_API_KEY", "test")
+    app = pytest.importorskip("app")
+    portfolio = dict.fromkeys(market_df["Symbol"].head(3), 1000.0)
+    ctx = PricingContext(market_df, portfolio)
+    ctx.correlation_matrix = None  # no price history
+    quote = evaluate(ctx)["quantile"]
+    assert np.isnan(quote["average_correlation"]).all()
+
+    engine = Deadline()
+    app.note_missing_correlations(quote, engine)
+    table = Deadline()
+    app.note_missing_correlations(scale_quote(quote, 2.0), table)
+    assert engine.degraded == table.degraded
+    assert "no price history" in engine.degraded["correlation"]
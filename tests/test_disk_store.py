@@ -0,0 +1,56 @@
+import threading
+import time
+
+import disk_store
+from disk_store import ROW_OVERHEAD_BYTES, DiskStore
+
+
+def open_test_store(tmp_path, max_bytes=1 << 20):
+    return DiskStore(str(tmp_path / "store.sqlite"), max_bytes=max_bytes, compact_interval=0)
+
+
+def test_values_round_trip_and_expire(tmp_path):
+    store = open_test_store(tmp_path)
+    store.set("fresh", b"value", ttl_seconds=60)
+    store.set("stale", b"value", ttl_seconds=-1)
+    assert store.get("fresh") == b"value"
+    assert store.get("stale") is None
+    assert store.compact(force=True)["expired"] == 1
+
+
+def test_cap_evicts_least_recently_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_store, "ACCESS_RESOLUTION_SECONDS", 0)
+    entry_bytes = 1 + 100 + ROW_OVERHEAD_BYTES
+    store = open_test_store(tmp_path, max_bytes=3 * entry_bytes)
+    for key in "abc":
+        store.set(key, b"x" * 100, ttl_seconds=60)
+        time.sleep(0.01)
+    store.get("a")  # now b is the least recently read
+    store.set("d", b"x" * 100, ttl_seconds=60)
+    # Eviction frees down to EVICTION_TARGET of the cap: b, then c
+    assert store.get("b") is None and store.get("c") is None
+    assert store.get("a") is not None and store.get("d") is not None
+    assert store.stats()["bytes"] <= store.max_bytes
+
+
+def test_oversized_value_is_refused(tmp_path):
+    store = open_test_store(tmp_path, max_bytes=100)
+    assert store.set("big", b"x" * 200, ttl_seconds=60) is False
+    assert store.stats()["entries"] == 0
+
+
+def test_concurrent_writers_keep_the_byte_total(tmp_path):
+    store = open_test_store(tmp_path)
+
+    def write(prefix):
+        for i in range(50):
+            store.set(f"{prefix}{i % 10}", b"x" * (i + 1), ttl_seconds=60)
+
+    threads = [threading.Thread(target=write, args=(prefix,)) for prefix in "abcd"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    conn = store._connection()
+    actual = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    assert store.stats()["bytes"] == actual
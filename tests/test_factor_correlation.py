@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+import cmc_fetcher
+import coingecko_fetcher
+import factor_correlation
+from factor_correlation import FactorCorrelationModel, fit_and_store, get_correlation_model
+from pricing_engine import PricingContext, average_correlation
+from stub_services import FakeCoinGeckoHandler, start_http_stub
+
+
+def one_factor_prices(symbols, days=90, seed=0):
+    rng = np.random.default_rng(seed)
+    market = rng.normal(0, 0.03, days)
+    returns = market[:, None] + rng.normal(0, 0.01, (days, len(symbols)))
+    index = pd.date_range("2024-01-01", periods=days, freq="D")
+    return pd.DataFrame(np.exp(returns.cumsum(axis=0)), index=index, columns=symbols)
+
+
+def test_model_averages_match_the_exact_matrix():
+    prices = one_factor_prices([f"C{i}" for i in range(40)])
+    model = FactorCorrelationModel.fit(prices, n_factors=3)
+    symbols = list(prices.columns[:35])
+    exact = average_correlation(prices[symbols].corr(), symbols)
+    np.testing.assert_allclose(model.average_correlation(symbols), exact, atol=0.02)
+
+
+def test_short_histories_are_left_out_instead_of_truncating_the_fit():
+    prices = one_factor_prices(["A", "B", "C"])
+    prices.iloc[:60, 2] = np.nan
+    model = FactorCorrelationModel.fit(prices)
+    assert model.symbols == ["A", "B"]
+
+
+def test_partially_covered_basket_uses_the_exact_matrix(market_df):
+    symbols = list(market_df["Symbol"].head(40))
+    model = FactorCorrelationModel.fit(one_factor_prices(symbols[:-1]))
+    portfolio = dict.fromkeys(symbols, 1.0)
+    assert not PricingContext(market_df, portfolio, correlation_model=model).uses_factor_model
+    covered = dict.fromkeys(symbols[:-1], 1.0)
+    assert PricingContext(market_df, covered, correlation_model=model).uses_factor_model
+
+
+def test_workers_read_the_stored_model_while_it_is_recent(monkeypatch, market_df, fake_redis):
+    symbols = list(market_df["Symbol"])
+    monkeypatch.setattr(cmc_fetcher, "r", fake_redis)
+    monkeypatch.setattr(coingecko_fetcher, "get_daily_history",
+                        lambda requested, days=90: (one_factor_prices(requested), None))
+    monkeypatch.setattr(factor_correlation, "_model", None)
+    assert get_correlation_model() is None
+
+    fit_and_store(market_df, "v1")
+    model = get_correlation_model()
+    assert model.covers(symbols)
+    assert get_correlation_model(max_age_seconds=-1) is None
+
+
+def test_history_covers_coins_beyond_the_static_map(monkeypatch):
+    server = start_http_stub(FakeCoinGeckoHandler)
+    try:
+        monkeypatch.setattr(coingecko_fetcher, "COINGECKO_API_URL", f"http://127.0.0.1:{server.server_port}")
+        monkeypatch.setattr(coingecko_fetcher, "_coin_ids", None)
+        prices, _ = coingecko_fetcher.get_daily_history(["BTC", "TKN20"], days=10)
+    finally:
+        server.shutdown()
+    assert list(prices.columns) == ["BTC", "TKN20"]
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from llm_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, LLMScheduler, QueueFull
+
+
+def run_in_thread(scheduler, admitted, name, tokens=10, priority=PRIORITY_INTERACTIVE, hold=0.0, timeout=None):
+    started_at = time.monotonic()
+
+    def target():
+        try:
+            scheduler.run(lambda: (admitted.append((name, time.monotonic() - started_at)), time.sleep(hold)),
+                          tokens, priority=priority, timeout=timeout)
+        except QueueFull:
+            admitted.append((name, None))
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def test_next_waiter_is_admitted_as_soon_as_budget_allows():
+    # 6000 tokens/min = 100/s: each 10-token run needs 0.1s of refill
+    scheduler = LLMScheduler(max_concurrency=4, tokens_per_minute=6000, queue_timeout=5)
+    scheduler.budget.tokens = 0
+    admitted = []
+    threads = [run_in_thread(scheduler, admitted, i, hold=1.0) for i in range(2)]
+    for thread in threads:
+        thread.join()
+    # The second run must not wait for the first one to finish
+    assert admitted[1][1] < 0.5
+
+
+def test_interactive_runs_are_admitted_before_batch():
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=60000, queue_timeout=5)
+    admitted = []
+    blocker = run_in_thread(scheduler, admitted, "blocker", hold=0.2)
+    time.sleep(0.05)
+    batch = run_in_thread(scheduler, admitted, "batch", priority=PRIORITY_BATCH)
+    time.sleep(0.02)
+    interactive = run_in_thread(scheduler, admitted, "interactive")
+    for thread in (blocker, batch, interactive):
+        thread.join()
+    assert [name for name, _ in admitted] == ["blocker", "interactive", "batch"]
+
+
+def test_full_queue_sheds_batch_for_interactive():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=1, tokens_per_minute=60000, queue_timeout=5)
+    admitted = []
+    blocker = run_in_thread(scheduler, admitted, "blocker", hold=0.2)
+    time.sleep(0.05)
+    batch = run_in_thread(scheduler, admitted, "batch", priority=PRIORITY_BATCH)
+    time.sleep(0.02)
+    interactive = run_in_thread(scheduler, admitted, "interactive")
+    for thread in (blocker, batch, interactive):
+        thread.join()
+    assert dict(admitted)["batch"] is None
+    assert dict(admitted)["interactive"] is not None
+    assert scheduler.stats()["shed"] == 1
+
+
+def test_run_waiting_past_its_timeout_is_shed():
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=60000)
+    admitted = []
+    blocker = run_in_thread(scheduler, admitted, "blocker", hold=0.3)
+    time.sleep(0.05)
+    with pytest.raises(QueueFull):
+        scheduler.run(lambda: None, 10, timeout=0.05)
+    blocker.join()
+
+
+def test_charge_refunds_overestimates():
+    scheduler = LLMScheduler(tokens_per_minute=600)
+    scheduler.run(lambda: None, 500)
+    scheduler.charge(-400)
+    assert scheduler.budget.tokens == pytest.approx(500, abs=5)
+
+
+def test_run_the_budget_cannot_cover_in_time_is_shed_at_once():
+    # 6000 tokens/min = 100/s: the queued run needs 0.3s of refill, this one another 0.3s
+    scheduler = LLMScheduler(tokens_per_minute=6000, queue_timeout=0.5)
+    scheduler.budget.tokens = 0
+    admitted = []
+    queued = run_in_thread(scheduler, admitted, "queued", tokens=30)
+    time.sleep(0.05)
+    started_at = time.monotonic()
+    with pytest.raises(QueueFull, match="would wait"):
+        scheduler.run(lambda: None, 30)
+    assert time.monotonic() - started_at < 0.1
+    queued.join()
+    assert admitted[0][1] is not None
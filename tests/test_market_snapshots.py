@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cmc_fetcher
+import market_snapshots
+from market_snapshots import load_snapshot, record_snapshot
+from stub_services import fake_listing
+
+
+def history(symbols, days=5):
+    index = pd.date_range("2024-01-01", periods=days, freq="D")
+    prices = pd.DataFrame(np.arange(days * len(symbols), dtype=float).reshape(days, -1) + 1,
+                          index=index, columns=symbols)
+    return prices, prices * 1000
+
+
+def test_round_trip_keeps_listing_and_history(tmp_path, market_df):
+    path = record_snapshot(market_df, history(["BTC", "ETH"]), directory=str(tmp_path))
+    df, (prices, market_caps) = load_snapshot(path)
+    pd.testing.assert_frame_equal(df, market_df[df.columns], check_dtype=False)
+    assert list(prices.columns) == ["BTC", "ETH"]
+    assert market_caps.iloc[0, 0] == 1000
+
+
+def test_same_listing_is_recorded_once_per_directory(tmp_path, market_df):
+    first, second = tmp_path / "a", tmp_path / "b"
+    assert record_snapshot(market_df, directory=str(first)) is not None
+    assert record_snapshot(market_df, directory=str(first)) is None
+    # Another directory has its own recordings
+    assert record_snapshot(market_df, directory=str(second)) is not None
+
+
+@pytest.fixture
+def use_listing(monkeypatch, tmp_path, fake_redis):
+    fake_redis.set("CMC_DATA", json.dumps(fake_listing(seed=0)))
+    monkeypatch.setattr(cmc_fetcher, "r", fake_redis)
+    monkeypatch.setattr(cmc_fetcher, "SNAPSHOT_SUBSCRIBE", False)
+    monkeypatch.setattr(cmc_fetcher, "RECORD_DIR", str(tmp_path))
+    monkeypatch.setattr(cmc_fetcher, "_last_payload", None)
+    monkeypatch.setattr(cmc_fetcher, "_last_market_df", None)
+
+
+def test_recorder_cli_keeps_the_history(tmp_path, monkeypatch, use_listing):
+    monkeypatch.setattr("coingecko_fetcher.get_daily_history", lambda symbols, days: history(symbols))
+    monkeypatch.setattr("sys.argv", ["market_snapshots.py", "record", "--directory", str(tmp_path)])
+    market_snapshots.main()
+    (path,) = market_snapshots.list_snapshots(str(tmp_path))
+    assert load_snapshot(path)[1] is not None
+
+
+def test_unchanged_listing_is_not_recorded_again(tmp_path, monkeypatch, use_listing):
+    calls = []
+    monkeypatch.setattr(cmc_fetcher, "record_snapshot", lambda df, directory: calls.append(directory))
+    first = cmc_fetcher.fetch_data_app()
+    second = cmc_fetcher.fetch_data_app()
+    assert calls == [str(tmp_path)]
+    pd.testing.assert_frame_equal(first, second)
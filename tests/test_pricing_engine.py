@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pricing_engine import (
+    TIER_LABELS, PricingContext, add_risk_columns, evaluate, quantile_tier_codes, scale_quote,
+)
+
+BASE_LTV = {'Tier 1': 0.70, 'Tier 1.5': 0.60, 'Tier 2': 0.50, 'Tier 3': 0.40}
+
+
+def reference_ltvs(df, correlation_matrix, symbols):
+    """The quantile policy as the calculator implemented it row by row before the engine."""
+    df = df[df['Symbol'].isin(symbols)]
+    vol_75, vol_25 = df['Volatility Score'].quantile(0.75), df['Volatility Score'].quantile(0.25)
+    ltvs = {}
+    for _, row in df.iterrows():
+        ltv = BASE_LTV.get(str(row['Risk Tier']), 0.30)
+        if row['Volatility Score'] > vol_75:
+            ltv = max(0.2, ltv - 0.05)
+        elif row['Volatility Score'] < vol_25:
+            ltv = min(0.85, ltv + 0.02)
+        correlations = correlation_matrix[row['Symbol']].drop(row['Symbol'])
+        average = correlations.abs().mean()
+        if average > 0.8:
+            ltv -= 0.05
+        elif average < 0.5:
+            ltv += 0.02
+        ltvs[row['Symbol']] = max(0.2, min(ltv, 0.85))
+    return ltvs
+
+
+@pytest.fixture
+def correlations(market_df):
+    symbols = list(market_df['Symbol'].head(6))
+    rng = np.random.default_rng(1)
+    values = rng.uniform(0.2, 0.95, (6, 6))
+    values = (values + values.T) / 2
+    np.fill_diagonal(values, 1.0)
+    return pd.DataFrame(values, index=symbols, columns=symbols)
+
+
+def test_tiers_match_qcut(market_df):
+    scores = add_risk_columns(market_df)['Risk Score']
+    expected = pd.qcut(scores, q=4, labels=TIER_LABELS).cat.codes.to_numpy()
+    np.testing.assert_array_equal(quantile_tier_codes(scores.to_numpy()), expected)
+
+
+def test_quantile_ltvs_match_the_row_by_row_policy(market_df, correlations):
+    symbols = list(correlations.columns)
+    ctx = PricingContext(market_df, dict.fromkeys(symbols, 1000.0), correlation_matrix=correlations)
+    quote = evaluate(ctx, ["quantile"])["quantile"]
+    expected = reference_ltvs(add_risk_columns(market_df), correlations, symbols)
+    assert dict(zip(quote["symbols"], quote["ltv"])) == pytest.approx(expected)
+
+
+def test_subset_prices_like_a_fresh_context(market_df, correlations):
+    symbols = list(correlations.columns)
+    universe = PricingContext(market_df, dict.fromkeys(symbols, 1.0), correlation_matrix=correlations)
+    portfolio = {symbols[0]: 300.0, symbols[3]: 700.0}
+    fresh = PricingContext(market_df, portfolio, correlation_matrix=correlations.loc[list(portfolio), list(portfolio)])
+    for name, quote in evaluate(universe.subset(portfolio)).items():
+        np.testing.assert_allclose(quote["ltv"], evaluate(fresh)[name]["ltv"])
+        assert quote["total_loan"] == pytest.approx(evaluate(fresh)[name]["total_loan"])
+
+
+def test_scaled_quote_keeps_rates_and_scales_amounts(market_df, correlations):
+    symbols = list(correlations.columns[:3])
+    ctx = PricingContext(market_df, dict.fromkeys(symbols, 1 / 3), correlation_matrix=correlations.loc[symbols, symbols])
+    quote = evaluate(ctx)["threshold"]
+    scaled = scale_quote(quote, 3000.0)
+    assert scaled["total_collateral"] == pytest.approx(3000.0)
+    assert scaled["weighted_interest"] == quote["weighted_interest"]
+    np.testing.assert_allclose(scaled["loan_amounts"], quote["loan_amounts"] * 3000.0)
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import coingecko_fetcher
+from pricing_engine import PricingContext, evaluate
+from quote_table import QuoteTable, table_version
+
+
+def price_history(symbols, days=90):
+    """Random walks, with the last symbol listed only for the final 40 days."""
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2024-01-01", periods=days, freq="D")
+    prices = pd.DataFrame(np.exp(rng.normal(0, 0.05, (days, len(symbols))).cumsum(axis=0)),
+                          index=index, columns=symbols)
+    prices.iloc[:days - 40, -1] = np.nan
+    return prices, prices * 1e9
+
+
+@pytest.fixture
+def history(monkeypatch, market_df):
+    symbols = list(market_df["Symbol"].head(10))
+    prices, market_caps = price_history(symbols)
+
+    def get_daily_history(requested, vs_currency="usd", days=90):
+        known = [symbol for symbol in requested if symbol in prices]
+        return prices[known], market_caps[known]
+
+    monkeypatch.setattr(coingecko_fetcher, "get_daily_history", get_daily_history)
+    return symbols
+
+
+def test_correlations_do_not_depend_on_the_other_symbols(history):
+    pair = history[:2]
+    universe = coingecko_fetcher.get_crypto_correlation_matrix(history)
+    alone = coingecko_fetcher.get_crypto_correlation_matrix(pair)
+    pd.testing.assert_frame_equal(universe.loc[pair, pair], alone)
+
+
+def test_table_and_engine_price_a_shape_alike(history, market_df):
+    table = QuoteTable.build(market_df, "v1", top_n=10, max_size=2)
+    portfolio = {history[0]: 500.0, history[1]: 500.0}
+    from_table = table.lookup(portfolio)["quantile"]
+    from_engine = evaluate(PricingContext(market_df, portfolio))["quantile"]
+    np.testing.assert_allclose(from_table["ltv"], from_engine["ltv"])
+    np.testing.assert_allclose(from_table["average_correlation"], from_engine["average_correlation"])
+
+
+def test_live_versions_share_a_table_while_the_listing_is_unchanged(market_df):
+    assert table_version(market_df, "live-1") == table_version(market_df.copy(), "live-2")
+    moved = market_df.copy()
+    moved.loc[0, "Last Price"] *= 1.01
+    assert table_version(moved, "live-2") != table_version(market_df, "live-2")
+    assert table_version(market_df, "abc123") == "abc123"
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+import cmc_fetcher
+from request_coalescing import IdempotencyKeyConflict, SingleFlight, loan_request_key
+
+INPUTS = (1000, ["BTC", "ETH"], 6, "USD", "2024-01-01", "Bank")
+
+
+def test_concurrent_callers_share_one_run():
+    flights = SingleFlight()
+    release, calls, results = threading.Event(), [], []
+
+    def compute():
+        calls.append(1)
+        release.wait()
+        return "quote"
+
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", compute))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)  # let every caller join the flight
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True]
+
+
+def test_priorities_do_not_share_a_flight():
+    assert loan_request_key(*INPUTS, priority="interactive") != loan_request_key(*INPUTS, priority="batch")
+    assert loan_request_key(*INPUTS) == loan_request_key(1000.0, ["ETH", "BTC"], "6", "USD", "2024-01-01", "Bank")
+
+
+def test_idempotency_key_replays_and_rejects_other_inputs():
+    flights = SingleFlight()
+    assert flights.do("a", lambda: 1, idempotency_key="k") == (1, False)
+    assert flights.do("a", lambda: 2, idempotency_key="k") == (1, True)
+    with pytest.raises(IdempotencyKeyConflict):
+        flights.do("b", lambda: 3, idempotency_key="k")
+
+
+def test_non_numeric_months_is_a_bad_request(monkeypatch):
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("PHI_API_KEY", "test")
+    api = pytest.importorskip("api")
+    body = dict(zip(("totalPortfolioValue", "listOfSelectedTokens", "months", "payout", "inception_date", "bank"),
+                    INPUTS), months="six")
+    response = api.app.test_client().post("/api/calculate-loan", json=body)
+    assert response.status_code == 400
+
+
+class CountingRedis:
+    def __init__(self, payload):
+        self.payload = payload
+        self.listing_reads = 0
+
+    def get(self, key):
+        if key == "CMC_DATA":
+            self.listing_reads += 1
+            return self.payload
+        return None
+
+
+def test_unversioned_listing_is_hashed_once_per_ttl(monkeypatch):
+    fake = CountingRedis(b"[]")
+    monkeypatch.setattr(cmc_fetcher, "r", fake)
+    monkeypatch.setattr(cmc_fetcher, "SNAPSHOT_SUBSCRIBE", False)
+    monkeypatch.setattr(cmc_fetcher, "_snapshot", None)
+    monkeypatch.setattr(cmc_fetcher, "_derived_version", None)
+    versions = {cmc_fetcher.get_snapshot_version() for _ in range(5)}
+    assert len(versions) == 1 and not versions.pop().startswith("live-")
+    assert fake.listing_reads == 1
@@ -0,0 +1,51 @@
+import os
+import time
+
+import request_profiler
+from request_profiler import ProfileStore, folded, profiled
+
+
+def busy(seconds):
+    until = time.monotonic() + seconds
+    while time.monotonic() < until:
+        pass
+
+
+def test_profile_round_trip_with_tags(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    with profiled(True, store=store, route="/api/calculate-loan") as profile:
+        busy(0.05)
+        profile.tag(shared=True)
+    stored = store.get(profile.id)
+    assert stored["route"] == "/api/calculate-loan" and stored["shared"] is True
+    assert stored["samples"] > 0
+    assert "busy (test_request_profiler.py" in folded(stored)
+    assert store.get("../../etc/passwd") is None
+
+
+def test_disabled_block_stores_nothing(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    with profiled(False, store=store) as profile:
+        pass
+    assert profile.id is None and store.ids() == []
+
+
+def test_list_reads_the_directory_once(tmp_path, monkeypatch):
+    store = ProfileStore(str(tmp_path), keep=10)
+    for _ in range(5):
+        with profiled(True, store=store):
+            busy(0.01)
+    listings = []
+    real_listdir = os.listdir
+    monkeypatch.setattr(request_profiler.os, "listdir", lambda path: listings.append(path) or real_listdir(path))
+    summaries = store.list()
+    assert len(summaries) == 5 and "stacks" not in summaries[0]
+    assert len(listings) == 1
+
+
+def test_token_must_match(monkeypatch):
+    monkeypatch.setattr(request_profiler, "REQUEST_PROFILE_TOKEN", "secret")
+    assert request_profiler.authorized("secret")
+    assert not request_profiler.authorized("wrong")
+    assert not request_profiler.should_profile({"X-Profile-Token": "wrong"})
+    assert not request_profiler.authorized("s\u00e9cret")
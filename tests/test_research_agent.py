@@ -0,0 +1,10 @@
+from agent import build_research_agent, research_agent_resources
+
+
+def test_agents_share_the_model_client_but_not_their_state(monkeypatch):
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    model, tools = research_agent_resources()
+    first = build_research_agent(model=model, tools=tools)
+    second = build_research_agent(model=model, tools=tools)
+    assert first is not second
+    assert first.model is second.model is model
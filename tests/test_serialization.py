@@ -0,0 +1,55 @@
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from serialization import compress, dumps, parse_fields, project, to_native
+
+
+def test_numpy_and_pandas_values_encode_natively():
+    payload = {
+        "ltv": np.array([0.5, 0.6]),
+        "total": np.float64(1.5),
+        "tiers": pd.Series(pd.Categorical(["Tier 1", None])),
+        "at": pd.Timestamp("2024-01-01"),
+    }
+    assert json.loads(dumps(to_native(payload))) == {
+        "ltv": [0.5, 0.6], "total": 1.5, "tiers": ["Tier 1", None], "at": "2024-01-01T00:00:00",
+    }
+
+
+def test_columnar_layout_turns_records_into_columns():
+    df = pd.DataFrame({"Symbol": ["BTC", "ETH"], "LTV": [0.7, 0.6]})
+    native = to_native({"rows": [{"a": 1, "b": 2}, {"a": 3, "b": 4}], "df": df}, layout="columnar")
+    assert native["rows"] == {"a": [1, 3], "b": [2, 4]}
+    assert json.loads(dumps(native["df"]))["columns"]["LTV"] == [0.7, 0.6]
+
+
+def test_projection_keeps_only_the_requested_paths():
+    result = {"aetherum_loan_details": {"total_loan": 1, "ltv": 2}, "risk": [{"a": 1, "b": 2}], "other": 3}
+    fields = parse_fields("aetherum_loan_details.total_loan, risk.b")
+    assert project(result, fields) == {"aetherum_loan_details": {"total_loan": 1}, "risk": [{"b": 2}]}
+
+
+def test_compression_follows_accept_encoding():
+    body = b"x" * 4096
+    compressed, encoding = compress(body, "deflate, gzip;q=1.0")
+    assert encoding == "gzip" and gzip.decompress(compressed) == body
+    assert compress(body, "gzip;q=0") == (body, None)
+    assert compress(b"small", "gzip") == (b"small", None)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip;q=0.0", None),
+    ("gzip; q=0.000, deflate;q=0", None),
+    ("gzip;q=0.5, deflate", "deflate"),
+    ("*", "gzip"),
+    ("gzip;q=0, *", "deflate"),
+    ("*;q=0", None),
+    ("gzip;q=abc", None),
+])
+def test_accept_encoding_q_values_and_wildcard(header, expected):
+    body = b"x" * 4096
+    assert compress(body, header)[1] == expected
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+import redis
+
+import cmc_fetcher
+from stub_services import FakeCMCHandler, FakeRedisServer, fake_listing, start_http_stub
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    redis_server = FakeRedisServer().start()
+    cmc = start_http_stub(FakeCMCHandler, listing=fake_listing(seed=0))
+    monkeypatch.setattr(cmc_fetcher, "r", redis.Redis(port=redis_server.server_address[1]))
+    monkeypatch.setattr(cmc_fetcher, "url", f"http://127.0.0.1:{cmc.server_port}/v1/cryptocurrency/listings/latest")
+    monkeypatch.setattr(cmc_fetcher, "SNAPSHOT_SUBSCRIBE", True)
+    monkeypatch.setattr(cmc_fetcher, "RECORD_DIR", None)
+    monkeypatch.setattr(cmc_fetcher, "_snapshot", None)
+    monkeypatch.setattr(cmc_fetcher, "_subscriber_pid", None)
+    monkeypatch.setattr(cmc_fetcher, "_subscriber", None)
+    monkeypatch.setattr(cmc_fetcher, "_snapshot_hooks", [])
+    monkeypatch.setattr(cmc_fetcher, "_last_refreshed_version", None)
+    monkeypatch.setattr(cmc_fetcher, "SNAPSHOT_RECONCILE_SECONDS", 0.1)
+    yield cmc
+    thread = cmc_fetcher._subscriber[0] if cmc_fetcher._subscriber else None
+    cmc_fetcher.stop_subscriber(timeout=5)
+    assert thread is None or not thread.is_alive()
+    cmc.shutdown()
+    redis_server.shutdown()
+
+
+def test_workers_follow_published_snapshots(upstreams):
+    seen = []
+    changed = threading.Event()
+    cmc_fetcher.on_snapshot_change(lambda version, df: (seen.append(version), changed.set()))
+
+    first = cmc_fetcher.refresh_market_data()
+    cmc_fetcher.fetch_data_app()  # starts the subscriber
+    assert changed.wait(5)
+    assert cmc_fetcher.get_snapshot_version() == first
+
+    changed.clear()
+    upstreams.RequestHandlerClass.listing = fake_listing(seed=1)
+    second = cmc_fetcher.refresh_market_data()
+    assert changed.wait(5)
+    assert second != first and seen[-1] == second
+    assert cmc_fetcher.get_snapshot_version() == second
+    assert cmc_fetcher.fetch_data_app()["Last Price"].iloc[0] == fake_listing(seed=1)[0]["quote"]["USD"]["price"]
+
+
+def test_the_refresher_records_each_snapshot_once(upstreams, monkeypatch, tmp_path):
+    recorded = []
+    monkeypatch.setattr(cmc_fetcher, "RECORD_DIR", str(tmp_path))
+    monkeypatch.setattr(cmc_fetcher, "record_snapshot", lambda df, directory: recorded.append(directory))
+    changed = threading.Event()
+    cmc_fetcher.on_snapshot_change(lambda version, df: changed.set())
+
+    cmc_fetcher.refresh_market_data()
+    assert recorded == [str(tmp_path)]
+    cmc_fetcher.fetch_data_app()  # starts the subscriber, which loads the same snapshot
+    assert changed.wait(5)
+    cmc_fetcher.refresh_market_data()  # unchanged listing
+    assert recorded == [str(tmp_path)]
@@ -0,0 +1,42 @@
+import time
+
+import pytest
+import redis
+import requests
+
+from stub_services import FakeLLMHandler, FakeRedisServer, start_http_stub
+
+
+@pytest.fixture
+def client():
+    server = FakeRedisServer().start()
+    yield redis.Redis(port=server.server_address[1])
+    server.shutdown()
+
+
+def test_fake_redis_strings_expiry_and_mget(client):
+    client.set("a", b"1")
+    client.set("b", b"2", px=50)
+    assert client.mget(["a", "b", "c"]) == [b"1", b"2", None]
+    time.sleep(0.1)
+    assert client.get("b") is None
+
+
+def test_fake_redis_transactions(client):
+    pipe = client.pipeline()
+    pipe.set("CMC_DATA", b"[]")
+    pipe.set("CMC_DATA_VERSION", b"v1")
+    pipe.get("CMC_DATA_VERSION")
+    assert pipe.execute()[-1] == b"v1"
+
+
+def test_fake_llm_reports_usage():
+    server = start_http_stub(FakeLLMHandler, completion_tokens=10)
+    try:
+        response = requests.post(f"http://127.0.0.1:{server.server_port}/openai/v1/chat/completions",
+                                 json={"model": "stub", "messages": [{"role": "user", "content": "x" * 40}]})
+    finally:
+        server.shutdown()
+    body = response.json()
+    assert body["usage"] == {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+    assert "load-test stub" in body["choices"][0]["message"]["content"]